@@ -1,13 +1,37 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
-from datetime import datetime, timedelta
-from threading import Thread
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, session, jsonify
+from datetime import datetime, timedelta, timezone
+from threading import Thread, Event, Condition, Lock
+from collections import deque
 import sqlite3
 import bcrypt
 import json
 import time
 import random
 import math
+import multiprocessing
+import socket
+import atexit
+import uuid
+import numpy as np
+import price_models
+import market_hours
+import backfill
+import migrations
+import candles
+import archive
+import downsample
+import tick_store
+import tick_version
+import config_cache
+import quote_bus
+import quote_codec
+import order_book
+import triggers
+import trade_executor
+import idempotency
+import queries
+from functools import wraps
 
 app = Flask(__name__)
 
@@ -16,6 +40,10 @@ app.secret_key = 'team34' # needed for flash messages and session management
 
 DB_NAME = 'stock_trading.db'
 
+# "embedded": this process runs the price generator (only the elected leader ticks)
+# "off": never start it here; run `python generator.py` as its own process instead
+GENERATOR_MODE = os.environ.get("EQUISENSE_GENERATOR", "embedded")
+
 def init_db_wal():
     conn = sqlite3.connect(DB_NAME)
     conn.execute("PRAGMA journal_mode=WAL;")
@@ -25,6 +53,13 @@ def init_db_wal():
 init_db_wal()
 
 
+# bring the schema up to date (no-op when already at the latest version)
+migrations.migrate(DB_NAME)
+
+# new data version per process start, so ETags never outlive changes made while it was down
+tick_version.bump(DB_NAME)
+
+
 # connect to the database
 def get_db_connection():
     conn = sqlite3.connect(DB_NAME, timeout=5, check_same_thread=False)
@@ -33,6 +68,8 @@ def get_db_connection():
     conn.execute("PRAGMA busy_timeout = 5000;")
     return conn
 
+trade_executor.start(get_db_connection)
+
 
 # password hashing helpers
 def hash_password(password: str) -> str:
@@ -202,50 +239,16 @@ def dashboard(user_id):
         return redirect(url_for('login'))
 
     # ==========================================================================
-    # GET LATEST PRICES
+    # LATEST / PREVIOUS PRICES (quotes table, maintained by the generator)
     # ==========================================================================
-    latest_prices = conn.execute("""
-        SELECT ph.stock_id, ph.price AS latest_price, ph.timestamp
-        FROM price_history ph
-        JOIN (
-            SELECT stock_id, MAX(timestamp) AS max_time
-            FROM price_history
-            GROUP BY stock_id
-        ) L ON ph.stock_id = L.stock_id AND ph.timestamp = L.max_time
-    """).fetchall()
-
-    latest_map = {row['stock_id']: row['latest_price'] for row in latest_prices}
+    stocks_raw = conn.execute(queries.DASHBOARD_QUOTES_SQL).fetchall()
 
-    # ==========================================================================
-    # GET PREVIOUS PRICES (timestamp just before latest)
-    # ==========================================================================
-    previous_prices = conn.execute("""
-        SELECT ph.stock_id, ph.price AS previous_price
-        FROM price_history ph
-        JOIN (
-            SELECT ph2.stock_id, MAX(ph2.timestamp) AS prev_time
-            FROM price_history ph2
-            JOIN (
-                SELECT stock_id, MAX(timestamp) AS max_time
-                FROM price_history
-                GROUP BY stock_id
-            ) L2 ON ph2.stock_id = L2.stock_id
-            WHERE ph2.timestamp < L2.max_time
-            GROUP BY ph2.stock_id
-        ) P ON ph.stock_id = P.stock_id AND ph.timestamp = P.prev_time
-    """).fetchall()
-
-    prev_map = {row['stock_id']: row['previous_price'] for row in previous_prices}
+    latest_map = {row["stock_id"]: row["latest_price"] for row in stocks_raw}
+    prev_map = {row["stock_id"]: row["previous_price"] for row in stocks_raw}
 
     # ==========================================================================
     # BUILD AVAILABLE STOCKS
     # ==========================================================================
-    stocks_raw = conn.execute("""
-        SELECT stock_id, symbol, company_name
-        FROM stocks
-        ORDER BY symbol
-    """).fetchall()
-
     available_stocks = []
     for s in stocks_raw:
         stock_id = s["stock_id"]
@@ -262,14 +265,7 @@ def dashboard(user_id):
     # ==========================================================================
     # BUILD PORTFOLIO
     # ==========================================================================
-    raw_portfolio = conn.execute("""
-        SELECT p.stock_id, s.symbol, s.company_name,
-               p.quantity, p.avg_cost, p.total_invested
-        FROM portfolio p
-        JOIN stocks s ON p.stock_id = s.stock_id
-        WHERE p.user_id = ? AND p.quantity > 0
-        ORDER BY s.symbol
-    """, (user_id,)).fetchall()
+    raw_portfolio = conn.execute(queries.DASHBOARD_PORTFOLIO_SQL, (user_id,)).fetchall()
 
     portfolio = []
     for p in raw_portfolio:
@@ -303,47 +299,24 @@ def dashboard(user_id):
     # ==========================================================================
     # PRICE HISTORY FOR CHART
     # ==========================================================================
-    held_ids = [p["stock_id"] for p in portfolio]
-    if held_ids:
-        placeholders = ",".join("?" * len(held_ids))
-        price_rows = conn.execute(f"""
-            SELECT stock_id, price, timestamp
-            FROM price_history
-            WHERE stock_id IN ({placeholders})
-            ORDER BY timestamp ASC
-        """, held_ids).fetchall()
-    else:
-        price_rows = []
-
-    portfolio_history = {}
-    for row in price_rows:
-        sid = row["stock_id"]
-        qty = next((p["quantity"] for p in portfolio if p["stock_id"] == sid), 0)
-        if qty == 0:
-            continue
-        portfolio_history.setdefault(row["timestamp"], 0)
-        portfolio_history[row["timestamp"]] += qty * row["price"]
+    # holdings value per minute, newest EQUITY_CHART_POINTS (see record_equity_snapshots)
+    snapshot_rows = conn.execute(queries.EQUITY_CHART_SQL, (user_id, EQUITY_CHART_POINTS)).fetchall()[::-1]
 
-    chart_labels = sorted(portfolio_history.keys())
-    chart_values = [portfolio_history[t] for t in chart_labels]
+    chart_labels = [candles.to_text(row["bucket"]) for row in snapshot_rows]
+    chart_values = [row["holdings_value"] for row in snapshot_rows]
 
     # ==========================================================================
     # TRANSACTION HISTORY
     # ==========================================================================
-    total_transactions = conn.execute(
-        "SELECT COUNT(*) FROM transaction_history WHERE user_id = ?", (user_id,)
-    ).fetchone()[0]
+    total_transactions = conn.execute(queries.TRANSACTION_COUNT_SQL, (user_id,)).fetchone()[0]
 
     total_pages = (total_transactions + per_page - 1) // per_page
 
-    transaction_history = conn.execute("""
-        SELECT th.*, s.symbol
-        FROM transaction_history th
-        JOIN stocks s ON th.stock_id = s.stock_id
-        WHERE th.user_id = ?
-        ORDER BY th.timestamp DESC
-        LIMIT ? OFFSET ?
-    """, (user_id, per_page, offset)).fetchall()
+    transaction_history = conn.execute(queries.TRANSACTION_PAGE_SQL, (user_id, per_page, offset)).fetchall()
+
+    open_limit_orders = conn.execute(queries.OPEN_LIMIT_ORDERS_SQL, (user_id,)).fetchall()
+
+    open_triggers = conn.execute(queries.OPEN_TRIGGERS_SQL, (user_id,)).fetchall()
 
     conn.close()
 
@@ -363,76 +336,251 @@ def dashboard(user_id):
         profit_pct=profit_pct,
         chart_labels=chart_labels,
         chart_values=chart_values,
+        open_limit_orders=open_limit_orders,
+        open_triggers=open_triggers,
     )
 
 
 
 
 # ----- API: Live stock prices -----
+def etag_by_tick_version(per_minute=False, variant=None):
+    """
+    Decorator for read-only APIs whose answer only changes with the tick version
+    (see tick_version.py). Sends an ETag and answers If-None-Match with 304 Not
+    Modified before the view runs, so unchanged polls skip the DB and the JSON.
+
+    :param per_minute: also change the ETag every minute (time-dependent answers)
+    :param variant: optional callable returning what else the answer depends on
+                    in the request (e.g. its format); it becomes part of the ETag
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = str(tick_version.read(DB_NAME))
+            if per_minute:
+                etag += f"-{int(time.time() // 60)}"
+            if variant is not None:
+                etag += f"-{variant()}"
+            if etag in request.if_none_match:
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "no-cache"  # always revalidate
+            return response
+        return wrapper
+    return decorator
+
+
+# /api/prices formats: see quote_codec.py. ?format=objects|columnar|binary (or
+# the Accept header), and ?since=<version> for just the quotes changed since
+# an earlier columnar/binary response.
+def api_prices_variant():
+    """The negotiated format and the since version: one ETag per distinct /api/prices body."""
+    fmt = quote_codec.negotiate(request.args.get("format"), request.headers.get("Accept"))
+    return f"{fmt}-{request.args.get('since', type=int)}"
+
 @app.route("/api/prices")
+@etag_by_tick_version(variant=api_prices_variant)
 def api_prices():
-    conn = get_db_connection()
-    stocks = conn.execute('''
-        WITH latest_prices AS (
-            SELECT ph1.stock_id, ph1.price,
-                   ROW_NUMBER() OVER (PARTITION BY ph1.stock_id ORDER BY ph1.id DESC) AS rn
-            FROM price_history ph1
-        )
-        SELECT s.stock_id, s.symbol, s.company_name, s.price,
-               (lp1.price - lp2.price) AS last_change
-        FROM stocks s
-        LEFT JOIN latest_prices lp1 ON s.stock_id = lp1.stock_id AND lp1.rn = 1
-        LEFT JOIN latest_prices lp2 ON s.stock_id = lp2.stock_id AND lp2.rn = 2
-        ORDER BY s.symbol
-    ''').fetchall()
-    conn.close()
+    fmt = quote_codec.negotiate(request.args.get("format"), request.headers.get("Accept"))
+    since = request.args.get("since", type=int)
+    if fmt is None:
+        return jsonify({"error": "format must be one of " + ", ".join(quote_codec.FORMATS)}), 400
+
+    # served from this process's quote map; touches the DB only after a tick
+    quote_bus.refresh(DB_NAME, get_db_connection)
+    version, full, quotes = quote_bus.quotes_since(since if fmt != "objects" else None)
+
+    # full snapshots are encoded once per version and format, whatever the client count
+    if full:
+        cached = quote_payload_cache.get(fmt)
+        if cached is None or cached[0] != version:
+            cached = quote_payload_cache[fmt] = (version, quote_codec.encode(fmt, quotes, version))
+        body = cached[1]
+    else:
+        body = quote_codec.encode(fmt, quotes, version, full=False)
+    response = app.response_class(body, mimetype=quote_codec.MIME_TYPES[fmt])
+    response.vary.add("Accept")
+    return response
 
-    return jsonify([
-        {
-            "stock_id": s["stock_id"],
-            "symbol": s["symbol"],
-            "company_name": s["company_name"],
-            "price": s["price"],
-            "last_change": s["last_change"] or 0
-        }
-        for s in stocks
-    ])
+# format -> (version, last full /api/prices body in that format)
+quote_payload_cache = {}
 
 
-    return jsonify([
-        {
-            "stock_id": s["stock_id"],
-            "symbol": s["symbol"],
-            "company_name": s["company_name"],
-            "price": s["price"],
-            "last_change": s["last_change"] or 0
-        }
-        for s in stocks
-    ])
+def parse_time_param(value):
+    """
+    Parses a time query parameter: unix seconds, or a UTC date/datetime
+    ("YYYY-MM-DD" or "YYYY-MM-DD HH:MM:SS"). Returns unix seconds or None.
+    """
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    if len(value) == 10:
+        value += " 00:00:00"
+    return candles.to_epoch(value.replace("T", " "))
 
 
 #Price history API, used for stock chart
+#  ?resolution=raw|1m|5m|1h|1d|<seconds>|auto  (default raw ticks)
+#  ?start=...&end=...                           (optional range, see parse_time_param)
+#  ?max_points=N&downsample=lttb|minmax         (optional cap on returned points)
+#  ?since_ts=...&since_id=...                   (raw only: just the ticks after a cursor)
+# Raw responses include "cursor" ({"since_ts", "since_id"}) to pass on the next poll.
 @app.route('/api/price_history/<int:stock_id>')
+@etag_by_tick_version()
 def api_price_history(stock_id):
+    try:
+        start = parse_time_param(request.args.get('start'))
+        end = parse_time_param(request.args.get('end'))
+        resolution = candles.choose_resolution(request.args.get('resolution'), start, end)
+        since_ts = request.args.get('since_ts') or None
+        since_id = request.args.get('since_id', type=int)
+        if since_ts:
+            candles.to_epoch(since_ts)
+    except ValueError:
+        return jsonify({"error": "Invalid resolution or time range"}), 400
+    if (since_ts or since_id is not None) and resolution is not None:
+        return jsonify({"error": "since_ts/since_id only apply to raw ticks"}), 400
+
+    max_points = request.args.get('max_points', type=int)
+    method = request.args.get('downsample', 'lttb')
+    if (max_points is not None and max_points < 4) or method not in downsample.METHODS:
+        return jsonify({"error": "max_points must be at least 4 and downsample one of "
+                                 + ", ".join(downsample.METHODS)}), 400
+
     conn = get_db_connection()
-    # Get all price history entries for the stock, oldest first
-    rows = conn.execute('''
-        SELECT price, timestamp
-        FROM price_history
-        WHERE stock_id = ?
-        ORDER BY timestamp ASC
-    ''', (stock_id,)).fetchall()
+
+    if resolution is None and tick_store.enabled():
+        conn.close()
+        # since_id is a row number in the stock's tick files
+        if since_ts and since_id is None:
+            start = max(start or 0, candles.to_epoch(since_ts) + 1)
+        first, ts, px = tick_store.read_range(stock_id, start, end, after_row=since_id)
+        count = len(ts)
+        data = {
+            "stock_id": stock_id,
+            "resolution": "raw",
+            "timestamps": [candles.to_text(epoch) for epoch in ts.tolist()],
+            "prices": px.tolist(),
+            "cursor": {
+                "since_ts": candles.to_text(int(ts[-1])) if count else since_ts or "",
+                "since_id": first + count - 1 if count else (since_id if since_id is not None else first - 1),
+            },
+        }
+        return jsonify(downsample_history(data, max_points, method))
+
+    if resolution is None:
+        start_ts = candles.to_text(start) if start is not None else ""
+        end_ts = candles.to_text(end) if end is not None else "9999"
+
+        # Ticks older than the retention window live in the compressed archive;
+        # hot rows at or before the newest archived one are already in there.
+        # Rows are read after a (timestamp, id) position: that floor, or the
+        # caller's cursor if it is further along.
+        floor = archive.hot_floor(conn, stock_id)
+        if since_ts or since_id is not None:
+            if not since_ts:
+                row = conn.execute(queries.HISTORY_CURSOR_SQL, (since_id, stock_id)).fetchone()
+                if row is None:
+                    conn.close()
+                    return jsonify({"error": "Unknown since_id, pass since_ts as well"}), 400
+                since_ts = row["timestamp"]
+            # a timestamp-only cursor means strictly after that second
+            cursor = (since_ts, since_id if since_id is not None else 2 ** 62)
+            floor = max(floor, cursor)
+            archived = []
+        else:
+            archived = archive.read_history(conn, stock_id, start_ts, end_ts)
+        floor_ts, floor_id = floor
+        rows = conn.execute(
+            queries.HISTORY_RANGE_SQL, (stock_id, max(start_ts, floor_ts), end_ts, floor_ts, floor_id)
+        ).fetchall()
+        conn.close()
+
+        # next cursor: the newest tick returned (largest id within its second)
+        if rows:
+            last_ts = rows[-1]["timestamp"]
+            last_id = max(row["id"] for row in rows if row["timestamp"] == last_ts)
+        elif archived:
+            last_ts, last_id = archived[-1][0], floor_id
+        else:
+            last_ts, last_id = floor_ts, floor_id
+
+        # Convert to JSON-friendly format
+        data = {
+            "stock_id": stock_id,
+            "resolution": "raw",
+            "timestamps": [ts for ts, _ in archived] + [row["timestamp"] for row in rows],
+            "prices": [price for _, price in archived] + [row["price"] for row in rows],
+            "cursor": {"since_ts": last_ts, "since_id": min(last_id, 2 ** 53)},
+        }
+        return jsonify(downsample_history(data, max_points, method))
+
+    # Candles: "prices" holds the close so the chart can plot either shape
+    rows = candles.fetch_candles(conn, stock_id, resolution, start, end)
     conn.close()
 
-    # Convert to JSON-friendly format
     data = {
         "stock_id": stock_id,
-        "timestamps": [row["timestamp"] for row in rows],
-        "prices": [row["price"] for row in rows]
+        "resolution": resolution,
+        "timestamps": [candles.to_text(row["bucket"]) for row in rows],
+        "prices": [row["close"] for row in rows],
+        "open": [row["open"] for row in rows],
+        "high": [row["high"] for row in rows],
+        "low": [row["low"] for row in rows],
     }
+    return jsonify(downsample_history(data, max_points, method))
+
+
+def downsample_history(data, max_points, method):
+    """Cuts every series of a price history response down to at most max_points points."""
+    if not max_points or len(data["prices"]) <= max_points:
+        return data
+    keep = downsample.downsample_indices(data["timestamps"], data["prices"], max_points, method).tolist()
+    for key in ("timestamps", "prices", "open", "high", "low"):
+        if key in data:
+            series = data[key]
+            data[key] = [series[i] for i in keep]
+    data["downsampled_from"] = len(series)
+    return data
+
+
+
+def execute_cash(conn, user_id, action, amount):
+    """Deposits or withdraws cash. Runs as a trade writer job."""
+    if action == 'deposit':
+        user = conn.execute('''
+            UPDATE users
+            SET balance = balance + ?, total_deposited = total_deposited + ?
+            WHERE user_id = ?
+            RETURNING balance, total_deposited, total_withdrawn
+        ''', (amount, amount, user_id)).fetchone()
+        msg = f"User {user_id} deposited ${amount:.2f}."
+        log_type = 10  # deposit event
+    elif action == 'withdraw':
+        user = conn.execute('''
+            UPDATE users
+            SET balance = balance - ?, total_withdrawn = total_withdrawn + ?
+            WHERE user_id = ? AND balance >= ?
+            RETURNING balance, total_deposited, total_withdrawn
+        ''', (amount, amount, user_id, amount)).fetchone()
+        if user is None and conn.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,)).fetchone():
+            raise TradeRejected("Insufficient funds.", "insufficient funds")
+        msg = f"User {user_id} withdrew ${amount:.2f}."
+        log_type = 11  # withdrawal event
+    else:
+        raise TradeRejected("Invalid action.", "invalid action")
 
-    return jsonify(data)
-
+    if user is None:
+        raise TradeRejected("User not found.", "user not found")
+    insert_log(conn, log_type, msg, user_id=user_id)
+    return {"action": action, "amount": amount, "balance": user['balance'],
+            "total_deposited": user['total_deposited'], "total_withdrawn": user['total_withdrawn']}
 
 
 @app.route('/depositwithdraw/<int:user_id>', methods=['POST'])
@@ -450,71 +598,169 @@ def depositwithdraw(user_id):
         flash("Amount must be greater than zero.", "error")
         return redirect(url_for('dashboard', user_id=user_id))
 
-    conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
+    try:
+        trade_executor.submit(execute_cash, user_id, action, amount)
+    except TradeRejected as e:
+        flash(str(e), "error")
+        return redirect(url_for('dashboard', user_id=user_id))
 
-    user = conn.execute(
-        'SELECT balance, total_deposited, total_withdrawn FROM users WHERE user_id = ?',
-        (user_id,)
-    ).fetchone()
+    flash(f"Deposited ${amount:.2f}." if action == 'deposit' else f"Withdrew ${amount:.2f}.", "success")
+    return redirect(url_for('dashboard', user_id=user_id))
 
-    if not user:
-        conn.close()
-        flash("User not found.", "error")
-        return redirect(url_for('login'))
 
-    balance = user['balance']
-    total_deposited = user['total_deposited']
-    total_withdrawn = user['total_withdrawn']
+class TradeRejected(Exception):
+    """A trade refused for a business reason. The message is shown to the user."""
 
-    try:
-        if action == 'deposit':
-            new_balance = balance + amount
-            new_total_deposited = total_deposited + amount
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason  # for the audit log
 
-            conn.execute('''
-                UPDATE users
-                SET balance = ?, total_deposited = ?
-                WHERE user_id = ?
-            ''', (new_balance, new_total_deposited, user_id))
+# Trades run as jobs on the trade writer (trade_executor.py): many trades share
+# one transaction and commit, and a job that raises is rolled back on its own.
 
-            msg = f"User {user_id} deposited ${amount:.2f}."
-            log_type = 10  # deposit event
-            flash(f"Deposited ${amount:.2f}.", "success")
+# Trades use guarded statements: the balance or share check is the WHERE clause
+# of the UPDATE itself and RETURNING hands back the new values, so a check can
+# never be passed on a stale read.
 
-        elif action == 'withdraw':
-            if balance < amount:
-                conn.close()
-                flash("Insufficient funds.", "error")
-                return redirect(url_for('dashboard', user_id=user_id))
+# params: (user_id, stock_id, quantity, price, total_cost)
+ADD_TO_POSITION_SQL = '''
+    INSERT INTO portfolio (user_id, stock_id, quantity, avg_cost, total_invested, last_updated)
+    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT (user_id, stock_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        total_invested = total_invested + excluded.total_invested,
+        avg_cost = (total_invested + excluded.total_invested) / (quantity + excluded.quantity),
+        last_updated = excluded.last_updated
+'''
 
-            new_balance = balance - amount
-            new_total_withdrawn = total_withdrawn + amount
+def add_to_position(conn, user_id, stock_id, quantity, total_cost):
+    """
+    Adds shares bought for total_cost to the user's position (creating it).
 
-            conn.execute('''
-                UPDATE users
-                SET balance = ?, total_withdrawn = ?
-                WHERE user_id = ?
-            ''', (new_balance, new_total_withdrawn, user_id))
+    :return: the position row (quantity, avg_cost, total_invested) after the buy
+    """
+    return conn.execute(
+        ADD_TO_POSITION_SQL + " RETURNING quantity, avg_cost, total_invested",
+        (user_id, stock_id, quantity, total_cost / quantity, total_cost)
+    ).fetchone()
 
-            msg = f"User {user_id} withdrew ${amount:.2f}."
-            log_type = 11  # withdrawal event
-            flash(f"Withdrew ${amount:.2f}.", "success")
+def take_from_position(conn, user_id, stock_id, quantity):
+    """
+    Removes shares from the user's position if it holds at least `quantity`,
+    deleting it once empty.
 
-        else:
-            conn.close()
-            flash("Invalid action.", "error")
-            return redirect(url_for('dashboard', user_id=user_id))
+    :return: the position row (quantity, avg_cost, total_invested) after the
+             sale, or None if there were not enough shares
+    """
+    position = conn.execute('''
+        UPDATE portfolio
+        SET quantity = quantity - ?,
+            total_invested = total_invested - ? * avg_cost,
+            last_updated = CURRENT_TIMESTAMP
+        WHERE user_id = ? AND stock_id = ? AND quantity >= ?
+        RETURNING quantity, avg_cost, total_invested
+    ''', (quantity, quantity, user_id, stock_id, quantity)).fetchone()
+    if position is not None and position['quantity'] == 0:
+        conn.execute('DELETE FROM portfolio WHERE user_id = ? AND stock_id = ?', (user_id, stock_id))
+    return position
+
+def position_summary(position):
+    """A position row as the JSON API returns it (None once sold out)."""
+    if position is None or position['quantity'] == 0:
+        return None
+    return {"quantity": position['quantity'], "avg_cost": position['avg_cost'],
+            "total_invested": position['total_invested']}
 
-        conn.commit()
-    finally:
-        conn.close()
+def execute_buy(conn, user_id, stock_id, quantity):
+    """Buys at the current price. Runs as a trade writer job."""
+    stock = conn.execute('SELECT symbol, price FROM stocks WHERE stock_id = ?', (stock_id,)).fetchone()
+    if not stock:
+        raise TradeRejected("User or stock not found.", "user or stock not found")
+
+    total_cost = quantity * stock['price']
+    user = conn.execute('''
+        UPDATE users SET balance = balance - ?
+        WHERE user_id = ? AND balance >= ?
+        RETURNING balance + ? AS cash_before, balance AS cash_after
+    ''', (total_cost, user_id, total_cost, total_cost)).fetchone()
+    if user is None:
+        balance = conn.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        if balance is None:
+            raise TradeRejected("User or stock not found.", "user or stock not found")
+        raise TradeRejected(
+            f"Insufficient funds. Need ${total_cost:.2f}, have ${balance[0]:.2f}",
+            f"insufficient funds (needed {total_cost}, had {balance[0]})"
+        )
+    new_balance = user['cash_after']
 
-    log_event(log_type, msg, user_id=user_id)
+    position = add_to_position(conn, user_id, stock_id, quantity, total_cost)
 
-    return redirect(url_for('dashboard', user_id=user_id))
+    conn.execute('''
+        INSERT INTO orders (user_id, stock_id, order_type, quantity, price, cash_after)
+        VALUES (?, ?, 'BUY', ?, ?, ?)
+    ''', (user_id, stock_id, quantity, stock['price'], new_balance))
 
+    conn.execute('''
+        INSERT INTO transaction_history 
+        (user_id, stock_id, order_type, quantity, price, total_value, cash_before, cash_after, realized_pl)
+        VALUES (?, ?, 'BUY', ?, ?, ?, ?, ?, 0.0)
+    ''', (user_id, stock_id, quantity, stock['price'], total_cost, user['cash_before'], new_balance))
 
+    record_equity_snapshots(conn, datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"), user_id)
+    insert_log(
+        conn, 30, #buy success
+        f"Buy success: user {user_id} bought {quantity} shares of {stock['symbol']} at ${stock['price']:.2f} (total {total_cost:.2f}).",
+        user_id=user_id
+    )
+    return {"stock_id": stock_id, "symbol": stock['symbol'], "side": "BUY", "quantity": quantity,
+            "price": stock['price'], "total": total_cost, "realized_pl": 0.0,
+            "balance": new_balance, "position": position_summary(position)}
+
+def execute_sell(conn, user_id, stock_id, quantity):
+    """Sells at the current price. Runs as a trade writer job."""
+    stock = conn.execute('SELECT symbol, price FROM stocks WHERE stock_id = ?', (stock_id,)).fetchone()
+    position = take_from_position(conn, user_id, stock_id, quantity) if stock else None
+    if position is None:
+        position = conn.execute(queries.POSITION_QUANTITY_SQL, (user_id, stock_id)).fetchone()
+        if not stock or not position:
+            raise TradeRejected("User, stock, or position not found.", "user/stock/position missing")
+        raise TradeRejected(
+            f"Insufficient shares. Have {position['quantity']}, trying to sell {quantity}",
+            f"insufficient shares (had {position['quantity']}, wanted {quantity})"
+        )
+
+    total_value = quantity * stock['price']
+    realized_pl = total_value - quantity * position['avg_cost']
+
+    user = conn.execute('''
+        UPDATE users SET balance = balance + ?
+        WHERE user_id = ?
+        RETURNING balance - ? AS cash_before, balance AS cash_after
+    ''', (total_value, user_id, total_value)).fetchone()
+    if user is None:
+        raise TradeRejected("User, stock, or position not found.", "user/stock/position missing")
+    new_balance = user['cash_after']
+
+    conn.execute('''
+        INSERT INTO orders (user_id, stock_id, order_type, quantity, price, cash_after, realized_pl)
+        VALUES (?, ?, 'SELL', ?, ?, ?, ?)
+    ''', (user_id, stock_id, quantity, stock['price'], new_balance, realized_pl))
+
+    conn.execute('''
+        INSERT INTO transaction_history 
+        (user_id, stock_id, order_type, quantity, price, total_value, cash_before, cash_after, realized_pl)
+        VALUES (?, ?, 'SELL', ?, ?, ?, ?, ?, ?)
+    ''', (user_id, stock_id, quantity, stock['price'], total_value, user['cash_before'], new_balance, realized_pl))
+
+    record_equity_snapshots(conn, datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"), user_id)
+    insert_log(
+        conn, 32, #sell success
+        f"Sell success: user {user_id} sold {quantity} shares of {stock['symbol']} at ${stock['price']:.2f} (value {total_value:.2f}, P/L {realized_pl:.2f}).",
+        user_id=user_id
+    )
+    return {"stock_id": stock_id, "symbol": stock['symbol'], "side": "SELL", "quantity": quantity,
+            "price": stock['price'], "total": total_value, "realized_pl": realized_pl,
+            "balance": new_balance, "position": position_summary(position)}
 
 
 # buy stock function
@@ -550,82 +796,18 @@ def buy_stock(user_id):
         )
 
         return redirect(url_for('dashboard', user_id=user_id))
-    
-    conn = get_db_connection()
-    
-    try:
-        user = conn.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)).fetchone()
-        stock = conn.execute('SELECT * FROM stocks WHERE stock_id = ?', (stock_id,)).fetchone()
-        
-        if not user or not stock:
-            flash("User or stock not found.", "error")
-            log_event(
-                31, #buy failure
-                f"Buy failed for user {user_id}: user or stock not found.",
-                user_id=user_id
-            )
 
-            return redirect(url_for('dashboard', user_id=user_id))
-        
-        total_cost = quantity * stock['price']
-        
-        if user['balance'] < total_cost:
-            flash(f"Insufficient funds. Need ${total_cost:.2f}, have ${user['balance']:.2f}", "error")
-            log_event(
-                31, #buy failure
-                f"Buy failed for user {user_id}: insufficient funds (needed {total_cost}, had {user['balance']}).",
-                user_id=user_id
-            )
-
-            return redirect(url_for('dashboard', user_id=user_id))
-        
-        # update user balance
-        new_balance = user['balance'] - total_cost
-        conn.execute('UPDATE users SET balance = ? WHERE user_id = ?', (new_balance, user_id))
-        
-        existing_position = conn.execute(
-            'SELECT * FROM portfolio WHERE user_id = ? AND stock_id = ?', 
-            (user_id, stock_id)
-        ).fetchone()
-        
-        if existing_position:
-            new_quantity = existing_position['quantity'] + quantity
-            new_total_invested = existing_position['total_invested'] + total_cost
-            new_avg_cost = new_total_invested / new_quantity
-            
-            conn.execute('''
-                UPDATE portfolio 
-                SET quantity = ?, avg_cost = ?, total_invested = ?, last_updated = CURRENT_TIMESTAMP
-                WHERE user_id = ? AND stock_id = ?
-            ''', (new_quantity, new_avg_cost, new_total_invested, user_id, stock_id))
-        else:
-            conn.execute('''
-                INSERT INTO portfolio (user_id, stock_id, quantity, avg_cost, total_invested, last_updated)
-                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (user_id, stock_id, quantity, stock['price'], total_cost))
-        
-        conn.execute('''
-            INSERT INTO orders (user_id, stock_id, order_type, quantity, price, cash_after)
-            VALUES (?, ?, 'BUY', ?, ?, ?)
-        ''', (user_id, stock_id, quantity, stock['price'], new_balance))
-        
-        conn.execute('''
-            INSERT INTO transaction_history 
-            (user_id, stock_id, order_type, quantity, price, total_value, cash_before, cash_after, realized_pl)
-            VALUES (?, ?, 'BUY', ?, ?, ?, ?, ?, 0.0)
-        ''', (user_id, stock_id, quantity, stock['price'], total_cost, user['balance'], new_balance))
-        
-        conn.commit()
+    try:
+        trade = trade_executor.submit(execute_buy, user_id, stock_id, quantity)
+        flash(f"Successfully bought {quantity} shares of {trade['symbol']} for ${trade['total']:.2f}", "success")
+    except TradeRejected as e:
+        flash(str(e), "error")
         log_event(
-            30, #buy success
-            f"Buy success: user {user_id} bought {quantity} shares of {stock['symbol']} at ${stock['price']:.2f} (total {total_cost:.2f}).",
+            31, #buy failure
+            f"Buy failed for user {user_id}: {e.reason}.",
             user_id=user_id
         )
-
-        flash(f"Successfully bought {quantity} shares of {stock['symbol']} for ${total_cost:.2f}", "success")
-        
     except Exception as e:
-        conn.rollback()
         log_event(
             31, #buy failure
             f"Buy failed for user {user_id}: exception '{str(e)}'.",
@@ -633,8 +815,6 @@ def buy_stock(user_id):
         )
 
         flash(f"Error buying stock: {str(e)}", "error")
-    finally:
-        conn.close()
     
     return redirect(url_for('dashboard', user_id=user_id))
 
@@ -672,81 +852,19 @@ def sell_stock(user_id):
         )
 
         return redirect(url_for('dashboard', user_id=user_id))
-    
-    conn = get_db_connection()
-    
-    try:
-        user = conn.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)).fetchone()
-        stock = conn.execute('SELECT * FROM stocks WHERE stock_id = ?', (stock_id,)).fetchone()
-        position = conn.execute(
-            'SELECT * FROM portfolio WHERE user_id = ? AND stock_id = ?', 
-            (user_id, stock_id)
-        ).fetchone()
-        
-        if not user or not stock or not position:
-            flash("User, stock, or position not found.", "error")
-            log_event(
-                33, #sell failure
-                f"Sell failed for user {user_id}: user/stock/position missing.",
-                user_id=user_id
-            )
-
-            return redirect(url_for('dashboard', user_id=user_id))
-        
-        if position['quantity'] < quantity:
-            flash(f"Insufficient shares. Have {position['quantity']}, trying to sell {quantity}", "error")
 
-            log_event(
-                33, #sell failure
-                f"Sell failed for user {user_id}: insufficient shares (had {position['quantity']}, wanted {quantity}).",
-                user_id=user_id
-            )
-
-            return redirect(url_for('dashboard', user_id=user_id))
-        
-        total_value = quantity * stock['price']
-        new_balance = user['balance'] + total_value
-        
-        cost_basis = quantity * position['avg_cost']
-        realized_pl = total_value - cost_basis
-        
-        conn.execute('UPDATE users SET balance = ? WHERE user_id = ?', (new_balance, user_id))
-        
-        new_quantity = position['quantity'] - quantity
-        if new_quantity > 0:
-            new_total_invested = position['total_invested'] - cost_basis
-            conn.execute('''
-                UPDATE portfolio 
-                SET quantity = ?, total_invested = ?, last_updated = CURRENT_TIMESTAMP
-                WHERE user_id = ? AND stock_id = ?
-            ''', (new_quantity, new_total_invested, user_id, stock_id))
-        else:
-            conn.execute('DELETE FROM portfolio WHERE user_id = ? AND stock_id = ?', (user_id, stock_id))
-        
-        conn.execute('''
-            INSERT INTO orders (user_id, stock_id, order_type, quantity, price, cash_after, realized_pl)
-            VALUES (?, ?, 'SELL', ?, ?, ?, ?)
-        ''', (user_id, stock_id, quantity, stock['price'], new_balance, realized_pl))
-        
-        conn.execute('''
-            INSERT INTO transaction_history 
-            (user_id, stock_id, order_type, quantity, price, total_value, cash_before, cash_after, realized_pl)
-            VALUES (?, ?, 'SELL', ?, ?, ?, ?, ?, ?)
-        ''', (user_id, stock_id, quantity, stock['price'], total_value, user['balance'], new_balance, realized_pl))
-        
-        conn.commit()
+    try:
+        trade = trade_executor.submit(execute_sell, user_id, stock_id, quantity)
+        pl_text = f" (P/L: ${trade['realized_pl']:.2f})" if trade['realized_pl'] != 0 else ""
+        flash(f"Successfully sold {quantity} shares of {trade['symbol']} for ${trade['total']:.2f}{pl_text}", "success")
+    except TradeRejected as e:
+        flash(str(e), "error")
         log_event(
-            32, #sell success
-            f"Sell success: user {user_id} sold {quantity} shares of {stock['symbol']} at ${stock['price']:.2f} (value {total_value:.2f}, P/L {realized_pl:.2f}).",
+            33, #sell failure
+            f"Sell failed for user {user_id}: {e.reason}.",
             user_id=user_id
         )
-
-        pl_text = f" (P/L: ${realized_pl:.2f})" if realized_pl != 0 else ""
-        flash(f"Successfully sold {quantity} shares of {stock['symbol']} for ${total_value:.2f}{pl_text}", "success")
-        
     except Exception as e:
-        conn.rollback()
-
         log_event(
             33, #sell failure
             f"Sell failed for user {user_id}: exception '{str(e)}'.",
@@ -754,13 +872,572 @@ def sell_stock(user_id):
         )
 
         flash(f"Error selling stock: {str(e)}", "error")
-    finally:
-        conn.close()
     
     return redirect(url_for('dashboard', user_id=user_id))
 
 
 
+# ----- JSON trading API -----
+# Answers with the fill, the new balance and the position instead of
+# redirecting to the dashboard. Requests may carry an Idempotency-Key header
+# (see idempotency.py) so a retried request is not executed twice.
+
+def idempotent_response(endpoint, payload, fn, *args, failure_type=None):
+    """
+    Runs fn(conn, user_id, *args) as a trade writer job for the logged-in
+    user, at most once per Idempotency-Key if the request has one, and
+    builds the JSON response.
+
+    :param payload: the validated request body a retry must repeat
+    :param failure_type: log event type for rejected requests
+    """
+    user_id = session['user_id']
+    key = request.headers.get("Idempotency-Key")
+    if key is not None and not 0 < len(key) <= idempotency.MAX_KEY_LENGTH:
+        return jsonify({"error": f"Idempotency-Key must be 1 to {idempotency.MAX_KEY_LENGTH} characters"}), 400
+    try:
+        if key is None:
+            result, replayed = trade_executor.submit(fn, user_id, *args), False
+        else:
+            result, replayed = trade_executor.submit(idempotency.run, user_id, key, endpoint, payload,
+                                                     fn, user_id, *args)
+    except idempotency.KeyReused as e:
+        return jsonify({"error": str(e)}), 422
+    except TradeRejected as e:
+        if failure_type is not None:
+            log_event(failure_type, f"{endpoint} failed for user {user_id}: {e.reason}.", user_id=user_id)
+        return jsonify({"error": str(e)}), 409
+
+    response = jsonify(result)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+def market_order_job(side, market_status):
+    """Trade writer job for a JSON market order; refuses it while the market is closed."""
+    execute = execute_buy if side == "BUY" else execute_sell
+
+    def job(conn, user_id, stock_id, quantity):
+        if market_status.get("status") != "open":
+            raise TradeRejected(f"Market is closed: {market_status.get('reason')}",
+                                f"market closed ({market_status.get('reason')})")
+        return execute(conn, user_id, stock_id, quantity)
+    return job
+
+def api_market_order(side):
+    if 'user_id' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    body = request.get_json(silent=True) or {}
+    stock_id, quantity = body.get("stock_id"), body.get("quantity")
+    if not valid_order_leg({"stock_id": stock_id, "side": side, "quantity": quantity}):
+        return jsonify({"error": "stock_id and a positive integer quantity are required"}), 400
+
+    return idempotent_response(
+        f"{side.lower()} order", {"stock_id": stock_id, "quantity": quantity},
+        market_order_job(side, get_market_status()), stock_id, quantity,
+        failure_type=31 if side == "BUY" else 33
+    )
+
+@app.route("/api/orders/buy", methods=["POST"])
+def api_buy():
+    """Buys at the current price. Body: {"stock_id": 1, "quantity": 5}"""
+    return api_market_order("BUY")
+
+@app.route("/api/orders/sell", methods=["POST"])
+def api_sell():
+    """Sells at the current price. Body: {"stock_id": 1, "quantity": 5}"""
+    return api_market_order("SELL")
+
+@app.route("/api/account/cash", methods=["POST"])
+def api_cash():
+    """Deposits or withdraws. Body: {"action": "deposit" or "withdraw", "amount": 100.0}"""
+    if 'user_id' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    body = request.get_json(silent=True) or {}
+    action, amount = body.get("action"), body.get("amount")
+    if (action not in ("deposit", "withdraw") or isinstance(amount, bool)
+            or not isinstance(amount, (int, float)) or not amount > 0):
+        return jsonify({"error": "action must be deposit or withdraw and amount greater than zero"}), 400
+
+    return idempotent_response("cash", {"action": action, "amount": amount},
+                               execute_cash, action, float(amount))
+
+
+
+# ----- batch orders -----
+
+ORDER_BATCH_MAX_LEGS = 100
+
+def execute_order_batch(conn, user_id, legs, all_or_nothing):
+    """
+    Validates and applies a list of market order legs together. Runs as one
+    trade writer job.
+
+    Prices, the balance and the positions are read once. Sell legs are
+    checked first (in the order given) so their proceeds can fund the buy
+    legs, then buy legs; cash and shares are tracked across legs. If
+    all_or_nothing is set, any rejected leg rejects the whole batch.
+    Accepted legs are written with executemany.
+
+    :param legs: list of {"stock_id", "side", "quantity"} dicts
+    :return: (cash after, per-leg result dicts in request order)
+    """
+    stock_ids = sorted({leg["stock_id"] for leg in legs if isinstance(leg.get("stock_id"), int)})
+    marks = ",".join("?" * len(stock_ids))
+    stocks = {row["stock_id"]: row for row in conn.execute(
+        f"SELECT stock_id, symbol, price FROM stocks WHERE stock_id IN ({marks})", stock_ids
+    )}
+    positions = {row["stock_id"]: [row["quantity"], row["avg_cost"]] for row in conn.execute(
+        f"SELECT stock_id, quantity, avg_cost FROM portfolio WHERE user_id = ? AND stock_id IN ({marks})",
+        [user_id] + stock_ids
+    )}
+    user = conn.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    if user is None:
+        raise TradeRejected("User not found.", "user not found")
+    cash = user["balance"]
+
+    results = [None] * len(legs)
+    order = sorted(range(len(legs)), key=lambda i: legs[i].get("side") != "SELL")
+    for i in order:
+        leg = legs[i]
+        side, quantity, stock = leg.get("side"), leg.get("quantity"), stocks.get(leg.get("stock_id"))
+        result = {"index": i, "stock_id": leg.get("stock_id"), "side": side, "quantity": quantity}
+        results[i] = result
+        if side not in ("BUY", "SELL") or not isinstance(quantity, int) or quantity <= 0:
+            result.update(status="rejected", error="side must be BUY or SELL and quantity a positive integer")
+            continue
+        if stock is None:
+            result.update(status="rejected", error="stock not found")
+            continue
+        total = quantity * stock["price"]
+        position = positions.setdefault(stock["stock_id"], [0, stock["price"]])
+        if side == "SELL" and position[0] < quantity:
+            result.update(status="rejected", error=f"insufficient shares (have {position[0]})")
+            continue
+        if side == "BUY" and cash < total:
+            result.update(status="rejected", error=f"insufficient funds (need {total:.2f}, have {cash:.2f})")
+            continue
+
+        cash_before = cash
+        if side == "SELL":
+            position[0] -= quantity
+            realized_pl = total - quantity * position[1]
+            cash += total
+        else:
+            position[1] = (position[0] * position[1] + total) / (position[0] + quantity)
+            position[0] += quantity
+            realized_pl = 0.0
+            cash -= total
+        result.update(status="filled", symbol=stock["symbol"], price=stock["price"], total=total,
+                      realized_pl=realized_pl, cash_before=cash_before, cash_after=cash)
+
+    filled = [r for r in results if r["status"] == "filled"]
+    if all_or_nothing and len(filled) < len(results):
+        for r in filled:
+            r.update(status="rejected", error="another leg was rejected")
+        filled = []
+
+    # legs are written in the order they were checked, so the cash_before/after
+    # columns of the ledger chain up
+    rank = {i: k for k, i in enumerate(order)}
+    filled.sort(key=lambda r: rank[r["index"]])
+    sells = [r for r in filled if r["side"] == "SELL"]
+    buys = [r for r in filled if r["side"] == "BUY"]
+    if filled:
+        taken = conn.executemany('''
+            UPDATE portfolio
+            SET quantity = quantity - ?,
+                total_invested = total_invested - ? * avg_cost,
+                last_updated = CURRENT_TIMESTAMP
+            WHERE user_id = ? AND stock_id = ? AND quantity >= ?
+        ''', [(r["quantity"], r["quantity"], user_id, r["stock_id"], r["quantity"]) for r in sells]).rowcount
+        if sells and taken != len(sells):
+            raise TradeRejected("Positions changed while the batch was checked.", "positions changed")
+        conn.execute("DELETE FROM portfolio WHERE user_id = ? AND quantity <= 0", (user_id,))
+        conn.executemany(ADD_TO_POSITION_SQL, [
+            (user_id, r["stock_id"], r["quantity"], r["price"], r["total"]) for r in buys
+        ])
+        if conn.execute('''
+            UPDATE users SET balance = balance + ?
+            WHERE user_id = ? AND balance + ? >= 0
+            RETURNING balance
+        ''', (cash - user["balance"], user_id, cash - user["balance"])).fetchone() is None:
+            raise TradeRejected("Insufficient funds.", "balance changed")
+        conn.executemany('''
+            INSERT INTO orders (user_id, stock_id, order_type, quantity, price, cash_after, realized_pl)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(user_id, r["stock_id"], r["side"], r["quantity"], r["price"], r["cash_after"], r["realized_pl"])
+              for r in filled])
+        conn.executemany('''
+            INSERT INTO transaction_history
+            (user_id, stock_id, order_type, quantity, price, total_value, cash_before, cash_after, realized_pl)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(user_id, r["stock_id"], r["side"], r["quantity"], r["price"], r["total"],
+               r["cash_before"], r["cash_after"], r["realized_pl"]) for r in filled])
+        record_equity_snapshots(conn, datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"), user_id)
+
+    log_rows = []
+    for r in results:
+        buy = r["side"] == "BUY"
+        if r["status"] == "filled":
+            log_rows.append((30 if buy else 32,
+                             f"Batch {'buy' if buy else 'sell'} success: user {user_id} "
+                             f"{'bought' if buy else 'sold'} {r['quantity']} shares of {r['symbol']} "
+                             f"at ${r['price']:.2f} (total {r['total']:.2f})."))
+        else:
+            log_rows.append((31 if buy else 33,
+                             f"Batch {'buy' if buy else 'sell'} failed for user {user_id}: {r['error']}."))
+    now = datetime.utcnow().isoformat()
+    conn.executemany("INSERT INTO logs (type, details, timestamp, user_id) VALUES (?, ?, ?, ?)",
+                     [(event_type, details, now, user_id) for event_type, details in log_rows])
+    for r in filled:
+        del r["cash_before"]
+    return cash if filled else user["balance"], results
+
+
+def valid_order_leg(leg):
+    """True if a batch leg has an int stock_id, a BUY/SELL side and a positive int quantity."""
+    def is_int(value):
+        return isinstance(value, int) and not isinstance(value, bool)
+    return (is_int(leg.get("stock_id")) and leg.get("side") in ("BUY", "SELL")
+            and is_int(leg.get("quantity")) and leg["quantity"] > 0)
+
+
+@app.route("/api/orders/batch", methods=["POST"])
+def api_order_batch():
+    """
+    Buys and sells several stocks in one request and one transaction.
+
+    Body: {"orders": [{"stock_id": 1, "side": "BUY", "quantity": 5}, ...],
+           "mode": "all_or_nothing" (default) or "best_effort"}
+    Answers with the status of every leg, in request order.
+    """
+    if 'user_id' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    user_id = session['user_id']
+
+    body = request.get_json(silent=True) or {}
+    legs = body.get("orders")
+    mode = body.get("mode", "all_or_nothing")
+    if (not isinstance(legs, list) or not legs or len(legs) > ORDER_BATCH_MAX_LEGS
+            or not all(isinstance(leg, dict) for leg in legs)):
+        return jsonify({"error": f"orders must be a list of 1 to {ORDER_BATCH_MAX_LEGS} legs"}), 400
+    if mode not in ("all_or_nothing", "best_effort"):
+        return jsonify({"error": "mode must be all_or_nothing or best_effort"}), 400
+    for leg in legs:
+        if isinstance(leg.get("side"), str):
+            leg["side"] = leg["side"].upper()
+    malformed = [i for i, leg in enumerate(legs) if not valid_order_leg(leg)]
+    if malformed:
+        return jsonify({"error": "every leg needs an integer stock_id, side BUY or SELL "
+                                 "and a positive integer quantity",
+                        "invalid_legs": malformed}), 400
+
+    ms = get_market_status()
+    if ms.get("status") != "open":
+        log_event(31, f"Batch order failed for user {user_id}: market closed ({ms.get('reason')}).",
+                  user_id=user_id)
+        return jsonify({"error": f"Market is closed: {ms.get('reason')}",
+                        "next_open": ms.get("next_open")}), 409
+
+    try:
+        cash, results = trade_executor.submit(execute_order_batch, user_id, legs, mode == "all_or_nothing")
+    except TradeRejected as e:
+        log_event(31, f"Batch order failed for user {user_id}: {e.reason}.", user_id=user_id)
+        return jsonify({"error": str(e)}), 409
+
+    filled = sum(1 for r in results if r["status"] == "filled")
+    status = "filled" if filled == len(results) else "partial" if filled else "rejected"
+    return jsonify({"mode": mode, "status": status, "balance": cash, "results": results}), \
+        200 if filled else 422
+
+
+
+# ----- limit orders -----
+# Buy orders hold quantity * limit_price of cash from placement until they fill
+# (the difference to the fill price is refunded) or are cancelled. Orders that
+# are marketable when placed fill at once; the rest rest in the generator's
+# order books (order_book.py) and are matched every tick.
+
+def release_limit_order(conn, order, reason):
+    """Cancels an open limit order and refunds the cash a buy order still holds."""
+    remaining = order["quantity"] - order["filled"]
+    if order["side"] == order_book.BUY and remaining > 0:
+        conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?",
+                     (remaining * order["limit_price"], order["user_id"]))
+    conn.execute("""
+        UPDATE limit_orders SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP
+        WHERE order_id = ? AND status = 'open'
+    """, (order["order_id"],))
+    return f"Limit order {order['order_id']} cancelled: {reason}."
+
+def settle_limit_fill(conn, order_id, quantity, price):
+    """
+    Fills up to `quantity` of an open limit order at `price`: moves cash and
+    shares and writes orders/transaction_history rows. Runs inside the
+    caller's transaction.
+
+    :return: (quantity filled, log message or None)
+    """
+    order = conn.execute(queries.LIMIT_ORDER_SQL, (order_id,)).fetchone()
+    if order is None or order["status"] != "open":
+        return 0, None
+    user_id, stock_id = order["user_id"], order["stock_id"]
+    quantity = min(quantity, order["quantity"] - order["filled"])
+    if quantity <= 0:
+        return 0, None
+
+    total = quantity * price
+    conn.execute("SAVEPOINT limit_fill")
+    if order["side"] == order_book.BUY:
+        # the cash was held at the limit price; refund the difference
+        cash_delta = quantity * (order["limit_price"] - price)
+        realized_pl = 0.0
+    else:
+        position = take_from_position(conn, user_id, stock_id, quantity)
+        if position is None:
+            conn.execute("RELEASE limit_fill")
+            return 0, release_limit_order(conn, order, "not enough shares left to sell")
+        cash_delta = total
+        realized_pl = total - quantity * position["avg_cost"]
+
+    user = conn.execute("""
+        UPDATE users SET balance = balance + ?
+        WHERE user_id = ?
+        RETURNING balance - ? AS cash_before, balance AS cash_after
+    """, (cash_delta, user_id, cash_delta)).fetchone()
+    if user is None:
+        conn.execute("ROLLBACK TO limit_fill")  # puts sold shares back
+        conn.execute("RELEASE limit_fill")
+        return 0, release_limit_order(conn, order, "account not found")
+    conn.execute("RELEASE limit_fill")
+    if order["side"] == order_book.BUY:
+        add_to_position(conn, user_id, stock_id, quantity, total)
+    new_balance = user["cash_after"]
+
+    conn.execute("""
+        INSERT INTO orders (user_id, stock_id, order_type, quantity, price, cash_after, realized_pl)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (user_id, stock_id, order["side"], quantity, price, new_balance, realized_pl))
+    conn.execute("""
+        INSERT INTO transaction_history
+        (user_id, stock_id, order_type, quantity, price, total_value, cash_before, cash_after, realized_pl)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (user_id, stock_id, order["side"], quantity, price, total, user["cash_before"], new_balance, realized_pl))
+
+    filled = order["filled"] + quantity
+    conn.execute("""
+        UPDATE limit_orders
+        SET filled = ?, status = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE order_id = ?
+    """, (filled, "filled" if filled >= order["quantity"] else "open", order_id))
+    return quantity, (f"Limit order {order_id} filled: user {user_id} {order['side'].lower()} "
+                      f"{quantity} of stock {stock_id} at ${price:.2f} (limit ${order['limit_price']:.2f}).")
+
+
+def execute_limit_order(conn, user_id, stock_id, side, quantity, limit_price, market_open):
+    """
+    Places a limit order, filling it at once if it is marketable. Runs as a
+    trade writer job.
+
+    :return: message for the user
+    """
+    user = conn.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)).fetchone()
+    stock = conn.execute('SELECT * FROM stocks WHERE stock_id = ?', (stock_id,)).fetchone()
+    if not user or not stock:
+        raise TradeRejected("User or stock not found.", "user or stock not found")
+
+    if side == order_book.BUY:
+        hold = quantity * limit_price
+        # the balance check and the hold are one statement, so nothing can
+        # spend the cash between them
+        held = conn.execute(
+            'UPDATE users SET balance = balance - ? WHERE user_id = ? AND balance >= ? RETURNING balance',
+            (hold, user_id, hold)
+        ).fetchone()
+        if held is None:
+            raise TradeRejected(f"Insufficient funds. Need ${hold:.2f}, have ${user['balance']:.2f}",
+                                f"insufficient funds (needed {hold}, had {user['balance']})")
+    else:
+        position = conn.execute(queries.POSITION_QUANTITY_SQL, (user_id, stock_id)).fetchone()
+        committed = conn.execute(queries.OPEN_SELL_QUANTITY_SQL, (user_id, stock_id)).fetchone()[0]
+        available = (position['quantity'] if position else 0) - committed
+        if available < quantity:
+            raise TradeRejected(f"Insufficient shares. {available} available for new sell orders.",
+                                f"insufficient shares ({available} available, wanted {quantity})")
+
+    order_id = conn.execute("""
+        INSERT INTO limit_orders (user_id, stock_id, side, quantity, limit_price)
+        VALUES (?, ?, ?, ?, ?)
+    """, (user_id, stock_id, side, quantity, limit_price)).lastrowid
+    message = (f"Limit order {order_id} placed: user {user_id} {side.lower()} "
+               f"{quantity} of {stock['symbol']} at limit ${limit_price:.2f}.")
+    insert_log(conn, 34, message, user_id=user_id)
+
+    # marketable right away: fill at the current price
+    price = stock['price']
+    if market_open and (limit_price >= price if side == order_book.BUY else limit_price <= price):
+        filled, fill_message = settle_limit_fill(conn, order_id, quantity, price)
+        if fill_message:
+            insert_log(conn, 35 if filled else 36, fill_message, user_id=user_id)
+            message = fill_message
+        if filled:
+            record_equity_snapshots(conn, datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"), user_id)
+    return message
+
+def execute_cancel_limit_order(conn, user_id, order_id):
+    """Cancels one of the user's open limit orders. Runs as a trade writer job."""
+    order = conn.execute(
+        "SELECT * FROM limit_orders WHERE order_id = ? AND user_id = ? AND status = 'open'",
+        (order_id, user_id)
+    ).fetchone()
+    if not order:
+        return None
+    message = release_limit_order(conn, order, "cancelled by user")
+    insert_log(conn, 36, message, user_id=user_id)
+    return message
+
+
+@app.route('/limit_order/<int:user_id>', methods=['POST'])
+def place_limit_order(user_id):
+    if 'user_id' not in session or session['user_id'] != user_id:
+        flash("Unauthorized.", "error")
+        return redirect(url_for('login'))
+
+    try:
+        stock_id = int(request.form['stock_id'])
+        side = request.form['side'].upper()
+        quantity = int(request.form['quantity'])
+        limit_price = round(float(request.form['limit_price']), 2)
+    except (KeyError, ValueError):
+        flash("Invalid limit order.", "error")
+        return redirect(url_for('dashboard', user_id=user_id))
+    if side not in (order_book.BUY, order_book.SELL) or quantity <= 0 or limit_price <= 0:
+        flash("Limit orders need a side, a positive quantity and a positive limit price.", "error")
+        return redirect(url_for('dashboard', user_id=user_id))
+
+    market_open = get_market_status().get("status") == "open"
+    try:
+        message = trade_executor.submit(execute_limit_order, user_id, stock_id, side,
+                                        quantity, limit_price, market_open)
+    except TradeRejected as e:
+        flash(str(e), "error")
+        log_event(37, f"Limit order rejected for user {user_id}: {e.reason}", user_id=user_id)
+        return redirect(url_for('dashboard', user_id=user_id))
+
+    flash(message, "success")
+    return redirect(url_for('dashboard', user_id=user_id))
+
+
+@app.route('/limit_order/<int:user_id>/cancel/<int:order_id>', methods=['POST'])
+def cancel_limit_order(user_id, order_id):
+    if 'user_id' not in session or session['user_id'] != user_id:
+        flash("Unauthorized.", "error")
+        return redirect(url_for('login'))
+
+    message = trade_executor.submit(execute_cancel_limit_order, user_id, order_id)
+    if message:
+        flash(message, "success")
+    else:
+        flash("Order not found or no longer open.", "error")
+    return redirect(url_for('dashboard', user_id=user_id))
+
+
+
+# ----- stop-loss / take-profit triggers -----
+# A trigger sells up to `quantity` shares of a position at the first tick
+# price at or beyond its trigger price (see triggers.py).
+
+def execute_place_trigger(conn, user_id, stock_id, kind, quantity, trigger_price):
+    """Places a trigger on one of the user's positions. Runs as a trade writer job."""
+    position = conn.execute("""
+        SELECT p.quantity, s.symbol, s.price FROM portfolio p
+        JOIN stocks s ON s.stock_id = p.stock_id
+        WHERE p.user_id = ? AND p.stock_id = ?
+    """, (user_id, stock_id)).fetchone()
+    if not position:
+        raise TradeRejected("Position not found.", "position not found")
+    if position['quantity'] < quantity:
+        raise TradeRejected(f"Insufficient shares. Have {position['quantity']}, trigger for {quantity}",
+                            f"insufficient shares (had {position['quantity']}, wanted {quantity})")
+    if triggers.fires(kind, trigger_price, position['price']):
+        below = "below" if kind == triggers.STOP_LOSS else "above"
+        raise TradeRejected(f"The trigger price must be {below} the current price (${position['price']:.2f}).",
+                            f"trigger price {trigger_price} would fire at {position['price']}")
+
+    trigger_id = conn.execute("""
+        INSERT INTO trigger_orders (user_id, stock_id, kind, quantity, trigger_price)
+        VALUES (?, ?, ?, ?, ?)
+    """, (user_id, stock_id, kind, quantity, trigger_price)).lastrowid
+    message = (f"Trigger {trigger_id} placed: user {user_id} {kind.replace('_', '-')} "
+               f"{quantity} of {position['symbol']} at ${trigger_price:.2f}.")
+    insert_log(conn, 38, message, user_id=user_id)
+    return message
+
+def execute_cancel_trigger(conn, user_id, trigger_id):
+    """
+    Cancels one of the user's open triggers. Runs as a trade writer job.
+
+    :return: (log message, cancelled trigger row), or (None, None) if it was not open
+    """
+    trigger = conn.execute("""
+        UPDATE trigger_orders SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP
+        WHERE trigger_id = ? AND user_id = ? AND status = 'open'
+        RETURNING trigger_id, stock_id, kind, trigger_price
+    """, (trigger_id, user_id)).fetchone()
+    if trigger is None:
+        return None, None
+    message = f"Trigger {trigger_id} cancelled by user {user_id}."
+    insert_log(conn, 40, message, user_id=user_id)
+    return message, trigger
+
+
+@app.route('/trigger_order/<int:user_id>', methods=['POST'])
+def place_trigger_order(user_id):
+    if 'user_id' not in session or session['user_id'] != user_id:
+        flash("Unauthorized.", "error")
+        return redirect(url_for('login'))
+
+    try:
+        stock_id = int(request.form['stock_id'])
+        kind = request.form['kind']
+        quantity = int(request.form['quantity'])
+        trigger_price = round(float(request.form['trigger_price']), 2)
+    except (KeyError, ValueError):
+        flash("Invalid trigger order.", "error")
+        return redirect(url_for('dashboard', user_id=user_id))
+    if kind not in triggers.KINDS or quantity <= 0 or trigger_price <= 0:
+        flash("Triggers need a kind, a positive quantity and a positive trigger price.", "error")
+        return redirect(url_for('dashboard', user_id=user_id))
+
+    try:
+        message = trade_executor.submit(execute_place_trigger, user_id, stock_id, kind, quantity, trigger_price)
+    except TradeRejected as e:
+        flash(str(e), "error")
+        return redirect(url_for('dashboard', user_id=user_id))
+
+    flash(message, "success")
+    return redirect(url_for('dashboard', user_id=user_id))
+
+
+@app.route('/trigger_order/<int:user_id>/cancel/<int:trigger_id>', methods=['POST'])
+def cancel_trigger_order(user_id, trigger_id):
+    if 'user_id' not in session or session['user_id'] != user_id:
+        flash("Unauthorized.", "error")
+        return redirect(url_for('login'))
+
+    message, trigger = trade_executor.submit(execute_cancel_trigger, user_id, trigger_id)
+    if trigger is not None and trigger_books:
+        # this process runs the generator: take it out of the books on the next tick
+        cancelled_triggers.append((trigger["stock_id"], trigger["trigger_id"],
+                                   trigger["kind"], trigger["trigger_price"]))
+    if message:
+        flash(message, "success")
+    else:
+        flash("Trigger not found or no longer open.", "error")
+    return redirect(url_for('dashboard', user_id=user_id))
+
+
 # ----- admin routes (now protected) -----
 
 @app.route('/admin')
@@ -1029,7 +1706,9 @@ def admin_stock_edit(stock_id):
         try:
             conn.execute('UPDATE stocks SET symbol = ?, company_name = ? WHERE stock_id = ?',
                          (symbol, company_name, stock_id))
+            quote_bus.publish(conn)
             conn.commit()
+            tick_version.bump(DB_NAME)
             flash(f"Stock {symbol} updated successfully", "success")
             return redirect(url_for('admin_stocks'))
         except sqlite3.IntegrityError:
@@ -1047,9 +1726,33 @@ def admin_stock_delete(stock_id):
         return check
 
     conn = get_db_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    # its open orders can never fill now: cancel them, refunding the cash buy orders hold
+    orders = conn.execute(
+        "SELECT * FROM limit_orders WHERE stock_id = ? AND status = 'open'", (stock_id,)
+    ).fetchall()
+    log_rows = [(36, release_limit_order(conn, order, "stock deleted"), order["user_id"])
+                for order in orders]
+    log_rows += [
+        (40, f"Trigger {row['trigger_id']} cancelled: stock {stock_id} deleted.", row["user_id"])
+        for row in conn.execute("""
+            UPDATE trigger_orders SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP
+            WHERE stock_id = ? AND status = 'open'
+            RETURNING trigger_id, user_id
+        """, (stock_id,)).fetchall()
+    ]
     conn.execute('DELETE FROM stocks WHERE stock_id = ?', (stock_id,))
+    conn.execute('DELETE FROM quotes WHERE stock_id = ?', (stock_id,))
+    quote_bus.publish(conn)
     conn.commit()
     conn.close()
+    # the generator's books (when this process runs it); other processes skip
+    # the cancelled orders by their status
+    limit_books.pop(stock_id, None)
+    trigger_books.pop(stock_id, None)
+    tick_version.bump(DB_NAME)
+    for event_type, details, user_id in log_rows:
+        log_event(event_type, details, user_id=user_id)
     flash("Stock deleted successfully", "success")
     return redirect(url_for('admin_stocks'))
 
@@ -1068,11 +1771,17 @@ def admin_stock_create():
         
         conn = get_db_connection()
         try:
-            conn.execute(
+            cur = conn.execute(
                 'INSERT INTO stocks (symbol, company_name, price) VALUES (?, ?, ?)',
                 (symbol, company_name, price)
             )
+            conn.execute(
+                'INSERT INTO quotes (stock_id, price, previous_price, change) VALUES (?, ?, ?, 0)',
+                (cur.lastrowid, price, price)
+            )
+            quote_bus.publish(conn)
             conn.commit()
+            tick_version.bump(DB_NAME)
             flash(f"Stock {symbol} created successfully!", "success")
 
             log_event(
@@ -1083,6 +1792,9 @@ def admin_stock_create():
 
             return redirect(url_for('admin_stocks'))
         except sqlite3.IntegrityError:
+            # release the write lock first: log_event waits for the trade writer
+            conn.rollback()
+            conn.close()
             flash("Stock symbol already exists.", "error")
             log_event(
                 44,  # Admin: Stock Creation Failed
@@ -1113,7 +1825,15 @@ def admin_stock_update():
             'UPDATE stocks SET price = ? WHERE stock_id = ?',
             (new_price, stock_id)
         )
+        upsert_quotes(
+            conn,
+            [(int(stock_id), new_price)],
+            conn.execute("SELECT COALESCE(MAX(tick_id), 0) FROM quotes").fetchone()[0],
+            datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        )
+        quote_bus.publish(conn)
         conn.commit()
+        tick_version.bump(DB_NAME)
         flash("Stock price updated successfully!", "success")
         return redirect(url_for('admin_stock_update'))
     
@@ -1141,6 +1861,9 @@ def admin_market_hours():
         conn.commit()
         conn.close()
 
+        config_cache.invalidate(DB_NAME)
+        generator_wakeup.set()
+        tick_version.bump(DB_NAME)
         flash("Market hours updated.", "success")
 
         log_event(
@@ -1172,6 +1895,7 @@ def admin_market_schedule():
             VALUES ('09:30', '16:00', 'EST', 'monday,tuesday,wednesday,thursday,friday', '', 0, '')
         """)
         conn.commit()
+        config_cache.invalidate(DB_NAME)
         settings = get_market_schedule()
 
     if request.method == "POST":
@@ -1200,6 +1924,10 @@ def admin_market_schedule():
         conn.commit()
         conn.close()
 
+        config_cache.invalidate(DB_NAME)
+        generator_wakeup.set()
+        tick_version.bump(DB_NAME)
+
         # Flash message
         flash("Market schedule updated!", "success")
 
@@ -1254,28 +1982,20 @@ def admin_logs():
 
     conn = get_db_connection()
 
-    # Base query
-    base_query = "FROM logs"
-    params = []
-
     # Filtering
+    where = ""
+    params = []
     if selected_types:
         placeholders = ",".join("?" for _ in selected_types)
-        base_query += f" WHERE type IN ({placeholders})"
+        where = f" WHERE type IN ({placeholders})"
         params.extend(int(t) for t in selected_types)
 
     # Count logs
-    count_query = "SELECT COUNT(*) " + base_query
-    total_logs = conn.execute(count_query, params).fetchone()[0]
+    total_logs = conn.execute(queries.LOGS_COUNT_SQL.format(where=where), params).fetchone()[0]
 
     # Pagination
     offset = (page - 1) * per_page
-    log_query = (
-        "SELECT * " + base_query +
-        " ORDER BY timestamp DESC LIMIT ? OFFSET ?"
-    )
-
-    logs = conn.execute(log_query, params + [per_page, offset]).fetchall()
+    logs = conn.execute(queries.LOGS_PAGE_SQL.format(where=where), params + [per_page, offset]).fetchall()
     conn.close()
 
     event_types = {
@@ -1289,6 +2009,13 @@ def admin_logs():
         31: "Buy order failed",
         32: "Sell order succeeded",
         33: "Sell order failed",
+        34: "Limit order placed",
+        35: "Limit order filled",
+        36: "Limit order cancelled",
+        37: "Limit order rejected",
+        38: "Trigger order placed",
+        39: "Trigger order executed",
+        40: "Trigger order cancelled",
         41: "Admin: Logs Downloaded",
         42: "Admin: Logs Cleared",
         43: "Admin: Stock Created",
@@ -1396,6 +2123,27 @@ def admin_settings():
         volatility = float(request.form.get("volatility", 0.005))
         trend_bias = float(request.form.get("trend_bias", 0.0002))
         exaggeration = float(request.form.get("exaggeration", 1.0))
+        model = request.form.get("model", "gbm")
+        model_params = request.form.get("model_params", "").strip() or "{}"
+        workers = max(1, int(request.form.get("workers", 1) or 1))
+        seed_raw = request.form.get("seed", "").strip()
+        seed = int(seed_raw) if seed_raw else None
+        catchup_policy = request.form.get("catchup_policy", "skip")
+        if catchup_policy not in CATCHUP_POLICIES:
+            catchup_policy = "skip"
+        retention_days = max(0, int(request.form.get("retention_days", 0) or 0))
+
+        if model not in price_models.MODELS:
+            flash("Unknown price model.", "error")
+            conn.close()
+            return redirect(url_for("admin_settings"))
+        try:
+            if not isinstance(json.loads(model_params), dict):
+                raise ValueError
+        except ValueError:
+            flash("Model parameters must be a JSON object.", "error")
+            conn.close()
+            return redirect(url_for("admin_settings"))
 
         # Track changes for logging
         changes = []
@@ -1408,14 +2156,37 @@ def admin_settings():
         compare("volatility", settings["volatility"], volatility)
         compare("trend_bias", settings["trend_bias"], trend_bias)
         compare("exaggeration", settings["exaggeration"], exaggeration)
+        old_model, _ = price_models.load_model_settings(settings)
+        if old_model != model:
+            changes.append(f"model: {old_model} → {model}")
+        old_params = settings["model_params"] if "model_params" in settings.keys() else "{}"
+        if (old_params or "{}") != model_params:
+            changes.append(f"model_params: {old_params} → {model_params}")
+        old_workers = settings["workers"] if "workers" in settings.keys() else 1
+        if old_workers != workers:
+            changes.append(f"workers: {old_workers} → {workers}")
+        old_seed = settings["seed"] if "seed" in settings.keys() else None
+        if old_seed != seed:
+            changes.append(f"seed: {old_seed} → {seed}")
+        old_policy = settings["catchup_policy"] if "catchup_policy" in settings.keys() else "skip"
+        if old_policy != catchup_policy:
+            changes.append(f"catchup_policy: {old_policy} → {catchup_policy}")
+        old_retention = settings["retention_days"] if "retention_days" in settings.keys() else 0
+        if old_retention != retention_days:
+            changes.append(f"retention_days: {old_retention} → {retention_days}")
 
         # Update DB
         cursor.execute("""
             UPDATE price_generator_settings
-            SET enabled = ?, interval_seconds = ?, volatility = ?, trend_bias = ?, exaggeration = ?
+            SET enabled = ?, interval_seconds = ?, volatility = ?, trend_bias = ?, exaggeration = ?,
+                model = ?, model_params = ?, workers = ?, seed = ?, catchup_policy = ?,
+                retention_days = ?
             WHERE id = 1
-        """, (enabled, interval_seconds, volatility, trend_bias, exaggeration))
+        """, (enabled, interval_seconds, volatility, trend_bias, exaggeration, model, model_params,
+              workers, seed, catchup_policy, retention_days))
         conn.commit()
+        config_cache.invalidate(DB_NAME)
+        generator_wakeup.set()
 
         # Log changes
         if changes:
@@ -1431,10 +2202,19 @@ def admin_settings():
 
     # GET request
     conn.close()
-    return render_template("admin_settings.html", settings=settings)
+    model, model_params = price_models.load_model_settings(settings)
+    return render_template(
+        "admin_settings.html",
+        settings=settings,
+        model=model,
+        model_params=json.dumps(model_params),
+        models=price_models.MODELS,
+        catchup_policies=CATCHUP_POLICIES,
+        tick_stats=tick_stats
+    )
 
 
-def get_market_schedule():
+def load_market_schedule():
     conn = get_db_connection()
     schedule = conn.execute(
         "SELECT * FROM market_schedule ORDER BY id DESC LIMIT 1"
@@ -1442,6 +2222,10 @@ def get_market_schedule():
     conn.close()
     return schedule
 
+def get_market_schedule():
+    """The market_schedule row, from the process-wide config cache."""
+    return config_cache.get(DB_NAME, "market_schedule", load_market_schedule)
+
 def compute_next_open(schedule, from_dt=None):
     """
     Look forward up to 30 days for the next datetime when the market will open.
@@ -1583,47 +2367,136 @@ def get_market_status():
     }
 
 
+# last computed market status and the (tick version, minute) it was computed for
+market_status_memo = {"key": None, "status": None}
+
+def current_market_status():
+    """get_market_status(), computed at most once per tick version and minute."""
+    key = (tick_version.read(DB_NAME), int(time.time() // 60))
+    if market_status_memo["key"] != key:
+        market_status_memo["status"] = get_market_status()
+        market_status_memo["key"] = key
+    return market_status_memo["status"]
+
 @app.route("/api/market/status")
+@etag_by_tick_version(per_minute=True)
 def api_market_status():
-    status = get_market_status()
-    return jsonify(status)
+    return jsonify(current_market_status())
 
-def log_event(event_type, details, user_id=None):
-    """
-    Logs an event to the logs table.
 
-    :param event_type: Integer representing event category/type
-    :param details: Text description of the event
-    :param user_id: Optional user ID (None for system events)
-    """
+# ----- server-sent events price stream -----
+# One broadcaster thread per process follows the quote feed (quote_bus.py) and
+# publishes the changed quotes (and market status transitions) once; every
+# connected client only waits on the condition and forwards the shared,
+# pre-encoded events.
+
+STREAM_POLL_SECONDS = 0.25
+STREAM_KEEPALIVE_SECONDS = 15
+
+price_stream = {
+    "condition": Condition(),
+    "events": deque(maxlen=256),  # (seq, encoded event)
+    "seq": 0,
+    "thread": None,
+}
+price_stream_lock = Lock()
 
-    for _ in range(8):  # retry up to 8 times on locked DB
+def sse_message(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def publish_stream_event(event, data):
+    message = sse_message(event, data)
+    with price_stream["condition"]:
+        price_stream["seq"] += 1
+        price_stream["events"].append((price_stream["seq"], message))
+        price_stream["condition"].notify_all()
+
+def price_stream_loop():
+    """Publishes a "prices" event per quote change and a "market" event per status change."""
+    quote_bus.refresh(DB_NAME, get_db_connection)
+    market = current_market_status()
+
+    while True:
+        time.sleep(STREAM_POLL_SECONDS)
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
+            quotes = quote_bus.refresh(DB_NAME, get_db_connection)
+            if quotes:
+                publish_stream_event("prices", quotes)
+
+            status = current_market_status()
+            if status != market:
+                market = status
+                publish_stream_event("market", status)
+        except Exception as e:
+            print("Price stream update failed:", e)
 
-            timestamp = datetime.utcnow().isoformat()
+def ensure_price_stream():
+    with price_stream_lock:
+        if price_stream["thread"] is None:
+            price_stream["thread"] = Thread(target=price_stream_loop, daemon=True)
+            price_stream["thread"].start()
 
-            cur.execute("""
-                INSERT INTO logs (type, details, timestamp, user_id)
-                VALUES (?, ?, ?, ?)
-            """, (event_type, details, timestamp, user_id))
+@app.route("/api/stream/prices")
+def api_stream_prices():
+    """
+    Server-sent events: "prices" (changed quotes, all of them on connect) and
+    "market" (current status on connect, then each transition).
+    """
+    ensure_price_stream()
+    condition = price_stream["condition"]
+
+    def stream():
+        with condition:
+            last = price_stream["seq"]
+        quote_bus.refresh(DB_NAME, get_db_connection)
+        yield "retry: 3000\n\n"
+        yield sse_message("prices", quote_bus.snapshot())
+        yield sse_message("market", current_market_status())
+
+        while True:
+            with condition:
+                condition.wait_for(lambda: price_stream["seq"] > last, timeout=STREAM_KEEPALIVE_SECONDS)
+                events = list(price_stream["events"])
+                missed = bool(events) and events[0][0] > last + 1
+                pending = [message for seq, message in events if seq > last]
+                last = price_stream["seq"]
+
+            if missed:
+                # fell behind the event buffer: resend everything
+                pending = [sse_message("prices", quote_bus.snapshot()),
+                           sse_message("market", current_market_status())]
+            yield "".join(pending) if pending else ": keepalive\n\n"
+
+    return Response(stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # don't let a reverse proxy buffer the stream
+    })
+
+def insert_log(conn, event_type, details, user_id=None):
+    """Writes a logs row in the caller's transaction."""
+    conn.execute("""
+        INSERT INTO logs (type, details, timestamp, user_id)
+        VALUES (?, ?, ?, ?)
+    """, (event_type, details, datetime.utcnow().isoformat(), user_id))
 
-            conn.commit()
-            conn.close()
-            return  # success
-        except sqlite3.OperationalError as e:
-            if "locked" in str(e).lower():
-                time.sleep(0.05)
-                continue
-            raise  # real error → raise immediately
+def log_event(event_type, details, user_id=None):
+    """
+    Logs an event to the logs table. The write goes through the trade writer,
+    so it shares a commit with whatever trades are in flight.
 
-    print("log_event FAILED after all retries!")
+    :param event_type: Integer representing event category/type
+    :param details: Text description of the event
+    :param user_id: Optional user ID (None for system events)
+    """
+    try:
+        trade_executor.submit(insert_log, event_type, details, user_id)
+    except sqlite3.OperationalError as e:
+        print(f"log_event FAILED: {e}")
 
 
 #stuff for the price generator
 
-def get_generator_settings():
+def load_generator_settings():
     conn = get_db_connection()
     conn.row_factory = sqlite3.Row
     row = conn.execute("SELECT * FROM price_generator_settings WHERE id = 1").fetchone()
@@ -1638,22 +2511,29 @@ def get_generator_settings():
         """)
         conn.commit()
         conn.close()
-        return get_generator_settings()
+        return load_generator_settings()
 
     return row
 
-def apply_price_change(old_price, volatility, trend_bias):
+def get_generator_settings():
+    """The price_generator_settings row, from the process-wide config cache."""
+    return config_cache.get(DB_NAME, "generator_settings", load_generator_settings)
+
+def apply_price_change(old_price, volatility, trend_bias, exaggeration=1.0):
     """
     Generate a new stock price using Gaussian noise.
+    Single-stock form of the GBM model; the generator itself advances all
+    stocks at once with price_models.advance_prices.
     
     - volatility = standard deviation of returns (e.g. 0.01 = 1%)
     - trend_bias = average directional drift (e.g. 0.0005 for slight upward trend)
+    - exaggeration = multiplier applied to the random shock
 
     Price model:
-        new_price = old_price * exp( GaussianNoise + trend_bias )
+        new_price = old_price * exp( GaussianNoise * exaggeration + trend_bias )
     """
     # Gaussian noise, centered at 0
-    gaussian_return = random.gauss(mu=0, sigma=volatility)
+    gaussian_return = random.gauss(mu=0, sigma=volatility * exaggeration)
 
     # Add drift
     total_return = gaussian_return + trend_bias
@@ -1667,75 +2547,752 @@ def apply_price_change(old_price, volatility, trend_bias):
 
     return round(new_price, 2)
     
-def safe_execute(query, params=()):
-    for _ in range(5):  # retry up to 5 times
+def write_price_tick(updates, timestamp):
+    """
+    Writes one generator tick in a single transaction on a single connection.
+
+    :param updates: List of (stock_id, new_price) tuples
+    :param timestamp: Tick timestamp shared by every price_history row of this tick
+    :return: the tick_id stored in quotes, or None if the tick was not committed
+    """
+    stock_rows = [(price, stock_id) for stock_id, price in updates]
+    history_rows = [(stock_id, price, timestamp) for stock_id, price in updates]
+
+    for _ in range(5):  # retry up to 5 times on locked DB
+        conn = get_db_connection()
         try:
-            conn = get_db_connection()
-            conn.execute(query, params)
+            # take the write lock up front so the whole tick is one fsync
+            conn.execute("BEGIN IMMEDIATE")
+            if not holds_generator_lease(conn):
+                # another process took over as generator leader
+                conn.rollback()
+                return None
+            conn.executemany(
+                "UPDATE stocks SET price = ? WHERE stock_id = ?",
+                stock_rows
+            )
+            if not tick_store.enabled():
+                conn.executemany(
+                    "INSERT INTO price_history (stock_id, price, timestamp) VALUES (?, ?, ?)",
+                    history_rows
+                )
+            tick_id = conn.execute("SELECT COALESCE(MAX(tick_id), 0) + 1 FROM quotes").fetchone()[0]
+            upsert_quotes(conn, updates, tick_id, timestamp)
+            candles.record_tick(conn, updates, timestamp)
+            last_fill = conn.execute(queries.LAST_TRANSACTION_SQL).fetchone()[0]
+            limit_messages = match_limit_orders(conn, updates)
+            fire_triggers(conn, updates)
+            record_equity_snapshots(conn, timestamp)
+            # users this tick's fills sold out have no positions left for the
+            # query above; record their (now empty) holdings one by one
+            for (user_id,) in conn.execute(queries.TICK_TRADERS_SQL, (last_fill,)).fetchall():
+                record_equity_snapshots(conn, timestamp, user_id)
+            quote_bus.publish(conn, [
+                tuple(row) for row in conn.execute(
+                    "SELECT stock_id, price, change FROM quotes WHERE tick_id = ?", (tick_id,)
+                )
+            ], tick_id)
             conn.commit()
-            conn.close()
-            return
-        except sqlite3.OperationalError as e:
-            if "locked" in str(e).lower():
+            if tick_store.enabled():
+                stock_ids, prices = zip(*updates)
+                tick_store.append(stock_ids, [candles.to_epoch(timestamp)] * len(updates), prices)
+            tick_version.bump(DB_NAME)
+            for message in limit_messages:
+                log_event(35 if "filled" in message else 36, message)
+            return tick_id
+        except Exception as e:
+            conn.rollback()
+            # the books already moved with this tick's fills and fired triggers:
+            # rebuild them from limit_orders/trigger_orders on the retry (or the next tick)
+            reset_limit_books()
+            reset_trigger_books()
+            if isinstance(e, sqlite3.OperationalError) and "locked" in str(e).lower():
                 time.sleep(0.1)  # small delay then retry
-            else:
-                raise
-    print("DB write failed after retries:", query)
+                continue
+            raise
+        finally:
+            conn.close()
+
+    print("Price tick write failed after retries")
+    return None
+
+# one equity snapshot per user per minute; the dashboard chart shows the newest ones
+EQUITY_SNAPSHOT_SECONDS = 60
+EQUITY_CHART_POINTS = 1440
+
+def record_equity_snapshots(conn, timestamp, user_id=None):
+    """
+    Stores the holdings value of every user with positions (or of one user,
+    even with none left) in the minute bucket of `timestamp`, replacing the
+    bucket's earlier value. Every position is valued at its stock's latest
+    quote, so stocks that did not tick carry their last price forward.
+    Runs inside the caller's transaction.
+    """
+    epoch = candles.to_epoch(timestamp)
+    bucket = epoch - epoch % EQUITY_SNAPSHOT_SECONDS
+    if user_id is None:
+        conn.execute(queries.EQUITY_SNAPSHOTS_SQL, (bucket,))
+    else:
+        conn.execute(queries.USER_EQUITY_SNAPSHOT_SQL, (user_id, bucket, user_id))
+
+def prune_equity_snapshots(conn, retention_days):
+    """Deletes equity snapshots older than retention_days. Returns the number deleted."""
+    cutoff = int(time.time()) - int(retention_days * 86400)
+    deleted = conn.execute(queries.PRUNE_EQUITY_SNAPSHOTS_SQL, (cutoff,)).rowcount
+    conn.commit()
+    return deleted
+
+# the generator leader's order books: stock_id -> order_book.OrderBook
+limit_books = {}
+limit_book_state = {"cursor": 0}  # newest limit_orders.order_id loaded into the books
+
+def reset_limit_books():
+    """Drops the books; the next tick rebuilds them from limit_orders."""
+    limit_books.clear()
+    limit_book_state["cursor"] = 0
+
+def match_limit_orders(conn, updates):
+    """
+    Loads newly placed limit orders into the books, crosses them against
+    resting orders, then fills every order marketable at this tick's prices.
+    Runs inside the tick transaction.
 
-def update_all_stock_prices():
+    :param updates: List of (stock_id, new_price) tuples
+    :return: log messages of fills and cancellations
+    """
+    messages = []
+
+    def settle(order, quantity, price, book):
+        filled, message = settle_limit_fill(conn, order["order_id"], quantity, price)
+        if message:
+            messages.append(message)
+        if filled:
+            book.reduce(order["order_id"], filled)
+        else:
+            book.cancel(order["order_id"])  # cancelled or filled elsewhere
+        return filled
+
+    def cross_pair(bid, ask, quantity, price, book):
+        # both legs in one savepoint, the seller's side first: if the buyer
+        # cannot take all the shares sold (order no longer open, account gone),
+        # undo both and retry with what the buyer could take
+        while True:
+            conn.execute("SAVEPOINT limit_pair")
+            sold, ask_message = settle_limit_fill(conn, ask["order_id"], quantity, price)
+            bought, bid_message = (settle_limit_fill(conn, bid["order_id"], sold, price)
+                                   if sold else (0, None))
+            if bought == sold:
+                conn.execute("RELEASE limit_pair")
+                break
+            conn.execute("ROLLBACK TO limit_pair")
+            conn.execute("RELEASE limit_pair")
+            if not bought:
+                # a buy leg that fills nothing moves no cash or shares; settle
+                # it alone to record its cancellation (if any)
+                _, bid_message = settle_limit_fill(conn, bid["order_id"], sold, price)
+                if bid_message:
+                    messages.append(bid_message)
+                book.cancel(bid["order_id"])  # the ask keeps resting
+                return
+            quantity = bought
+        messages.extend(m for m in (ask_message, bid_message) if m)
+        if sold:
+            book.reduce(ask["order_id"], sold)
+            book.reduce(bid["order_id"], sold)
+        else:
+            book.cancel(ask["order_id"])  # cancelled, filled elsewhere or out of shares
+
+    # incoming orders, oldest first; each one crosses the opposite side of its book
+    new_orders = conn.execute(queries.NEW_LIMIT_ORDERS_SQL, (limit_book_state["cursor"],)).fetchall()
+    for row in new_orders:
+        limit_book_state["cursor"] = row["order_id"]
+        book = limit_books.setdefault(row["stock_id"], order_book.OrderBook())
+        book.add(row["order_id"], row["user_id"], row["side"], row["limit_price"],
+                 row["quantity"] - row["filled"])
+        while True:
+            pair = book.crossed_pair()
+            if pair is None:
+                break
+            bid, ask = pair
+            # trade at the resting (older) order's price
+            price = ask["limit_price"] if ask["order_id"] < bid["order_id"] else bid["limit_price"]
+            cross_pair(bid, ask, min(bid["remaining"], ask["remaining"]), price, book)
+
+    # this tick's prices
+    for stock_id, price in updates:
+        book = limit_books.get(stock_id)
+        if book:
+            for order in book.crossing_with_price(price):
+                settle(order, order["remaining"], price, book)
+    return messages
+
+# the generator leader's trigger books: stock_id -> triggers.TriggerBook
+trigger_books = {}
+trigger_book_state = {"cursor": 0}  # newest trigger_orders.trigger_id loaded into the books
+# (stock_id, trigger_id, kind, trigger_price) cancelled since the last tick; the
+# generator thread removes them from the books (fire_triggers also skips any it missed)
+cancelled_triggers = deque()
+
+def reset_trigger_books():
+    """Drops the books; the next tick rebuilds them from trigger_orders."""
+    trigger_books.clear()
+    cancelled_triggers.clear()
+    trigger_book_state["cursor"] = 0
+
+def fire_triggers(conn, updates):
+    """
+    Loads newly placed triggers into the books and drops cancelled ones, then
+    sells at this tick's price every position whose stop-loss or take-profit
+    the tick crossed. Fired triggers are settled together with executemany.
+    Runs inside the tick transaction.
+
+    :param updates: List of (stock_id, new_price) tuples
+    :return: number of triggers executed
+    """
+    new_triggers = conn.execute(queries.NEW_TRIGGERS_SQL, (trigger_book_state["cursor"],)).fetchall()
+    for row in new_triggers:
+        trigger_book_state["cursor"] = row["trigger_id"]
+        trigger_books.setdefault(row["stock_id"], triggers.TriggerBook()).add(
+            row["trigger_id"], row["kind"], row["trigger_price"])
+    while cancelled_triggers:
+        stock_id, trigger_id, kind, trigger_price = cancelled_triggers.popleft()
+        book = trigger_books.get(stock_id)
+        if book:
+            book.remove(trigger_id, kind, trigger_price)
+
+    prices = {}
+    fired_ids = []
+    for stock_id, price in updates:
+        book = trigger_books.get(stock_id)
+        if book:
+            fired = book.pop_fired(price)
+            if fired:
+                prices[stock_id] = price
+                fired_ids.extend(fired)
+    if not fired_ids:
+        return 0
+
+    # still open in the database (the book may hold cancelled ones), oldest first
+    fired_ids = json.dumps(fired_ids)
+    fired = conn.execute(queries.FIRED_TRIGGERS_SQL, (fired_ids,)).fetchall()
+    positions = {(row["user_id"], row["stock_id"]): [row["quantity"], row["avg_cost"]]
+                 for row in conn.execute(queries.FIRED_POSITIONS_SQL, (fired_ids,))}
+    balances = {row["user_id"]: row["balance"]
+                for row in conn.execute(queries.FIRED_BALANCES_SQL, (fired_ids,))}
+
+    sales, cancelled, log_rows = [], [], []
+    for row in fired:
+        user_id, stock_id = row["user_id"], row["stock_id"]
+        position = positions.get((user_id, stock_id))
+        quantity = min(row["quantity"], position[0]) if position else 0
+        if quantity <= 0 or user_id not in balances:
+            cancelled.append((row["trigger_id"],))
+            log_rows.append((40, f"Trigger {row['trigger_id']} cancelled: user {user_id} "
+                                 f"no longer holds {row['symbol']}.", user_id))
+            continue
+        price = prices[stock_id]
+        total = quantity * price
+        realized_pl = total - quantity * position[1]
+        position[0] -= quantity
+        cash_before = balances[user_id]
+        balances[user_id] = cash_before + total
+        sales.append((row, quantity, price, total, realized_pl, cash_before, balances[user_id]))
+        log_rows.append((39, f"Trigger {row['trigger_id']} executed: user {user_id} "
+                             f"{row['kind'].replace('_', '-')} sold {quantity} of {row['symbol']} "
+                             f"at ${price:.2f} (trigger ${row['trigger_price']:.2f}).", user_id))
+
+    conn.executemany("""
+        UPDATE portfolio
+        SET quantity = quantity - ?, total_invested = total_invested - ? * avg_cost,
+            last_updated = CURRENT_TIMESTAMP
+        WHERE user_id = ? AND stock_id = ?
+    """, [(q, q, row["user_id"], row["stock_id"]) for row, q, *_ in sales])
+    conn.executemany("DELETE FROM portfolio WHERE user_id = ? AND stock_id = ? AND quantity <= 0",
+                     {(row["user_id"], row["stock_id"]) for row, *_ in sales})
+    conn.executemany("UPDATE users SET balance = balance + ? WHERE user_id = ?",
+                     [(total, row["user_id"]) for row, _, _, total, *_ in sales])
+    conn.executemany("""
+        INSERT INTO orders (user_id, stock_id, order_type, quantity, price, cash_after, realized_pl)
+        VALUES (?, ?, 'SELL', ?, ?, ?, ?)
+    """, [(row["user_id"], row["stock_id"], q, price, after, pl)
+          for row, q, price, total, pl, before, after in sales])
+    conn.executemany("""
+        INSERT INTO transaction_history
+        (user_id, stock_id, order_type, quantity, price, total_value, cash_before, cash_after, realized_pl)
+        VALUES (?, ?, 'SELL', ?, ?, ?, ?, ?, ?)
+    """, [(row["user_id"], row["stock_id"], q, price, total, before, after, pl)
+          for row, q, price, total, pl, before, after in sales])
+    conn.executemany("""
+        UPDATE trigger_orders
+        SET status = 'executed', quantity = ?, fill_price = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE trigger_id = ?
+    """, [(q, price, row["trigger_id"]) for row, q, price, *_ in sales])
+    conn.executemany("""
+        UPDATE trigger_orders SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP
+        WHERE trigger_id = ?
+    """, cancelled)
+    now = datetime.utcnow().isoformat()
+    conn.executemany("INSERT INTO logs (type, details, timestamp, user_id) VALUES (?, ?, ?, ?)",
+                     [(event_type, details, now, user_id) for event_type, details, user_id in log_rows])
+    return len(sales)
+
+def upsert_quotes(conn, updates, tick_id, timestamp):
+    """
+    Moves each quote's price to previous_price and stores the new one.
+    Runs inside the caller's transaction.
+
+    :param updates: List of (stock_id, new_price) tuples
+    """
+    conn.executemany("""
+        INSERT INTO quotes (stock_id, price, previous_price, change, tick_id, updated_at)
+        VALUES (?, ?, ?, 0, ?, ?)
+        ON CONFLICT(stock_id) DO UPDATE SET
+            previous_price = quotes.price,
+            price = excluded.price,
+            change = excluded.price - quotes.price,
+            tick_id = excluded.tick_id,
+            updated_at = excluded.updated_at
+    """, [(stock_id, price, price, tick_id, timestamp) for stock_id, price in updates])
+
+
+# first price seen per stock this run, the level the mean_reversion model pulls towards
+price_anchors = {}
+
+# process pool for sharded generation, rebuilt when the worker count changes
+generator_pool = {"pool": None, "workers": 1}
+
+def get_generator_pool(workers):
+    """
+    Returns a multiprocessing pool with `workers` processes, or None for in-process generation.
+    """
+    if generator_pool["workers"] != workers:
+        if generator_pool["pool"] is not None:
+            generator_pool["pool"].terminate()
+        generator_pool["pool"] = multiprocessing.Pool(workers) if workers > 1 else None
+        generator_pool["workers"] = workers
+    return generator_pool["pool"]
+
+# seed used by sharded generation when none is configured
+run_seed = random.getrandbits(32)
+
+# timing of the most recent tick, shown on the admin settings page
+tick_stats = {
+    "tick": 0,
+    "last_tick_at": None,
+    "stock_count": 0,
+    "compute_ms": 0.0,
+    "write_ms": 0.0,
+    "total_ms": 0.0,
+    "lag_ms": 0.0,          # how late the last tick started versus its schedule
+    "max_lag_ms": 0.0,
+    "missed_ticks": 0,      # ticks skipped or backfilled because the generator fell behind
+}
+
+def load_tick_counter():
+    """
+    Continues the stream tick count from the newest quote tick, so seeded
+    price streams never reuse a tick number after a restart or a leader change.
+    """
+    conn = get_db_connection()
+    stored = conn.execute("SELECT COALESCE(MAX(tick_id), 0) FROM quotes").fetchone()[0]
+    conn.close()
+    tick_stats["tick"] = max(tick_stats["tick"], stored)
+
+def update_all_stock_prices(settings=None, check_market=True):
     # ---- CHECK MARKET STATUS FIRST ----
-    market = get_market_status()
-    if market["status"] != "open":
-        # Skip updating all prices if the market is not open
-        return
+    if check_market:
+        market = get_market_status()
+        if market["status"] != "open":
+            # Skip updating all prices if the market is not open
+            return
 
-    settings = get_generator_settings()
+    if settings is None:
+        settings = get_generator_settings()
 
     if not settings["enabled"]:
         return
 
     volatility = settings["volatility"]
     trend_bias = settings["trend_bias"]
+    exaggeration = settings["exaggeration"] if "exaggeration" in settings.keys() else 1.0
+    model, params = price_models.load_model_settings(settings)
+
+    tick_start = time.perf_counter()
 
     # GET STOCK LIST WITH ONE CONNECTION
     conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
     stocks = conn.execute("SELECT stock_id, price FROM stocks").fetchall()
     conn.close()
 
-    # PROCESS EACH STOCK USING safe_execute (each has its own conn)
-    for stock in stocks:
-        new_price = apply_price_change(stock["price"], volatility, trend_bias)
+    # ADVANCE EVERY PRICE IN ONE VECTORIZED STEP
+    stock_ids = np.array([s["stock_id"] for s in stocks], dtype=np.int64)
+    prices = np.array([s["price"] for s in stocks], dtype=np.float64)
+    for sid, price in zip(stock_ids.tolist(), prices.tolist()):
+        price_anchors.setdefault(sid, price)
+    anchors = np.array([price_anchors[sid] for sid in stock_ids.tolist()], dtype=np.float64)
+
+    keys = settings.keys()
+    workers = max(1, int(settings["workers"] or 1)) if "workers" in keys else 1
+    seed = settings["seed"] if "seed" in keys else None
+    tick = tick_stats["tick"] + 1
+
+    if workers > 1 or seed is not None:
+        # per-symbol streams: same prices for any number of shards
+        new_prices = price_models.advance_prices_sharded(
+            stock_ids,
+            prices,
+            anchors,
+            seed=run_seed if seed is None else seed,
+            tick=tick,
+            pool=get_generator_pool(workers),
+            shards=workers,
+            model=model,
+            params=params,
+            volatility=volatility,
+            trend_bias=trend_bias,
+            exaggeration=exaggeration or 1.0,
+        )
+    else:
+        new_prices = price_models.advance_prices(
+            prices,
+            model=model,
+            params=params,
+            volatility=volatility,
+            trend_bias=trend_bias,
+            exaggeration=exaggeration or 1.0,
+            anchors=anchors,
+            stock_ids=stock_ids,
+        )
+    updates = list(zip(stock_ids.tolist(), new_prices.tolist()))
+    timestamp = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    computed = time.perf_counter()
+
+    # WRITE THE WHOLE TICK IN ONE TRANSACTION
+    if updates and not write_price_tick(updates, timestamp):
+        return
+    written = time.perf_counter()
+
+    tick_stats.update({
+        "tick": tick,
+        "last_tick_at": timestamp,
+        "stock_count": len(updates),
+        "compute_ms": (computed - tick_start) * 1000,
+        "write_ms": (written - computed) * 1000,
+        "total_ms": (written - tick_start) * 1000,
+    })
+
+
+
+CATCHUP_POLICIES = ("skip", "backfill")
+
+# longest gap the backfill catch-up policy will fill after downtime
+CATCHUP_MAX_SECONDS = 7 * 24 * 3600
+
+# longest the generator sleeps while the market is closed before re-reading the schedule
+MAX_IDLE_SLEEP = 900
+
+# how often a sleeping generator checks the config version for admin changes
+# made in other processes (the web app, when the generator runs standalone)
+CONFIG_POLL_SECONDS = 5
+
+# set by the admin routes so a sleeping generator re-reads schedule and settings right away
+generator_wakeup = Event()
+
+def generator_sleep(seconds):
+    """
+    Sleeps up to `seconds`, returning early if generator_wakeup is set or
+    the config version (see config_cache.py) changes. Returns True if woken early.
+    """
+    deadline = time.monotonic() + max(0.0, seconds)
+    version = tick_version.read(DB_NAME, config_cache.VERSION_NAME)
+    woken = False
+    while not woken:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        woken = (generator_wakeup.wait(timeout=min(remaining, CONFIG_POLL_SECONDS))
+                 or tick_version.read(DB_NAME, config_cache.VERSION_NAME) != version)
+    generator_wakeup.clear()
+    return woken
+
+def seconds_until_open():
+    """
+    Seconds until the market can next be open, from market_schedule.
+    Manual override and unknown schedules fall back to MAX_IDLE_SLEEP.
+    """
+    schedule = get_market_schedule()
+    if not schedule or schedule["manual_override"]:
+        return MAX_IDLE_SLEEP
+    now = datetime.now()
+    session = market_hours.next_session(schedule, now)
+    if not session or session[0] <= now:
+        # in session hours but closed (e.g. holiday on a non-standard line): recheck soon
+        return 60
+    return min((session[0] - now).total_seconds(), MAX_IDLE_SLEEP)
+
+def last_tick_time():
+    """
+    Local datetime of the newest tick, or None. Every tick updates the quotes,
+    so this reads their newest updated_at (one row per stock) instead of
+    scanning the whole history.
+    """
+    conn = get_db_connection()
+    row = conn.execute(queries.LAST_TICK_SQL).fetchone()
+    conn.close()
+    if not row or not row[0]:
+        return None
+    utc_dt = datetime.strptime(row[0][:19], "%Y-%m-%d %H:%M:%S")
+    return utc_dt.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+
+def catch_up(settings, since, interval):
+    """
+    Bulk-generates the ticks missed between `since` and now (backfill policy).
+    Runs through backfill.backfill_history so missed ticks follow the trading sessions.
+    """
+    now = datetime.now()
+    since = max(since, now - timedelta(seconds=CATCHUP_MAX_SECONDS))
+    if (now - since).total_seconds() < interval:
+        return 0
 
-        # update main price
-        safe_execute(
-            "UPDATE stocks SET price = ? WHERE stock_id = ?",
-            (new_price, stock["stock_id"])
+    seed = settings["seed"] if "seed" in settings.keys() else None
+    conn = get_db_connection()
+    try:
+        rows, ticks, elapsed = backfill.backfill_history(
+            conn,
+            since + timedelta(seconds=1),
+            now,
+            interval,
+            run_seed if seed is None else seed,
+            first_tick=tick_stats["tick"] + 1,
+            update_prices=True,
+            rebuild_indexes=False,
+            progress=lambda msg: None,
         )
+        if rows:
+            record_equity_snapshots(conn, datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
+            conn.commit()
+            tick_version.bump(DB_NAME)
+    finally:
+        conn.close()
+
+    tick_stats["tick"] += ticks
+    print(f"Generator caught up {ticks} missed ticks ({rows} rows) in {elapsed:.1f}s")
+    return ticks
+
+# leader election: one generator ticks across every process sharing the DB
+LEASE_SECONDS = 6
+
+generator_lease = {
+    "holder": f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}",
+    "is_leader": False,
+    "enforce": False,  # set once this process takes part in the election
+    "stopping": False,  # set on shutdown so the lease is not re-acquired
+}
+
+def acquire_generator_lease():
+    """
+    Takes or renews the generator lease. The lease goes to whoever holds it already,
+    or to anyone once it has expired (leader died or stalled).
+    Returns True if this process is the leader.
+    """
+    if generator_lease["stopping"]:
+        return False
+    now = time.time()
+    conn = get_db_connection()
+    try:
+        cur = conn.execute("""
+            INSERT INTO generator_lease (id, holder, expires_at) VALUES (1, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE generator_lease.holder = excluded.holder OR generator_lease.expires_at < ?
+        """, (generator_lease["holder"], now + LEASE_SECONDS, now))
+        conn.commit()
+        leader = cur.rowcount > 0
+    except sqlite3.OperationalError as e:
+        if "locked" not in str(e).lower():
+            raise
+        # could not renew in time: keep the current role until the next attempt
+        leader = generator_lease["is_leader"]
+    finally:
+        conn.close()
 
-        # update history
-        safe_execute(
-            "INSERT INTO price_history (stock_id, price) VALUES (?, ?)",
-            (stock["stock_id"], new_price)
+    if leader and not generator_lease["is_leader"]:
+        print(f"Generator leadership acquired by {generator_lease['holder']}")
+        generator_wakeup.set()
+    elif not leader and generator_lease["is_leader"]:
+        print(f"Generator leadership lost by {generator_lease['holder']}")
+    generator_lease["is_leader"] = leader
+    return leader
+
+def release_generator_lease():
+    """Gives up the lease on shutdown so a standby takes over without waiting for expiry."""
+    generator_lease["stopping"] = True
+    if not generator_lease["is_leader"]:
+        return
+    generator_lease["is_leader"] = False
+    try:
+        conn = get_db_connection()
+        conn.execute(
+            "UPDATE generator_lease SET expires_at = 0 WHERE id = 1 AND holder = ?",
+            (generator_lease["holder"],)
         )
+        conn.commit()
+        conn.close()
+    except sqlite3.Error:
+        pass
 
+def holds_generator_lease(conn):
+    """
+    Fencing check run inside the tick transaction: True if this process
+    still holds an unexpired lease (or is not taking part in an election).
+    """
+    if not generator_lease["enforce"]:
+        return True
+    row = conn.execute(
+        "SELECT 1 FROM generator_lease WHERE id = 1 AND holder = ? AND expires_at > ?",
+        (generator_lease["holder"], time.time())
+    ).fetchone()
+    return row is not None
 
+def lease_keeper_loop():
+    """Renews (or competes for) the generator lease a few times per lease period."""
+    while not generator_lease["stopping"]:
+        try:
+            acquire_generator_lease()
+        except Exception as e:
+            print("Generator lease check failed:", e)
+        time.sleep(LEASE_SECONDS / 3)
+
+ARCHIVE_CHECK_SECONDS = 300
+
+def archive_loop():
+    """
+    Moves ticks older than retention_days into the compressed archive and
+    drops equity snapshots older than that.
+    Runs in the generator leader only, in small batches between ticks and trades.
+    """
+    while not generator_lease["stopping"]:
+        try:
+            settings = get_generator_settings()
+            days = settings["retention_days"] if "retention_days" in settings.keys() else 0
+            if days and generator_lease["is_leader"]:
+                conn = get_db_connection()
+                try:
+                    rows = archive.archive_old_history(
+                        conn, days,
+                        should_stop=lambda: generator_lease["stopping"] or not generator_lease["is_leader"]
+                    )
+                    snapshots = prune_equity_snapshots(conn, days)
+                finally:
+                    conn.close()
+                if rows:
+                    print(f"Archived {rows} price_history rows older than {days} days")
+                if snapshots:
+                    print(f"Deleted {snapshots} equity snapshots older than {days} days")
+        except Exception as e:
+            print("Price history archival failed:", e)
+        time.sleep(ARCHIVE_CHECK_SECONDS)
+
+def start_generator(block=False):
+    """
+    Starts the lease keeper and the price generator loop.
+    Every process may call this; only the lease holder generates ticks.
+    """
+    generator_lease["enforce"] = True
+    atexit.register(release_generator_lease)
+    acquire_generator_lease()
+    Thread(target=lease_keeper_loop, daemon=True).start()
+    Thread(target=archive_loop, daemon=True).start()
+    if block:
+        price_generator_loop()
+    else:
+        Thread(target=price_generator_loop, daemon=True).start()
 
 def price_generator_loop():
+    """
+    Runs generator ticks on a fixed schedule aligned to the monotonic clock.
+
+    Ticks are due every interval_seconds from the first tick, regardless of how long
+    each one takes. If the generator falls behind by whole intervals, the missed ticks
+    are skipped or bulk-backfilled depending on catchup_policy. While the market is
+    closed it sleeps until the next open instead of polling. Waking early (a
+    settings change, or taking over the lease) never adds an extra tick: the schedule
+    is re-anchored one interval after the wake or after the last written tick.
+    """
     print("Price generator loop initiated")
+    next_tick = None  # monotonic time the next tick is due
+    last_tick_wall = None  # wall-clock time of the last written tick
+    woken = False  # the last sleep between ticks was cut short by a settings change
+
     while True:
         try:
+            if generator_lease["enforce"] and not generator_lease["is_leader"]:
+                # standby: the lease keeper wakes us when leadership is acquired
+                reset_limit_books()
+                reset_trigger_books()
+                next_tick = None
+                last_tick_wall = None
+                generator_sleep(LEASE_SECONDS / 3)
+                continue
+
             settings = get_generator_settings()
-            interval = settings["interval_seconds"]
-            update_all_stock_prices()
-            time.sleep(interval)
+            interval = max(1, settings["interval_seconds"])
+            keys = settings.keys()
+            policy = settings["catchup_policy"] if "catchup_policy" in keys else "skip"
+
+            if not settings["enabled"] or get_market_status()["status"] != "open":
+                next_tick = None
+                generator_sleep(interval if not settings["enabled"] else seconds_until_open())
+                continue
+
+            now = time.monotonic()
+            if next_tick is None:
+                # first tick of a session: realign the schedule, optionally fill the gap
+                next_tick = now
+                load_tick_counter()
+                since = last_tick_wall or last_tick_time()
+                if policy == "backfill" and since:
+                    tick_stats["missed_ticks"] += catch_up(settings, since, interval)
+                    since = last_tick_time() or since
+                if since:
+                    # keep the cadence of the last written tick (ours, or the previous
+                    # lease holder's) instead of ticking again at once
+                    next_tick += max(0.0, interval - (datetime.now() - since).total_seconds())
+            elif woken:
+                # settings changed mid-session: the next tick is one (new) interval away
+                next_tick = now + interval
+            woken = False
+            if next_tick > now:
+                woken = generator_sleep(next_tick - now)
+                continue
+
+            lag = now - next_tick
+            if lag >= interval:
+                missed = int(lag // interval)
+                tick_stats["missed_ticks"] += missed
+                if policy == "backfill" and last_tick_wall:
+                    catch_up(settings, last_tick_wall, interval)
+                else:
+                    print(f"Generator {lag:.1f}s behind, skipping {missed} ticks")
+                next_tick += missed * interval
+                lag -= missed * interval
+
+            update_all_stock_prices(settings, check_market=False)
+            last_tick_wall = datetime.now()
+
+            tick_stats["lag_ms"] = lag * 1000
+            tick_stats["max_lag_ms"] = max(tick_stats["max_lag_ms"], lag * 1000)
+
+            next_tick += interval
+            woken = generator_sleep(next_tick - time.monotonic())
         except Exception as e:
             print("Generator crashed:", e)
+            next_tick = None
             time.sleep(10)
 
 #start background threat for price generator
-thread = Thread(target=price_generator_loop, daemon=True)
-thread.start()
+#(not inside generator pool processes, which re-import this module on spawn platforms)
+if GENERATOR_MODE == "embedded" and __name__ != '__mp_main__':
+    start_generator()
 
 # run the flask app
 if __name__ == '__main__': 
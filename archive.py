@@ -0,0 +1,280 @@
+"""
+Tiered retention for price_history.
+
+Ticks newer than the retention window stay in price_history ("hot"). Older
+ticks are moved, one stock and a few thousand rows at a time, into compressed
+chunks in an archive database next to the main one (stock_trading.db ->
+stock_trading_archive.db), attached to a connection as `archive`.
+
+Each chunk holds one stock's consecutive ticks: timestamps and prices are
+delta-encoded (prices in whole cents when every price is a cent amount, which
+generator prices always are) and zlib-compressed. Candles are not archived;
+they keep covering the whole history.
+
+Usage:
+    python archive.py --days 30
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import struct
+import time
+import zlib
+
+import numpy as np
+
+import candles
+
+
+DB_NAME = 'stock_trading.db'
+
+# rows per chunk; also the rows moved per write transaction
+CHUNK_ROWS = 2000
+
+# seconds to wait between chunks, so the generator and trades get the write lock
+BATCH_PAUSE = 0.05
+
+# chunk price encodings
+CENTS = 1
+FLOATS = 2
+
+HEADER = struct.Struct("<BI")  # encoding, row count
+
+
+def archive_path(db_file):
+    """stock_trading.db -> stock_trading_archive.db"""
+    base, ext = os.path.splitext(db_file)
+    return f"{base}_archive{ext or '.db'}"
+
+
+def attach_archive(conn, create=True):
+    """
+    Attaches the archive database of conn's main database as `archive`.
+
+    :param create: create the archive file and its tables if missing
+    :return: True if the archive is attached
+    """
+    databases = {row[1]: row[2] for row in conn.execute("PRAGMA database_list")}
+    if "archive" in databases:
+        return True
+    path = archive_path(databases["main"])
+    if not create and not os.path.exists(path):
+        return False
+
+    conn.execute("ATTACH DATABASE ? AS archive", (path,))
+    if create:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive.price_chunks (
+            stock_id INTEGER NOT NULL,
+            start_ts TEXT NOT NULL,
+            first_id INTEGER NOT NULL,
+            end_ts TEXT NOT NULL,
+            last_id INTEGER NOT NULL,
+            row_count INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (stock_id, start_ts, first_id)
+        ) WITHOUT ROWID''')
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_price_chunks_stock_end "
+                     "ON price_chunks (stock_id, end_ts, last_id)")
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive.archive_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            archived_before TEXT
+        )''')
+        conn.commit()
+    return True
+
+
+def encode_chunk(epochs, prices):
+    """Delta-encodes and compresses one stock's ticks (unix seconds, prices)."""
+    epochs = np.asarray(epochs, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.float64)
+
+    cents = np.round(prices * 100)
+    if np.array_equal(cents / 100, prices):
+        encoding = CENTS
+        values = np.diff(cents.astype(np.int64), prepend=0).astype("<i8")
+    else:
+        encoding = FLOATS
+        values = prices.astype("<f8")
+
+    payload = np.diff(epochs, prepend=0).astype("<i8").tobytes() + values.tobytes()
+    return HEADER.pack(encoding, len(epochs)) + zlib.compress(payload, 6)
+
+
+def decode_chunk(data):
+    """Inverse of encode_chunk: returns (epochs, prices) arrays."""
+    encoding, count = HEADER.unpack_from(data)
+    payload = zlib.decompress(data[HEADER.size:])
+    epochs = np.cumsum(np.frombuffer(payload, dtype="<i8", count=count))
+    if encoding == CENTS:
+        cents = np.cumsum(np.frombuffer(payload, dtype="<i8", count=count, offset=count * 8))
+        prices = cents / 100
+    else:
+        prices = np.frombuffer(payload, dtype="<f8", count=count, offset=count * 8)
+    return epochs, prices
+
+
+def archived_before(conn):
+    """Unix seconds before which history has been fully archived, or None."""
+    if not attach_archive(conn, create=False):
+        return None
+    row = conn.execute("SELECT archived_before FROM archive.archive_state WHERE id = 1").fetchone()
+    return candles.to_epoch(row[0]) if row and row[0] else None
+
+
+def hot_floor(conn, stock_id):
+    """
+    (end_ts, last_id) of the newest chunk of a stock, or ("", 0).
+
+    Hot rows at or below this position are already archived; they only exist
+    if an archive batch was interrupted between its two writes.
+    """
+    if not attach_archive(conn, create=False):
+        return "", 0
+    row = conn.execute("""
+        SELECT end_ts, last_id FROM archive.price_chunks
+        WHERE stock_id = ?
+        ORDER BY end_ts DESC, last_id DESC
+        LIMIT 1
+    """, (stock_id,)).fetchone()
+    return (row[0], row[1]) if row else ("", 0)
+
+
+def read_history(conn, stock_id, start_ts="", end_ts="9999"):
+    """
+    Archived ticks of a stock with start_ts <= timestamp < end_ts, oldest first.
+
+    :return: list of (timestamp text, price)
+    """
+    if not attach_archive(conn, create=False):
+        return []
+    chunks = conn.execute("""
+        SELECT data FROM archive.price_chunks
+        WHERE stock_id = ? AND end_ts >= ? AND start_ts < ?
+        ORDER BY start_ts, first_id
+    """, (stock_id, start_ts, end_ts)).fetchall()
+
+    rows = []
+    for (data,) in chunks:
+        epochs, prices = decode_chunk(data)
+        rows.extend(
+            (ts, price)
+            for ts, price in zip(map(candles.to_text, epochs.tolist()), prices.tolist())
+            if start_ts <= ts < end_ts
+        )
+    rows.sort(key=lambda row: row[0])
+    return rows
+
+
+def archive_chunk(conn, stock_id, cutoff_ts, chunk_rows=CHUNK_ROWS):
+    """
+    Moves up to chunk_rows of a stock's oldest ticks before cutoff_ts into one
+    archive chunk. Returns the number of rows moved.
+    """
+    rows = conn.execute("""
+        SELECT id, timestamp, price FROM price_history
+        WHERE stock_id = ? AND timestamp < ?
+        ORDER BY timestamp, id
+        LIMIT ?
+    """, (stock_id, cutoff_ts, chunk_rows)).fetchall()
+    conn.commit()
+    if not rows:
+        return 0
+
+    first_id, start_ts, _ = rows[0]
+    last_id, end_ts, _ = rows[-1]
+    data = encode_chunk([candles.to_epoch(r[1]) for r in rows], [r[2] for r in rows])
+
+    # two transactions, archive first: attached WAL databases do not commit
+    # atomically together. A crash in between leaves the rows in both places;
+    # readers skip them via hot_floor and the next run archives them again
+    # into the same chunk (same key) and deletes them.
+    conn.execute("""
+        INSERT OR REPLACE INTO archive.price_chunks
+            (stock_id, start_ts, first_id, end_ts, last_id, row_count, data)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (stock_id, start_ts, first_id, end_ts, last_id, len(rows), data))
+    conn.commit()
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # exactly the rows encoded above: a row inserted since the SELECT
+        # (e.g. by a backfill) stays until the next run archives it
+        conn.execute(
+            "DELETE FROM price_history WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps([r[0] for r in rows]),)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows)
+
+
+def archive_old_history(conn, retention_days, chunk_rows=CHUNK_ROWS, pause=BATCH_PAUSE,
+                        should_stop=None, progress=None):
+    """
+    Archives every tick older than the retention window, in small batches.
+
+    The cutoff is aligned to a UTC midnight so candle buckets never straddle it.
+
+    :param retention_days: days of full-resolution ticks kept in price_history
+    :param should_stop: optional callable; the pass stops early when it returns True
+    :param progress: optional callable receiving a status message per stock
+    :return: rows archived
+    """
+    attach_archive(conn)
+    cutoff = int(time.time()) - retention_days * 86400
+    cutoff -= cutoff % 86400
+    cutoff_ts = candles.to_text(cutoff)
+
+    stock_ids = [row[0] for row in conn.execute("SELECT stock_id FROM stocks ORDER BY stock_id")]
+    conn.commit()
+    total = 0
+    for stock_id in stock_ids:
+        while True:
+            if should_stop and should_stop():
+                return total
+            moved = archive_chunk(conn, stock_id, cutoff_ts, chunk_rows)
+            total += moved
+            if moved < chunk_rows:
+                break
+            time.sleep(pause)
+        if progress:
+            progress(f"stock {stock_id}: {total} rows archived so far")
+
+    conn.execute("""
+        INSERT INTO archive.archive_state (id, archived_before) VALUES (1, ?)
+        ON CONFLICT(id) DO UPDATE SET archived_before = MAX(COALESCE(archived_before, ''), excluded.archived_before)
+    """, (cutoff_ts,))
+    conn.commit()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old price_history rows into the compressed archive.")
+    parser.add_argument("--days", type=int, required=True, help="days of ticks to keep in price_history")
+    parser.add_argument("--db", default=DB_NAME, help=f"database file (default {DB_NAME})")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM the main database afterwards")
+    args = parser.parse_args()
+    if args.days < 1:
+        parser.error("--days must be at least 1")
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA busy_timeout = 5000;")
+    try:
+        started = time.perf_counter()
+        rows = archive_old_history(conn, args.days, progress=print)
+        print(f"Archived {rows} rows in {time.perf_counter() - started:.1f}s to {archive_path(args.db)}")
+        if args.vacuum:
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
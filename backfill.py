@@ -0,0 +1,225 @@
+"""
+Bulk-generates historical price_history rows for every stock.
+
+Walks every trading session in the market_schedule between two dates, one
+tick every --spacing seconds, using the price model from
+price_generator_settings. Prices come from per-symbol seeded streams, so the
+same seed, range and spacing always give the same history.
+
+Usage:
+    python backfill.py --start 2024-01-01 --end 2025-01-01 --spacing 60 --seed 42
+"""
+
+import argparse
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import repeat
+
+import numpy as np
+
+import archive
+import candles
+import market_hours
+import migrations
+import price_models
+import quote_bus
+import tick_store
+import tick_version
+
+
+DB_NAME = 'stock_trading.db'
+
+
+def session_ticks(schedule, start, end, spacing):
+    """Yields every tick datetime (local time) inside the trading sessions of [start, end)."""
+    step = timedelta(seconds=spacing)
+    for open_dt, close_dt in market_hours.trading_sessions(schedule, start, end):
+        tick_dt = open_dt
+        # the closing tick belongs to the range unless the session was clipped to `end`
+        while tick_dt < close_dt or (tick_dt == close_dt < end):
+            yield tick_dt
+            tick_dt += step
+
+
+def to_utc_text(local_dt):
+    """Formats a local datetime like SQLite's CURRENT_TIMESTAMP (UTC)."""
+    return local_dt.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def drop_indexes(conn, table):
+    """Drops the explicit indexes on `table` and returns their CREATE statements."""
+    indexes = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table,)
+    ).fetchall()
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX "{name}"')
+    conn.commit()
+    return [sql for _, sql in indexes]
+
+
+def backfill_history(conn, start, end, spacing, seed, batch_size=100_000, first_tick=1,
+                     update_prices=False, rebuild_indexes=True, progress=print):
+    """
+    Generates ticks for every stock across the trading sessions of [start, end).
+
+    :param conn: sqlite3 connection
+    :param start: first local datetime to generate
+    :param end: local datetime to stop before
+    :param spacing: seconds between ticks
+    :param seed: seed of the per-symbol price streams
+    :param batch_size: rows written per transaction
+    :param first_tick: stream tick number of the first generated tick
+    :param update_prices: store the final generated prices in stocks.price and quotes
+    :param rebuild_indexes: drop price_history indexes during the load and rebuild them after
+    :return: (rows written, ticks generated, elapsed seconds)
+    """
+    conn.row_factory = sqlite3.Row
+    settings = conn.execute("SELECT * FROM price_generator_settings WHERE id = 1").fetchone()
+    schedule = conn.execute("SELECT * FROM market_schedule ORDER BY id DESC LIMIT 1").fetchone()
+    stocks = conn.execute("SELECT stock_id, price FROM stocks ORDER BY stock_id").fetchall()
+    if settings is None or schedule is None or not stocks:
+        raise ValueError("Generator settings, market schedule and at least one stock are required")
+
+    model, params = price_models.load_model_settings(settings)
+    exaggeration = settings["exaggeration"] if "exaggeration" in settings.keys() else 1.0
+    options = dict(
+        model=model,
+        params=params,
+        volatility=settings["volatility"],
+        trend_bias=settings["trend_bias"],
+        exaggeration=exaggeration or 1.0,
+    )
+
+    stock_ids = np.array([s["stock_id"] for s in stocks], dtype=np.int64)
+    prices = np.array([s["price"] for s in stocks], dtype=np.float64)
+    anchors = prices.copy()
+    id_list = stock_ids.tolist()
+
+    if tick_store.enabled():
+        # the store's files are append-only and must stay in time order
+        latest = tick_store.last_epoch(id_list)
+        if latest is not None and candles.to_epoch(to_utc_text(start)) < latest:
+            raise ValueError(
+                f"The tick store already holds ticks up to {candles.to_text(latest)} UTC; "
+                "a memmap backfill can only add history after that. Backfill older history "
+                "into price_history and re-run 'python tick_store.py --convert' instead."
+            )
+
+    before_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM price_history").fetchone()[0]
+    index_sql = drop_indexes(conn, "price_history") if rebuild_indexes else []
+    started = time.perf_counter()
+    rows_written = 0
+    ticks = 0
+    batch = []
+
+    def flush():
+        nonlocal rows_written
+        conn.execute("BEGIN IMMEDIATE")
+        if tick_store.enabled():
+            stock_col, price_col, time_col = zip(*batch)
+            tick_store.append(stock_col, [candles.to_epoch(ts) for ts in time_col], price_col)
+            candles.record_rows(conn, batch)
+        else:
+            conn.executemany(
+                "INSERT INTO price_history (stock_id, price, timestamp) VALUES (?, ?, ?)",
+                batch
+            )
+        conn.commit()
+        rows_written += len(batch)
+        batch.clear()
+        elapsed = time.perf_counter() - started
+        progress(f"{rows_written} rows, {rows_written / elapsed:,.0f} rows/sec")
+
+    try:
+        for tick_dt in session_ticks(schedule, start, end, spacing):
+            previous = prices
+            prices = price_models.advance_prices_sharded(
+                stock_ids, prices, anchors, seed=seed, tick=first_tick + ticks, **options
+            )
+            ticks += 1
+            batch.extend(zip(id_list, prices.tolist(), repeat(to_utc_text(tick_dt))))
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+
+        if update_prices and rows_written:
+            conn.executemany(
+                "UPDATE stocks SET price = ? WHERE stock_id = ?",
+                zip(prices.tolist(), id_list)
+            )
+            # the quotes the dashboard reads: last generated price and the one before it;
+            # tick_id is the last stream tick, where the generator continues from
+            tick_id = conn.execute("SELECT COALESCE(MAX(tick_id), 0) + 1 FROM quotes").fetchone()[0]
+            tick_id = max(tick_id, first_tick + ticks - 1)
+            conn.executemany("""
+                INSERT OR REPLACE INTO quotes (stock_id, price, previous_price, change, tick_id, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [
+                (sid, price, prev, price - prev, tick_id, to_utc_text(tick_dt))
+                for sid, price, prev in zip(id_list, prices.tolist(), previous.tolist())
+            ])
+            quote_bus.publish(conn)
+            conn.commit()
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        if index_sql:
+            progress("Rebuilding price_history indexes...")
+            for sql in index_sql:
+                conn.execute(sql)
+            conn.commit()
+
+    if rows_written and not tick_store.enabled():
+        progress("Updating candles...")
+        if update_prices:
+            # newest history (catch-up): fold the new rows into the existing candles
+            candles.rebuild_candles(conn, after_id=before_id)
+        else:
+            # may be older than existing rows: recompute every candle not
+            # covering archived history
+            candles.rebuild_candles(conn, since=archive.archived_before(conn))
+        conn.commit()
+
+    return rows_written, ticks, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-generate historical price_history rows.")
+    parser.add_argument("--start", required=True, help="first day to generate (YYYY-MM-DD)")
+    parser.add_argument("--end", required=True, help="day to stop before (YYYY-MM-DD)")
+    parser.add_argument("--spacing", type=int, default=60, help="seconds between ticks (default 60)")
+    parser.add_argument("--seed", type=int, required=True, help="seed of the price streams")
+    parser.add_argument("--batch", type=int, default=100_000, help="rows per transaction")
+    parser.add_argument("--update-prices", action="store_true",
+                        help="store the final generated prices in stocks.price and quotes")
+    parser.add_argument("--db", default=DB_NAME, help=f"database file (default {DB_NAME})")
+    args = parser.parse_args()
+
+    start = datetime.strptime(args.start, "%Y-%m-%d")
+    end = datetime.strptime(args.end, "%Y-%m-%d")
+    if end <= start or args.spacing <= 0:
+        parser.error("--end must be after --start and --spacing must be positive")
+
+    migrations.migrate(args.db)
+    conn = sqlite3.connect(args.db)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA busy_timeout = 5000;")
+    try:
+        rows, _, elapsed = backfill_history(
+            conn, start, end, args.spacing, args.seed,
+            batch_size=args.batch, update_prices=args.update_prices
+        )
+    finally:
+        conn.close()
+    tick_version.bump(args.db)
+
+    rate = rows / elapsed if elapsed else 0
+    print(f"Backfill complete: {rows} rows in {elapsed:.1f}s ({rate:,.0f} rows/sec)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark of the /api/prices wire formats (see quote_codec.py).
+
+Encodes a synthetic market of --symbols stocks in every format, as a full
+snapshot and as a delta with --changed of the stocks updated, and prints
+payload size and encode time (best of --repeat runs).
+
+Usage:
+    python bench_quotes.py --symbols 10000
+"""
+
+import argparse
+import gzip
+import json
+import time
+
+import numpy as np
+
+import quote_codec
+
+
+def synthetic_quotes(count, seed=1):
+    rng = np.random.default_rng(seed)
+    prices = np.round(rng.uniform(5, 500, count), 2)
+    changes = np.round(rng.normal(0, 0.5, count), 2)
+    return [
+        {
+            "stock_id": i + 1,
+            "symbol": f"S{i + 1:05d}",
+            "company_name": f"Synthetic Company {i + 1} Incorporated",
+            "price": float(prices[i]),
+            "last_change": float(changes[i]),
+        }
+        for i in range(count)
+    ]
+
+
+def best_time(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare /api/prices payload encodings.")
+    parser.add_argument("--symbols", type=int, default=10_000)
+    parser.add_argument("--changed", type=float, default=0.1, help="share of stocks in a delta")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    quotes = synthetic_quotes(args.symbols)
+    delta = quotes[::max(1, round(1 / args.changed))]
+
+    cases = [
+        ("objects, stdlib json (before)", lambda: json.dumps(quotes).encode()),
+        ("objects", lambda: quote_codec.encode("objects", quotes, 1)),
+        ("columnar full", lambda: quote_codec.encode("columnar", quotes, 1)),
+        ("columnar delta", lambda: quote_codec.encode("columnar", delta, 1, full=False)),
+        ("binary full", lambda: quote_codec.encode("binary", quotes, 1)),
+        ("binary delta", lambda: quote_codec.encode("binary", delta, 1, full=False)),
+    ]
+
+    print(f"{args.symbols} symbols, delta = {len(delta)} changed quotes")
+    print(f"{'format':32} {'bytes':>10} {'gzip bytes':>11} {'encode ms':>10}")
+    for name, fn in cases:
+        elapsed, body = best_time(fn, args.repeat)
+        print(f"{name:32} {len(body):>10,} {len(gzip.compress(body)):>11,} {elapsed * 1000:>10.2f}")
+
+    # the binary format must round-trip to the cent
+    _, _, ids, prices, changes = quote_codec.decode_binary(quote_codec.encode("binary", quotes, 1))
+    assert ids.tolist() == [q["stock_id"] for q in quotes]
+    assert np.allclose(prices, [q["price"] for q in quotes], atol=0.005)
+    assert np.allclose(changes, [q["last_change"] for q in quotes], atol=0.005)
+
+
+if __name__ == '__main__':
+    main()
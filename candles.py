@@ -0,0 +1,180 @@
+"""
+OHLC candle rollups of price_history.
+
+Candles are kept in one table, keyed by (stock_id, resolution, bucket), where
+resolution is the bucket size in seconds and bucket is the bucket start as a
+UTC unix timestamp. The generator updates every resolution incrementally in
+the tick transaction (record_tick); rebuild_candles recomputes them from
+price_history after bulk loads.
+"""
+
+import calendar
+from datetime import datetime
+
+
+# label -> bucket size in seconds, finest first
+RESOLUTIONS = {
+    "1m": 60,
+    "5m": 300,
+    "1h": 3600,
+    "1d": 86400,
+}
+
+# points an "auto" request aims for
+AUTO_TARGET_POINTS = 500
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def to_epoch(timestamp):
+    """UTC 'YYYY-MM-DD HH:MM:SS' text (as stored in price_history) -> unix seconds."""
+    return calendar.timegm(datetime.strptime(timestamp[:19], TIME_FORMAT).timetuple())
+
+
+def to_text(epoch):
+    """Unix seconds -> UTC 'YYYY-MM-DD HH:MM:SS' text."""
+    return datetime.utcfromtimestamp(epoch).strftime(TIME_FORMAT)
+
+
+UPSERT_SQL = """
+    INSERT INTO candles (stock_id, resolution, bucket, open, high, low, close, ticks)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(stock_id, resolution, bucket) DO UPDATE SET
+        high = MAX(high, excluded.high),
+        low = MIN(low, excluded.low),
+        close = excluded.close,
+        ticks = ticks + excluded.ticks
+"""
+
+
+def record_tick(conn, updates, timestamp):
+    """
+    Folds one tick into the candle of every resolution.
+    Runs inside the caller's (tick) transaction.
+
+    :param updates: List of (stock_id, new_price) tuples
+    :param timestamp: UTC tick timestamp text
+    """
+    epoch = to_epoch(timestamp)
+    rows = []
+    for seconds in RESOLUTIONS.values():
+        bucket = epoch - epoch % seconds
+        rows.extend(
+            (stock_id, seconds, bucket, price, price, price, price, 1)
+            for stock_id, price in updates
+        )
+    conn.executemany(UPSERT_SQL, rows)
+
+
+def record_rows(conn, rows):
+    """
+    Folds (stock_id, price, timestamp) rows, oldest first, into the candles
+    (bulk loads that bypass price_history, see tick_store.py).
+    Runs inside the caller's transaction.
+    """
+    epochs = {}
+    for seconds in RESOLUTIONS.values():
+        buckets = {}
+        for stock_id, price, timestamp in rows:
+            epoch = epochs.get(timestamp)
+            if epoch is None:
+                epoch = epochs[timestamp] = to_epoch(timestamp)
+            key = (stock_id, epoch - epoch % seconds)
+            candle = buckets.get(key)
+            if candle is None:
+                buckets[key] = [price, price, price, price, 1]
+            else:
+                candle[1] = max(candle[1], price)
+                candle[2] = min(candle[2], price)
+                candle[3] = price
+                candle[4] += 1
+        conn.executemany(UPSERT_SQL, [
+            (stock_id, seconds, bucket, *candle)
+            for (stock_id, bucket), candle in buckets.items()
+        ])
+
+
+def rebuild_candles(conn, after_id=None, since=None):
+    """
+    Recomputes candles from price_history.
+
+    :param after_id: only fold in price_history rows with a larger id, merging
+                     them into existing candles (rows must be newer than what the
+                     candles already hold, e.g. after a catch-up). None rebuilds
+                     every candle from scratch.
+    :param since: with after_id None, only rebuild candles from this unix time
+                  (a UTC midnight) on, keeping older ones, e.g. the candles of
+                  archived history (see archive.py)
+    """
+    since_ts = to_text(since) if since else ""
+    if after_id is None:
+        conn.execute("DELETE FROM candles WHERE bucket >= ?", (since or 0,))
+    for seconds in RESOLUTIONS.values():
+        conn.execute(f"""
+            INSERT INTO candles (stock_id, resolution, bucket, open, high, low, close, ticks)
+            SELECT g.stock_id, {seconds}, g.bucket, o.price, g.high, g.low, c.price, g.ticks
+            FROM (
+                SELECT stock_id,
+                       CAST(strftime('%s', timestamp) AS INTEGER) / {seconds} * {seconds} AS bucket,
+                       MIN(id) AS first_id, MAX(id) AS last_id,
+                       MAX(price) AS high, MIN(price) AS low, COUNT(*) AS ticks
+                FROM price_history
+                WHERE id > ? AND timestamp >= ?
+                GROUP BY stock_id, bucket
+            ) g
+            JOIN price_history o ON o.id = g.first_id
+            JOIN price_history c ON c.id = g.last_id
+            WHERE true
+            ON CONFLICT(stock_id, resolution, bucket) DO UPDATE SET
+                high = MAX(high, excluded.high),
+                low = MIN(low, excluded.low),
+                close = excluded.close,
+                ticks = ticks + excluded.ticks
+        """, (after_id or 0, since_ts))
+
+
+def choose_resolution(requested, start, end):
+    """
+    Picks the stored resolution that serves a request.
+
+    :param requested: "raw", a RESOLUTIONS label, a number of seconds, or "auto"
+    :param start: range start (unix seconds) or None
+    :param end: range end (unix seconds) or None
+    :return: bucket seconds, or None for raw ticks
+    """
+    if requested in (None, "", "raw"):
+        return None
+
+    if requested == "auto":
+        if start is None or end is None:
+            return RESOLUTIONS["1h"]
+        span = max(0, end - start)
+        # coarsest resolution that still gives the target number of points;
+        # ranges too short for even 1m candles get raw ticks
+        fitting = [s for s in RESOLUTIONS.values() if span / s >= AUTO_TARGET_POINTS]
+        return max(fitting) if fitting else None
+
+    seconds = RESOLUTIONS.get(requested)
+    if seconds is None:
+        seconds = int(requested)
+    # coarsest stored resolution no coarser than what was asked for
+    fitting = [s for s in RESOLUTIONS.values() if s <= seconds]
+    return max(fitting) if fitting else None
+
+
+FETCH_CANDLES_SQL = """
+    SELECT bucket, open, high, low, close, ticks
+    FROM candles
+    WHERE stock_id = ? AND resolution = ? AND bucket >= ? AND bucket < ?
+    ORDER BY bucket ASC
+"""
+
+
+def fetch_candles(conn, stock_id, resolution, start=None, end=None):
+    """Candles of one stock at `resolution` seconds within [start, end), oldest first."""
+    return conn.execute(FETCH_CANDLES_SQL, (
+        stock_id,
+        resolution,
+        start - start % resolution if start is not None else 0,
+        end if end is not None else 2 ** 62,
+    )).fetchall()
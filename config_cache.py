@@ -0,0 +1,48 @@
+"""
+Process-wide cache of the singleton config rows: the market schedule and the
+price generator settings.
+
+Every buy, sell, market status poll and generator loop iteration used to
+read these rows from the database. Each process now keeps the last row it
+loaded, tagged with the config version: a number in a small file next to the
+database (stock_trading.db.config, see tick_version.py) that every write to
+these tables bumps after its commit. Checking the cache is one stat() call,
+so it costs no database work until something actually changed, and an admin
+edit in one process reaches every other process on its next read.
+
+Writes made outside the app (sqlite3 shell, scripts) must call invalidate()
+or bump the file to be seen.
+"""
+
+from threading import Lock
+
+import tick_version
+
+
+VERSION_NAME = "config"
+
+cache = {}  # (db_name, key) -> (config version, value)
+lock = Lock()
+
+
+def get(db_name, key, load):
+    """
+    The cached value for `key`, or load() if the config changed since it
+    was cached (or it never was).
+    """
+    version = tick_version.read(db_name, VERSION_NAME)
+    cached = cache.get((db_name, key))
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with lock:
+        # the version is read before loading, so a write committed meanwhile
+        # leaves the entry outdated and the next call reloads it
+        value = load()
+        cache[(db_name, key)] = (version, value)
+        return value
+
+
+def invalidate(db_name):
+    """Call after committing a write to a cached table."""
+    tick_version.bump(db_name, VERSION_NAME)
+    cache.clear()
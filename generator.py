@@ -0,0 +1,35 @@
+"""
+Runs the stock price generator as its own process.
+
+Start the web app with the embedded generator turned off, then run this once
+(or on several hosts/processes for failover; only the lease holder ticks):
+
+    EQUISENSE_GENERATOR=off gunicorn app:app
+    python generator.py
+"""
+
+import os
+import signal
+import sys
+
+# importing app must not start a second, embedded generator in this process
+os.environ["EQUISENSE_GENERATOR"] = "off"
+
+import app
+
+
+def main():
+    # treat SIGTERM like Ctrl+C so the lease is released and a standby takes over at once
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Standalone price generator {app.generator_lease['holder']} starting")
+    try:
+        app.start_generator(block=True)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        app.release_generator_lease()
+        print("Standalone price generator stopped")
+
+
+if __name__ == '__main__':
+    main()
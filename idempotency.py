@@ -0,0 +1,85 @@
+"""
+Idempotency keys for the JSON trading API.
+
+A client sends an Idempotency-Key header with a trade or cash request and
+reuses it when retrying. The first request that succeeds stores its
+response under (user_id, key) in the same transaction as the trade; a retry
+with the same key and the same body gets that stored response back instead
+of trading again. Reusing a key for a different request is an error.
+
+Only successful responses are stored: a rejected request changed nothing,
+so retrying it simply runs it again.
+
+Keys expire after TTL_HOURS and each user keeps at most KEYS_PER_USER of
+them, so the table stays small.
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+
+TTL_HOURS = float(os.environ.get("EQUISENSE_IDEMPOTENCY_TTL_HOURS", "24"))
+KEYS_PER_USER = int(os.environ.get("EQUISENSE_IDEMPOTENCY_KEYS_PER_USER", "1000"))
+MAX_KEY_LENGTH = 255
+
+
+LOOKUP_SQL = "SELECT request_hash, response FROM idempotency_keys WHERE user_id = ? AND key = ?"
+
+PRUNE_EXPIRED_SQL = "DELETE FROM idempotency_keys WHERE created_at < ?"
+
+# everything older than the user's KEYS_PER_USER-th newest key
+PRUNE_USER_SQL = """
+    DELETE FROM idempotency_keys
+    WHERE user_id = ? AND (created_at, key) < (
+        SELECT created_at, key FROM idempotency_keys
+        WHERE user_id = ?
+        ORDER BY created_at DESC, key DESC
+        LIMIT 1 OFFSET ?
+    )
+"""
+
+
+class KeyReused(Exception):
+    """The key was already used for a different request."""
+
+
+def fingerprint(endpoint, payload):
+    """Hash of the endpoint and the request body (key order does not matter)."""
+    canonical = json.dumps([endpoint, payload], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def prune(conn, user_id, now=None):
+    """Deletes expired keys, and the user's oldest keys beyond KEYS_PER_USER."""
+    now = now or datetime.utcnow()
+    cutoff = (now - timedelta(hours=TTL_HOURS)).strftime("%Y-%m-%d %H:%M:%S")
+    conn.execute(PRUNE_EXPIRED_SQL, (cutoff,))
+    conn.execute(PRUNE_USER_SQL, (user_id, user_id, KEYS_PER_USER - 1))
+
+
+def run(conn, user_id, key, endpoint, payload, fn, *args):
+    """
+    Runs fn(conn, *args) at most once per (user_id, key). Runs inside the
+    caller's transaction (a trade writer job).
+
+    :param payload: the request body; a retry must send the same one
+    :return: (fn's result or the stored one, True if it was replayed)
+    :raises KeyReused: if the key was used for a different request
+    """
+    request_hash = fingerprint(endpoint, payload)
+    row = conn.execute(LOOKUP_SQL, (user_id, key)).fetchone()
+    if row is not None:
+        if row[0] != request_hash:
+            raise KeyReused(f"Idempotency-Key {key!r} was already used for a different request")
+        return json.loads(row[1]), True
+
+    result = fn(conn, *args)
+    now = datetime.utcnow()
+    conn.execute("""
+        INSERT INTO idempotency_keys (user_id, key, request_hash, response, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, (user_id, key, request_hash, json.dumps(result), now.strftime("%Y-%m-%d %H:%M:%S.%f")))
+    prune(conn, user_id, now)
+    return result, False
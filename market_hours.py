@@ -0,0 +1,85 @@
+"""
+Market schedule helpers that work on a market_schedule row and plain datetimes.
+
+Used by the backfill command and the generator scheduler, which need actual
+trading session boundaries rather than the open/closed answer of
+get_market_status(). Times are local, like get_market_status().
+"""
+
+from datetime import datetime, timedelta
+
+
+def _parse_hhmm(value, fallback):
+    try:
+        h, m = [int(x) for x in value.split(":")]
+        return h, m
+    except (AttributeError, ValueError):
+        return fallback
+
+
+def parse_holidays(schedule):
+    """
+    Returns the date part of each holiday line ("MM-DD" or "YYYY-MM-DD").
+    Holiday lines look like "12-25 - Christmas".
+    """
+    holidays_raw = schedule["holidays"] or ""
+    return [h.split(" - ")[0].strip() for h in holidays_raw.split("\n") if h.strip()]
+
+
+def is_trading_day(schedule, day, holidays=None):
+    """True if `day` is a configured trading day and not a holiday."""
+    trading_days = (schedule["trading_days"] or "").split(",")
+    if day.strftime("%A").lower() not in trading_days:
+        return False
+    if holidays is None:
+        holidays = parse_holidays(schedule)
+    return day.strftime("%m-%d") not in holidays and day.strftime("%Y-%m-%d") not in holidays
+
+
+def session_bounds(schedule, day, holidays=None):
+    """
+    Returns (open_dt, close_dt) for the trading session on `day`, or None.
+    The session includes its closing minute, as in get_market_status().
+    """
+    if not is_trading_day(schedule, day, holidays):
+        return None
+    open_h, open_m = _parse_hhmm(schedule["open_time"], (9, 30))
+    close_h, close_m = _parse_hhmm(schedule["close_time"], (16, 0))
+    base = datetime(day.year, day.month, day.day)
+    open_dt = base.replace(hour=open_h, minute=open_m)
+    close_dt = base.replace(hour=close_h, minute=close_m) + timedelta(seconds=59)
+    if close_dt <= open_dt:
+        return None
+    return open_dt, close_dt
+
+
+def trading_sessions(schedule, start, end):
+    """
+    Yields (open_dt, close_dt) for every session overlapping [start, end),
+    clipped to that range.
+    """
+    holidays = parse_holidays(schedule)
+    day = datetime(start.year, start.month, start.day)
+    while day < end:
+        bounds = session_bounds(schedule, day, holidays)
+        if bounds:
+            open_dt, close_dt = max(bounds[0], start), min(bounds[1], end)
+            if open_dt < close_dt:
+                yield open_dt, close_dt
+        day += timedelta(days=1)
+
+
+def next_session(schedule, from_dt, max_days=366):
+    """
+    Returns (open_dt, close_dt) of the session in progress at `from_dt`,
+    or of the next one to open. None if nothing opens within `max_days`.
+    Ignores manual_override, which has no end time.
+    """
+    holidays = parse_holidays(schedule)
+    day = datetime(from_dt.year, from_dt.month, from_dt.day)
+    for _ in range(max_days + 1):
+        bounds = session_bounds(schedule, day, holidays)
+        if bounds and bounds[1] >= from_dt:
+            return bounds
+        day += timedelta(days=1)
+    return None
@@ -0,0 +1,654 @@
+"""
+Versioned schema migrations for stock_trading.db.
+
+The schema version is kept in PRAGMA user_version. Each migration runs once,
+in order, inside its own transaction, so an existing database is upgraded in
+place and a new one is built from scratch by the same steps.
+
+Usage:
+    python migrations.py            # upgrade stock_trading.db to the latest version
+    python migrations.py --check    # also verify no hot query falls back to a table scan
+"""
+
+import argparse
+import sqlite3
+import sys
+
+import candles
+import idempotency
+import queries
+import quote_bus
+
+
+DB_NAME = 'stock_trading.db'
+
+
+def add_column(conn, table, column, definition):
+    """ALTER TABLE ... ADD COLUMN, skipped if the column already exists."""
+    existing = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in existing:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def migration_1(conn):
+    """Base schema (tables of the original DBCreationScript)."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        email TEXT NOT NULL UNIQUE,
+        balance REAL DEFAULT 0.0,
+        password_hash TEXT NOT NULL,
+        is_admin INTEGER DEFAULT 0,
+        total_deposited REAL DEFAULT 0.0,
+        total_withdrawn REAL DEFAULT 0.0
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stocks (
+        stock_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        symbol TEXT NOT NULL UNIQUE,
+        company_name TEXT NOT NULL,
+        price REAL NOT NULL
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS orders (
+        order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        stock_id INTEGER NOT NULL,
+        order_type TEXT CHECK(order_type IN ('BUY', 'SELL')) NOT NULL,
+        quantity INTEGER NOT NULL,
+        price REAL NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        cash_after REAL DEFAULT 0,
+        realized_pl REAL DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        FOREIGN KEY (stock_id) REFERENCES stocks(stock_id)
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS portfolio (
+        portfolio_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        stock_id INTEGER NOT NULL,
+        quantity INTEGER DEFAULT 0,
+        avg_cost REAL DEFAULT 0,
+        total_invested REAL DEFAULT 0,
+        last_updated TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        FOREIGN KEY (stock_id) REFERENCES stocks(stock_id)
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS transaction_history (
+        transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        stock_id INTEGER NOT NULL,
+        order_type TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        price REAL NOT NULL,
+        total_value REAL NOT NULL,
+        cash_before REAL NOT NULL,
+        cash_after REAL NOT NULL,
+        realized_pl REAL DEFAULT 0,
+        timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        FOREIGN KEY (stock_id) REFERENCES stocks(stock_id)
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS market_schedule (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        open_time TEXT DEFAULT '09:30',
+        close_time TEXT DEFAULT '16:00',
+        timezone TEXT DEFAULT 'EST',
+        trading_days TEXT DEFAULT 'monday,tuesday,wednesday,thursday,friday',
+        holidays TEXT DEFAULT '',
+        manual_override INTEGER DEFAULT 0,
+        manual_message TEXT DEFAULT ''
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS logs (
+        log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT DEFAULT (DATETIME('now')),
+        user_id INTEGER,
+        type INTEGER NOT NULL,
+        details TEXT,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS price_generator_settings (
+        id INTEGER PRIMARY KEY CHECK(id = 1),
+        enabled INTEGER DEFAULT 1,
+        interval_seconds INTEGER DEFAULT 10,
+        volatility REAL DEFAULT 0.01,
+        trend_bias REAL DEFAULT 0.0,
+        exaggeration REAL DEFAULT 1.0
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS price_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        stock_id INTEGER NOT NULL,
+        price REAL NOT NULL,
+        timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (stock_id) REFERENCES stocks(stock_id)
+    )''')
+    # columns added to early databases by hand
+    add_column(conn, "users", "total_deposited", "REAL DEFAULT 0.0")
+    add_column(conn, "users", "total_withdrawn", "REAL DEFAULT 0.0")
+    add_column(conn, "price_generator_settings", "exaggeration", "REAL DEFAULT 1.0")
+
+
+def migration_2(conn):
+    """Price model, sharding and catch-up settings; generator leader lease."""
+    add_column(conn, "price_generator_settings", "model", "TEXT DEFAULT 'gbm'")
+    add_column(conn, "price_generator_settings", "model_params", "TEXT DEFAULT '{}'")
+    add_column(conn, "price_generator_settings", "workers", "INTEGER DEFAULT 1")
+    add_column(conn, "price_generator_settings", "seed", "INTEGER")
+    add_column(conn, "price_generator_settings", "catchup_policy", "TEXT DEFAULT 'skip'")
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS generator_lease (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        holder TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )''')
+
+
+def migration_3(conn):
+    """Covering indexes for the hot queries (see HOT_QUERIES)."""
+    # chart history, latest/previous price lookups, portfolio chart
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_price_history_stock_time "
+                 "ON price_history (stock_id, timestamp, price)")
+    # /api/prices: newest rows per stock by id (dropped again in migration 4)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_price_history_stock_id "
+                 "ON price_history (stock_id, id, price)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transaction_history_user_time "
+                 "ON transaction_history (user_id, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_portfolio_user_stock "
+                 "ON portfolio (user_id, stock_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_time "
+                 "ON orders (user_id, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_type_time ON logs (type, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_time ON logs (timestamp)")
+
+
+def migration_4(conn):
+    """Materialized latest/previous quote per stock, seeded from price_history."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS quotes (
+        stock_id INTEGER PRIMARY KEY,
+        price REAL NOT NULL,
+        previous_price REAL,
+        change REAL DEFAULT 0,
+        tick_id INTEGER DEFAULT 0,
+        updated_at TEXT,
+        FOREIGN KEY (stock_id) REFERENCES stocks(stock_id)
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_quotes_tick ON quotes (tick_id)")
+    # one-off seed: the last two history rows of each stock
+    conn.execute('''
+    INSERT OR REPLACE INTO quotes (stock_id, price, previous_price, change, tick_id, updated_at)
+    SELECT s.stock_id,
+           COALESCE(h1.price, s.price),
+           COALESCE(h2.price, h1.price, s.price),
+           COALESCE(h1.price - h2.price, 0),
+           0,
+           h1.timestamp
+    FROM stocks s
+    LEFT JOIN (
+        SELECT stock_id, price, timestamp,
+               ROW_NUMBER() OVER (PARTITION BY stock_id ORDER BY id DESC) AS rn
+        FROM price_history
+    ) h1 ON h1.stock_id = s.stock_id AND h1.rn = 1
+    LEFT JOIN (
+        SELECT stock_id, price,
+               ROW_NUMBER() OVER (PARTITION BY stock_id ORDER BY id DESC) AS rn
+        FROM price_history
+    ) h2 ON h2.stock_id = s.stock_id AND h2.rn = 2
+    ''')
+    # only the old /api/prices window query used this; it cost a write per tick
+    conn.execute("DROP INDEX IF EXISTS idx_price_history_stock_id")
+
+
+def migration_5(conn):
+    """OHLC candles at 1m/5m/1h/1d, built from the existing price_history."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS candles (
+        stock_id INTEGER NOT NULL,
+        resolution INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        open REAL NOT NULL,
+        high REAL NOT NULL,
+        low REAL NOT NULL,
+        close REAL NOT NULL,
+        ticks INTEGER DEFAULT 0,
+        PRIMARY KEY (stock_id, resolution, bucket)
+    ) WITHOUT ROWID''')
+    candles.rebuild_candles(conn)
+
+
+def migration_6(conn):
+    """Retention window of full-resolution ticks (0 = keep everything in price_history)."""
+    add_column(conn, "price_generator_settings", "retention_days", "INTEGER DEFAULT 0")
+
+
+def migration_7(conn):
+    """Per-user minute snapshots of holdings value, seeded from the 1m candles."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS equity_snapshots (
+        user_id INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        holdings_value REAL NOT NULL,
+        PRIMARY KEY (user_id, bucket)
+    ) WITHOUT ROWID''')
+
+    # current positions valued at every past minute, each stock at its last
+    # close as of that minute (what the old chart summed from price_history)
+    minute = candles.RESOLUTIONS["1m"]
+    users = conn.execute(
+        "SELECT DISTINCT user_id FROM portfolio WHERE quantity > 0"
+    ).fetchall()
+    for (user_id,) in users:
+        conn.execute("""
+            INSERT OR REPLACE INTO equity_snapshots (user_id, bucket, holdings_value)
+            SELECT ?, b.bucket, COALESCE(SUM(p.quantity * (
+                       SELECT c.close FROM candles c
+                       WHERE c.stock_id = p.stock_id AND c.resolution = ? AND c.bucket <= b.bucket
+                       ORDER BY c.bucket DESC LIMIT 1
+                   )), 0)
+            FROM (
+                SELECT DISTINCT bucket FROM candles
+                WHERE resolution = ? AND stock_id IN (
+                    SELECT stock_id FROM portfolio WHERE user_id = ? AND quantity > 0
+                )
+            ) b
+            JOIN portfolio p ON p.user_id = ? AND p.quantity > 0
+            GROUP BY b.bucket
+        """, (user_id, minute, minute, user_id, user_id))
+
+
+def migration_8(conn):
+    """Quote change feed read by every web worker (see quote_bus.py)."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS quote_feed (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL CHECK (kind IN ('tick', 'reset')),
+        tick_id INTEGER,
+        payload TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+
+def migration_9(conn):
+    """Resting limit orders (the in-memory order books are rebuilt from these)."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS limit_orders (
+        order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        stock_id INTEGER NOT NULL,
+        side TEXT CHECK(side IN ('BUY', 'SELL')) NOT NULL,
+        quantity INTEGER NOT NULL,
+        filled INTEGER NOT NULL DEFAULT 0,
+        limit_price REAL NOT NULL,
+        status TEXT CHECK(status IN ('open', 'filled', 'cancelled')) NOT NULL DEFAULT 'open',
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_limit_orders_user_status "
+                 "ON limit_orders (user_id, status, stock_id)")
+
+
+def migration_10(conn):
+    """One portfolio row per (user, stock), enforced by a unique index."""
+    duplicates = conn.execute("""
+        SELECT user_id, stock_id, MIN(portfolio_id), SUM(quantity), SUM(total_invested)
+        FROM portfolio
+        GROUP BY user_id, stock_id
+        HAVING COUNT(*) > 1
+    """).fetchall()
+    for user_id, stock_id, keep_id, quantity, total_invested in duplicates:
+        conn.execute("DELETE FROM portfolio WHERE user_id = ? AND stock_id = ? AND portfolio_id <> ?",
+                     (user_id, stock_id, keep_id))
+        conn.execute("""
+            UPDATE portfolio
+            SET quantity = ?, total_invested = ?,
+                avg_cost = CASE WHEN ? > 0 THEN ? / ? ELSE avg_cost END
+            WHERE portfolio_id = ?
+        """, (quantity, total_invested, quantity, total_invested, quantity, keep_id))
+    conn.execute("DROP INDEX IF EXISTS idx_portfolio_user_stock")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_portfolio_user_stock_unique "
+                 "ON portfolio (user_id, stock_id)")
+
+
+def migration_11(conn):
+    """Idempotency keys of the JSON trading API (see idempotency.py)."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        user_id INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        request_hash TEXT NOT NULL,
+        response TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        PRIMARY KEY (user_id, key)
+    ) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created "
+                 "ON idempotency_keys (created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_user_created "
+                 "ON idempotency_keys (user_id, created_at)")
+
+
+def migration_12(conn):
+    """Stop-loss and take-profit triggers on positions (see triggers.py)."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS trigger_orders (
+        trigger_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        stock_id INTEGER NOT NULL,
+        kind TEXT CHECK(kind IN ('stop_loss', 'take_profit')) NOT NULL,
+        quantity INTEGER NOT NULL,
+        trigger_price REAL NOT NULL,
+        status TEXT CHECK(status IN ('open', 'executed', 'cancelled')) NOT NULL DEFAULT 'open',
+        fill_price REAL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trigger_orders_user_status "
+                 "ON trigger_orders (user_id, status)")
+
+
+def migration_13(conn):
+    """Index for expiring equity snapshots by age (see prune_equity_snapshots in app.py)."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_equity_snapshots_bucket "
+                 "ON equity_snapshots (bucket)")
+
+
+MIGRATIONS = [
+    (1, migration_1),
+    (2, migration_2),
+    (3, migration_3),
+    (4, migration_4),
+    (5, migration_5),
+    (6, migration_6),
+    (7, migration_7),
+    (8, migration_8),
+    (9, migration_9),
+    (10, migration_10),
+    (11, migration_11),
+    (12, migration_12),
+    (13, migration_13),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_name=DB_NAME, verbose=False):
+    """
+    Applies every migration newer than the database's user_version.
+    Returns the resulting version.
+    """
+    conn = sqlite3.connect(db_name, timeout=30)
+    conn.isolation_level = None  # transactions are managed explicitly below
+    try:
+        for version, step in MIGRATIONS:
+            if schema_version(conn) >= version:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # re-check under the write lock: another process may have just migrated
+                if schema_version(conn) >= version:
+                    conn.execute("ROLLBACK")
+                    continue
+                step(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            if verbose:
+                print(f"Applied migration {version}: {step.__doc__.strip()}")
+        return schema_version(conn)
+    finally:
+        conn.close()
+
+
+# ---------------------------------------------------------------------------
+# Query plan check
+# ---------------------------------------------------------------------------
+
+# The hot queries, with representative parameters. The SQL is the constants
+# the app itself executes, so the check cannot drift from the code. Tables
+# listed in `full_scan_ok` are read in full by design (e.g. listing every stock).
+LOGS_FILTER = " WHERE type IN (?, ?)"
+HOT_QUERIES = [
+    {
+        "name": "dashboard: quotes",
+        "sql": queries.DASHBOARD_QUOTES_SQL,
+        "params": (),
+        "full_scan_ok": ("stocks",),
+    },
+    {
+        "name": "dashboard: portfolio",
+        "sql": queries.DASHBOARD_PORTFOLIO_SQL,
+        "params": (1,),
+    },
+    {
+        "name": "dashboard: equity snapshots",
+        "sql": queries.EQUITY_CHART_SQL,
+        "params": (1, 1440),
+    },
+    {
+        "name": "dashboard: transaction count",
+        "sql": queries.TRANSACTION_COUNT_SQL,
+        "params": (1,),
+    },
+    {
+        "name": "dashboard: transaction page",
+        "sql": queries.TRANSACTION_PAGE_SQL,
+        "params": (1, 20, 0),
+    },
+    {
+        "name": "dashboard: open limit orders",
+        "sql": queries.OPEN_LIMIT_ORDERS_SQL,
+        "params": (1,),
+    },
+    {
+        "name": "dashboard: open triggers",
+        "sql": queries.OPEN_TRIGGERS_SQL,
+        "params": (1,),
+    },
+    {
+        "name": "quote_bus: reload",
+        "sql": quote_bus.RELOAD_SQL,
+        "params": (),
+        "full_scan_ok": ("stocks",),
+    },
+    {
+        "name": "quote_bus: feed after cursor",
+        "sql": quote_bus.FEED_AFTER_SQL,
+        "params": (0,),
+    },
+    {
+        "name": "api_price_history: since_id cursor",
+        "sql": queries.HISTORY_CURSOR_SQL,
+        "params": (1, 1),
+    },
+    {
+        "name": "api_price_history: raw range",
+        "sql": queries.HISTORY_RANGE_SQL,
+        "params": (1, "2025-01-01 00:00:00", "2025-02-01 00:00:00", "", 0),
+    },
+    {
+        "name": "api_price_history: candles",
+        "sql": candles.FETCH_CANDLES_SQL,
+        "params": (1, 3600, 0, 2 ** 62),
+    },
+    {
+        "name": "trade: position quantity",
+        "sql": queries.POSITION_QUANTITY_SQL,
+        "params": (1, 1),
+    },
+    {
+        "name": "trade: equity snapshot",
+        "sql": queries.USER_EQUITY_SNAPSHOT_SQL,
+        "params": (1, 0, 1),
+    },
+    {
+        "name": "archive: prune equity snapshots",
+        "sql": queries.PRUNE_EQUITY_SNAPSHOTS_SQL,
+        "params": (0,),
+    },
+    {
+        "name": "limit order: open sell quantity",
+        "sql": queries.OPEN_SELL_QUANTITY_SQL,
+        "params": (1, 1),
+    },
+    {
+        "name": "idempotency: key lookup",
+        "sql": idempotency.LOOKUP_SQL,
+        "params": (1, "k"),
+    },
+    {
+        "name": "idempotency: prune expired keys",
+        "sql": idempotency.PRUNE_EXPIRED_SQL,
+        "params": ("2025-01-01 00:00:00",),
+    },
+    {
+        "name": "idempotency: prune user's oldest keys",
+        "sql": idempotency.PRUNE_USER_SQL,
+        "params": (1, 1, 999),
+    },
+    {
+        "name": "tick: equity snapshots",
+        "sql": queries.EQUITY_SNAPSHOTS_SQL,
+        "params": (0,),
+    },
+    {
+        "name": "match_limit_orders: new open orders",
+        "sql": queries.NEW_LIMIT_ORDERS_SQL,
+        "params": (0,),
+    },
+    {
+        "name": "match_limit_orders: order lookup",
+        "sql": queries.LIMIT_ORDER_SQL,
+        "params": (1,),
+    },
+    {
+        "name": "fire_triggers: new open triggers",
+        "sql": queries.NEW_TRIGGERS_SQL,
+        "params": (0,),
+    },
+    {
+        "name": "fire_triggers: fired triggers",
+        "sql": queries.FIRED_TRIGGERS_SQL,
+        "params": ("[1, 2]",),
+    },
+    {
+        "name": "fire_triggers: positions",
+        "sql": queries.FIRED_POSITIONS_SQL,
+        "params": ("[1, 2]",),
+    },
+    {
+        "name": "fire_triggers: balances",
+        "sql": queries.FIRED_BALANCES_SQL,
+        "params": ("[1, 2]",),
+    },
+    {
+        "name": "tick: last transaction",
+        "sql": queries.LAST_TRANSACTION_SQL,
+        "params": (),
+    },
+    {
+        "name": "tick: users with fills",
+        "sql": queries.TICK_TRADERS_SQL,
+        "params": (0,),
+    },
+    {
+        "name": "last_tick_time",
+        "sql": queries.LAST_TICK_SQL,
+        "params": (),
+        "full_scan_ok": ("quotes",),  # one row per stock
+    },
+    {
+        "name": "admin_logs: filtered count",
+        "sql": queries.LOGS_COUNT_SQL.format(where=LOGS_FILTER),
+        "params": (30, 31),
+    },
+    {
+        "name": "admin_logs: filtered page",
+        "sql": queries.LOGS_PAGE_SQL.format(where=LOGS_FILTER),
+        "params": (30, 31, 10, 0),
+    },
+    {
+        "name": "admin_logs: page",
+        "sql": queries.LOGS_PAGE_SQL.format(where=""),
+        "params": (10, 0),
+    },
+]
+
+
+def table_scans(conn, query):
+    """Returns the plan lines of `query` that scan a table without an index."""
+    plan = conn.execute("EXPLAIN QUERY PLAN " + query["sql"], query["params"]).fetchall()
+    allowed = query.get("full_scan_ok", ())
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        if not detail.startswith("SCAN ") or " INDEX" in detail:
+            continue
+        table = detail.split()[1]
+        # subquery/CTE scans ("SCAN L", "SCAN lp1") read materialized results, not tables
+        if table in allowed or not is_table(conn, table, query["sql"]):
+            continue
+        scans.append(detail)
+    return scans
+
+
+def is_table(conn, name, sql):
+    """True if `name` is a table, or an alias of one, in `sql`."""
+    tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    if name in tables:
+        return True
+    words = sql.replace("(", " ").replace(")", " ").split()
+    for i, word in enumerate(words[1:], start=1):
+        if word == name and words[i - 1] in tables:
+            return True
+    return False
+
+
+def check_query_plans(db_name=DB_NAME):
+    """
+    Runs EXPLAIN QUERY PLAN on every hot query.
+    Returns a list of (query name, offending plan line).
+    """
+    conn = sqlite3.connect(db_name)
+    try:
+        return [
+            (query["name"], detail)
+            for query in HOT_QUERIES
+            for detail in table_scans(conn, query)
+        ]
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upgrade the database schema in place.")
+    parser.add_argument("--db", default=DB_NAME, help=f"database file (default {DB_NAME})")
+    parser.add_argument("--check", action="store_true",
+                        help="fail if any hot query falls back to a table scan")
+    args = parser.parse_args()
+
+    version = migrate(args.db, verbose=True)
+    print(f"Database schema is at version {version}")
+
+    if args.check:
+        problems = check_query_plans(args.db)
+        for name, detail in problems:
+            print(f"TABLE SCAN in {name}: {detail}")
+        if problems:
+            sys.exit(1)
+        print(f"All {len(HOT_QUERIES)} hot queries use indexes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+In-memory limit order books with price-time priority.
+
+One OrderBook per stock holds its resting limit orders in two heaps: bids
+ordered by (highest price, oldest order id) and asks by (lowest price, oldest
+order id). Insert is O(log n). Cancel marks the order removed and it is
+dropped when it reaches the top of its heap (amortised O(log n)), so matching
+only ever touches the orders that actually cross.
+
+The books hold no money or positions; the caller settles every match (see
+match_limit_orders in app.py) and reports back what was filled. The
+limit_orders table is the source of truth and books are rebuilt from it.
+"""
+
+import heapq
+
+
+BUY = "BUY"
+SELL = "SELL"
+
+
+class OrderBook:
+
+    def __init__(self):
+        self.bids = []    # (-limit_price, order_id)
+        self.asks = []    # (limit_price, order_id)
+        self.orders = {}  # order_id -> {"order_id", "user_id", "side", "limit_price", "remaining"}
+
+    def __len__(self):
+        return len(self.orders)
+
+    def add(self, order_id, user_id, side, limit_price, remaining):
+        self.orders[order_id] = {
+            "order_id": order_id,
+            "user_id": user_id,
+            "side": side,
+            "limit_price": limit_price,
+            "remaining": remaining,
+        }
+        if side == BUY:
+            heapq.heappush(self.bids, (-limit_price, order_id))
+        else:
+            heapq.heappush(self.asks, (limit_price, order_id))
+
+    def cancel(self, order_id):
+        """Removes an order (lazily from the heaps). Returns it, or None if unknown."""
+        return self.orders.pop(order_id, None)
+
+    def _top(self, heap):
+        # drop cancelled and filled entries sitting on top
+        while heap and heap[0][1] not in self.orders:
+            heapq.heappop(heap)
+        return self.orders[heap[0][1]] if heap else None
+
+    def best_bid(self):
+        return self._top(self.bids)
+
+    def best_ask(self):
+        return self._top(self.asks)
+
+    def reduce(self, order_id, quantity):
+        """Takes `quantity` off an order, removing it once nothing remains."""
+        order = self.orders.get(order_id)
+        if order is None:
+            return
+        order["remaining"] -= quantity
+        if order["remaining"] <= 0:
+            del self.orders[order_id]
+
+    def crossing_with_price(self, price):
+        """
+        Orders marketable at `price` (bids at or above it, asks at or below
+        it), best first. Stops at the first order that does not cross, so
+        resting orders away from the price are never visited.
+        """
+        for heap, crosses in ((self.bids, lambda o: o["limit_price"] >= price),
+                              (self.asks, lambda o: o["limit_price"] <= price)):
+            skipped = []
+            while True:
+                order = self._top(heap)
+                if order is None or not crosses(order):
+                    break
+                yield order
+                if self._top(heap) is order:
+                    # the caller did not fill or cancel it (e.g. settlement
+                    # failed); set it aside so the loop moves on
+                    skipped.append(heapq.heappop(heap))
+            for entry in skipped:
+                heapq.heappush(heap, entry)
+
+    def crossed_pair(self):
+        """(best bid, best ask) if they cross, else None."""
+        bid, ask = self.best_bid(), self.best_ask()
+        if bid and ask and bid["limit_price"] >= ask["limit_price"]:
+            return bid, ask
+        return None
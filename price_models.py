@@ -0,0 +1,293 @@
+"""
+Vectorized price models for the stock price generator.
+
+Every model advances the whole price vector in one NumPy step:
+
+    new_prices = prices * exp(returns)
+
+where `returns` is built from the generator settings:
+
+- volatility   = standard deviation of the per-tick random return
+- trend_bias   = drift added to every return
+- exaggeration = multiplier applied to every random shock (noise and jumps)
+
+Available models (price_generator_settings.model):
+
+- gbm            : geometric Brownian motion (the original apply_price_change model)
+- mean_reversion : Ornstein-Uhlenbeck on log price, pulled back towards an anchor price
+- jump_diffusion : GBM plus rare normally distributed jumps (Merton)
+- multi_factor   : returns share a set of common market factors, so stocks move together
+
+Model specific parameters live in price_generator_settings.model_params as JSON
+and are merged over DEFAULT_MODEL_PARAMS.
+
+With a seed configured the noise comes from SymbolStreams: every symbol has its
+own counter-based stream keyed by (seed, stock_id, tick), so the universe can be
+split into shards across a process pool (advance_prices_sharded) and still give
+exactly the same prices for any number of workers.
+"""
+
+import json
+
+import numpy as np
+
+
+MODELS = ("gbm", "mean_reversion", "jump_diffusion", "multi_factor")
+
+DEFAULT_MODEL_PARAMS = {
+    "gbm": {},
+    "mean_reversion": {
+        "reversion_speed": 0.05,    # fraction of the log distance to the anchor closed per tick
+    },
+    "jump_diffusion": {
+        "jump_intensity": 0.01,     # expected jumps per stock per tick
+        "jump_mean": 0.0,           # mean log jump size
+        "jump_std": 0.05,           # std dev of the log jump size
+    },
+    "multi_factor": {
+        "factors": 3,               # number of common market factors
+        "factor_share": 0.6,        # share of the return variance explained by the factors
+    },
+}
+
+MIN_PRICE = 0.01
+
+
+def load_model_settings(settings):
+    """
+    Reads the model name and its parameters from a price_generator_settings row.
+
+    Older databases without the model columns fall back to plain GBM.
+    Returns (model, params).
+    """
+    keys = settings.keys()
+    model = settings["model"] if "model" in keys and settings["model"] else "gbm"
+    if model not in MODELS:
+        model = "gbm"
+
+    params = dict(DEFAULT_MODEL_PARAMS[model])
+    raw = settings["model_params"] if "model_params" in keys else None
+    if raw:
+        try:
+            overrides = json.loads(raw)
+        except ValueError:
+            overrides = {}
+        if isinstance(overrides, dict):
+            params.update({k: v for k, v in overrides.items() if k in params})
+
+    return model, params
+
+
+# ---------------------------------------------------------------------------
+# Noise sources
+# ---------------------------------------------------------------------------
+
+class RandomNoise:
+    """
+    Noise source backed by a single numpy Generator.
+
+    normal()/uniform() return one draw per symbol, common_normal(k) returns
+    k draws shared by every symbol (market factors).
+    """
+
+    def __init__(self, size, rng=None):
+        self.size = size
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    def normal(self):
+        return self.rng.standard_normal(self.size)
+
+    def uniform(self):
+        return self.rng.random(self.size)
+
+    def common_normal(self, k):
+        return self.rng.standard_normal(k)
+
+
+# stream key of the draws shared by every symbol (market factors)
+COMMON_STREAM = 0xFFFFFFFF
+
+
+class SymbolStreams:
+    """
+    Counter-based noise source with one reproducible stream per symbol.
+
+    Draw n of tick t for a symbol depends only on (seed, stock_id, t, n), so a
+    shard computes exactly the same numbers as the full universe would and no
+    RNG state ever has to move between processes.
+    """
+
+    def __init__(self, seed, stock_ids, tick):
+        self.seed = int(seed)
+        self.stock_ids = np.asarray(stock_ids, dtype=np.int64)
+        self.tick = int(tick)
+        self.draw = 0
+
+    def _next_draw(self):
+        self.draw += 1
+        return self.draw
+
+    def normal(self):
+        return hash_normal(self.seed, self.stock_ids, self.tick, self._next_draw())
+
+    def uniform(self):
+        return hash_uniform(self.seed, self.stock_ids, self.tick, self._next_draw())
+
+    def common_normal(self, k):
+        return hash_normal(self.seed, COMMON_STREAM, self.tick, self._next_draw(), np.arange(k))
+
+
+def _splitmix64(x):
+    """SplitMix64 finalizer, applied element-wise to a uint64 array."""
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def hash_uniform(*keys):
+    """
+    Deterministic uniforms in (0, 1) derived from integer keys.
+
+    Each key may be a scalar or an array; the result has the broadcast shape.
+    The same keys always give the same value, on any machine or process.
+    """
+    with np.errstate(over="ignore"):
+        h = np.uint64(0)
+        for key in keys:
+            h = _splitmix64(h ^ np.asarray(key).astype(np.uint64))
+    # top 53 bits -> (0, 1), never exactly 0 so log() is safe
+    return ((h >> np.uint64(11)).astype(np.float64) + 0.5) / float(1 << 53)
+
+
+def hash_normal(*keys):
+    """Deterministic standard normals derived from integer keys (Box-Muller)."""
+    u1 = hash_uniform(*keys, 1)
+    u2 = hash_uniform(*keys, 2)
+    return np.sqrt(-2.0 * np.log(u1)) * np.cos(2.0 * np.pi * u2)
+
+
+def factor_loadings(stock_ids, factors):
+    """
+    Unit-length factor loadings per stock, fixed for the life of the stock.
+
+    Derived from the stock_id so every process (and every restart) sees the
+    same correlation structure without storing it.
+    """
+    ids = np.asarray(stock_ids, dtype=np.int64)[:, None]
+    loadings = hash_normal(ids, np.arange(factors)[None, :], 0x4641)
+    norms = np.linalg.norm(loadings, axis=1, keepdims=True)
+    return loadings / np.where(norms == 0, 1.0, norms)
+
+
+# ---------------------------------------------------------------------------
+# Models
+# ---------------------------------------------------------------------------
+
+def model_returns(model, params, noise, volatility, trend_bias, exaggeration,
+                  prices=None, anchors=None, stock_ids=None):
+    """
+    Log returns for one tick, one per symbol.
+
+    :param prices: current prices (mean_reversion)
+    :param anchors: long-run anchor prices (mean_reversion)
+    :param stock_ids: stock ids (multi_factor loadings)
+    """
+    sigma = volatility * exaggeration
+
+    if model == "multi_factor":
+        k = max(1, int(params["factors"]))
+        share = min(max(float(params["factor_share"]), 0.0), 1.0)
+        systematic = factor_loadings(stock_ids, k) @ noise.common_normal(k)
+        shocks = np.sqrt(share) * systematic + np.sqrt(1.0 - share) * noise.normal()
+        return trend_bias + sigma * shocks
+
+    returns = trend_bias + sigma * noise.normal()
+
+    if model == "mean_reversion" and anchors is not None:
+        speed = float(params["reversion_speed"])
+        returns += speed * (np.log(anchors) - np.log(prices))
+
+    elif model == "jump_diffusion":
+        # P(at least one jump this tick) for a Poisson process with the given rate
+        jump_prob = 1.0 - np.exp(-float(params["jump_intensity"]))
+        jumped = noise.uniform() < jump_prob
+        sizes = float(params["jump_mean"]) + float(params["jump_std"]) * noise.normal()
+        returns += np.where(jumped, sizes * exaggeration, 0.0)
+
+    return returns
+
+
+def advance_prices(prices, model="gbm", params=None, volatility=0.01, trend_bias=0.0,
+                   exaggeration=1.0, noise=None, anchors=None, stock_ids=None):
+    """
+    Advances every price by one tick.
+
+    :param prices: array of current prices
+    :param model: one of MODELS
+    :param params: model parameters (defaults from DEFAULT_MODEL_PARAMS)
+    :param noise: noise source; a fresh RandomNoise when omitted
+    :param anchors: anchor prices for mean_reversion (defaults to the current prices)
+    :param stock_ids: stock ids, required by multi_factor
+    :return: array of new prices, rounded to cents and floored at MIN_PRICE
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    if params is None:
+        params = DEFAULT_MODEL_PARAMS.get(model, {})
+    if noise is None:
+        noise = RandomNoise(len(prices))
+    if anchors is None:
+        anchors = prices
+    if stock_ids is None:
+        stock_ids = np.arange(len(prices))
+
+    returns = model_returns(
+        model, params, noise, volatility, trend_bias, exaggeration,
+        prices=prices, anchors=np.asarray(anchors, dtype=np.float64), stock_ids=stock_ids
+    )
+    new_prices = np.round(prices * np.exp(returns), 2)
+    return np.maximum(new_prices, MIN_PRICE)
+
+
+# ---------------------------------------------------------------------------
+# Sharded execution
+# ---------------------------------------------------------------------------
+
+def advance_shard(task):
+    """
+    Pool worker: advances one shard of the universe using per-symbol streams.
+
+    :param task: (stock_ids, prices, anchors, options) where options holds
+                 seed, tick and the advance_prices keyword arguments
+    """
+    stock_ids, prices, anchors, options = task
+    options = dict(options)
+    noise = SymbolStreams(options.pop("seed"), stock_ids, options.pop("tick"))
+    return advance_prices(prices, noise=noise, anchors=anchors, stock_ids=stock_ids, **options)
+
+
+def advance_prices_sharded(stock_ids, prices, anchors, seed, tick, pool=None, shards=1, **options):
+    """
+    Advances every price by one tick, split into `shards` pieces run on `pool`.
+
+    Results come back to the caller (the single DB writer) in input order and
+    are identical for any number of shards.
+    """
+    stock_ids = np.asarray(stock_ids, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.float64)
+    anchors = np.asarray(anchors, dtype=np.float64)
+    options = dict(options, seed=seed, tick=tick)
+
+    if pool is None or shards <= 1 or len(stock_ids) < 2:
+        return advance_shard((stock_ids, prices, anchors, options))
+
+    tasks = [
+        (ids, p, a, options)
+        for ids, p, a in zip(
+            np.array_split(stock_ids, shards),
+            np.array_split(prices, shards),
+            np.array_split(anchors, shards),
+        )
+        if len(ids)
+    ]
+    return np.concatenate(pool.map(advance_shard, tasks))
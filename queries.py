@@ -0,0 +1,149 @@
+"""
+SQL of app.py's hot queries.
+
+They are kept here instead of inline so that the query plan check
+(python migrations.py --check, see HOT_QUERIES there) explains exactly the
+statements app.py runs.
+"""
+
+# ----- dashboard -----
+
+DASHBOARD_QUOTES_SQL = """
+    SELECT s.stock_id, s.symbol, s.company_name,
+           COALESCE(q.price, s.price) AS latest_price,
+           COALESCE(q.previous_price, q.price, s.price) AS previous_price
+    FROM stocks s
+    LEFT JOIN quotes q ON q.stock_id = s.stock_id
+    ORDER BY s.symbol
+"""
+
+DASHBOARD_PORTFOLIO_SQL = """
+    SELECT p.stock_id, s.symbol, s.company_name,
+           p.quantity, p.avg_cost, p.total_invested
+    FROM portfolio p
+    JOIN stocks s ON p.stock_id = s.stock_id
+    WHERE p.user_id = ? AND p.quantity > 0
+    ORDER BY s.symbol
+"""
+
+EQUITY_CHART_SQL = """
+    SELECT bucket, holdings_value
+    FROM equity_snapshots
+    WHERE user_id = ?
+    ORDER BY bucket DESC
+    LIMIT ?
+"""
+
+TRANSACTION_COUNT_SQL = "SELECT COUNT(*) FROM transaction_history WHERE user_id = ?"
+
+TRANSACTION_PAGE_SQL = """
+    SELECT th.*, s.symbol
+    FROM transaction_history th
+    JOIN stocks s ON th.stock_id = s.stock_id
+    WHERE th.user_id = ?
+    ORDER BY th.timestamp DESC
+    LIMIT ? OFFSET ?
+"""
+
+OPEN_LIMIT_ORDERS_SQL = """
+    SELECT lo.*, s.symbol
+    FROM limit_orders lo
+    JOIN stocks s ON s.stock_id = lo.stock_id
+    WHERE lo.user_id = ? AND lo.status = 'open'
+    ORDER BY lo.order_id DESC
+"""
+
+OPEN_TRIGGERS_SQL = """
+    SELECT t.*, s.symbol
+    FROM trigger_orders t
+    JOIN stocks s ON s.stock_id = t.stock_id
+    WHERE t.user_id = ? AND t.status = 'open'
+    ORDER BY t.trigger_id DESC
+"""
+
+# ----- price history API -----
+
+HISTORY_CURSOR_SQL = "SELECT timestamp FROM price_history WHERE id = ? AND stock_id = ?"
+
+HISTORY_RANGE_SQL = """
+    SELECT id, price, timestamp
+    FROM price_history
+    WHERE stock_id = ? AND timestamp >= ? AND timestamp < ?
+      AND (timestamp > ? OR id > ?)
+    ORDER BY timestamp ASC
+"""
+
+# ----- trades -----
+
+POSITION_QUANTITY_SQL = "SELECT quantity FROM portfolio WHERE user_id = ? AND stock_id = ?"
+
+OPEN_SELL_QUANTITY_SQL = """
+    SELECT COALESCE(SUM(quantity - filled), 0) FROM limit_orders
+    WHERE user_id = ? AND status = 'open' AND stock_id = ? AND side = 'SELL'
+"""
+
+USER_EQUITY_SNAPSHOT_SQL = """
+    INSERT INTO equity_snapshots (user_id, bucket, holdings_value)
+    SELECT ?, ?, COALESCE(SUM(p.quantity * COALESCE(q.price, s.price)), 0)
+    FROM portfolio p
+    JOIN stocks s ON s.stock_id = p.stock_id
+    LEFT JOIN quotes q ON q.stock_id = p.stock_id
+    WHERE p.user_id = ? AND p.quantity > 0
+    ON CONFLICT(user_id, bucket) DO UPDATE SET holdings_value = excluded.holdings_value
+"""
+
+# ----- archive loop -----
+
+PRUNE_EQUITY_SNAPSHOTS_SQL = "DELETE FROM equity_snapshots WHERE bucket < ?"
+
+# ----- generator tick -----
+
+EQUITY_SNAPSHOTS_SQL = """
+    INSERT INTO equity_snapshots (user_id, bucket, holdings_value)
+    SELECT p.user_id, ?, SUM(p.quantity * COALESCE(q.price, s.price))
+    FROM portfolio p
+    JOIN stocks s ON s.stock_id = p.stock_id
+    LEFT JOIN quotes q ON q.stock_id = p.stock_id
+    WHERE p.quantity > 0
+    GROUP BY p.user_id
+    ON CONFLICT(user_id, bucket) DO UPDATE SET holdings_value = excluded.holdings_value
+"""
+
+NEW_LIMIT_ORDERS_SQL = "SELECT * FROM limit_orders WHERE order_id > ? AND status = 'open' ORDER BY order_id"
+
+LIMIT_ORDER_SQL = "SELECT * FROM limit_orders WHERE order_id = ?"
+
+NEW_TRIGGERS_SQL = "SELECT * FROM trigger_orders WHERE trigger_id > ? AND status = 'open' ORDER BY trigger_id"
+
+# the fired trigger ids are passed as one JSON array
+FIRED_TRIGGERS_SQL = """
+    SELECT t.*, s.symbol FROM trigger_orders t
+    JOIN stocks s ON s.stock_id = t.stock_id
+    WHERE t.trigger_id IN (SELECT value FROM json_each(?)) AND t.status = 'open'
+    ORDER BY t.trigger_id
+"""
+
+FIRED_POSITIONS_SQL = """
+    SELECT p.user_id, p.stock_id, p.quantity, p.avg_cost FROM portfolio p
+    JOIN (SELECT DISTINCT user_id, stock_id FROM trigger_orders
+          WHERE trigger_id IN (SELECT value FROM json_each(?))) t
+      ON t.user_id = p.user_id AND t.stock_id = p.stock_id
+"""
+
+FIRED_BALANCES_SQL = """
+    SELECT user_id, balance FROM users WHERE user_id IN (
+        SELECT user_id FROM trigger_orders WHERE trigger_id IN (SELECT value FROM json_each(?)))
+"""
+
+LAST_TRANSACTION_SQL = "SELECT COALESCE(MAX(transaction_id), 0) FROM transaction_history"
+
+# users with fills after a transaction_id (this tick's limit fills and triggers)
+TICK_TRADERS_SQL = "SELECT DISTINCT user_id FROM transaction_history WHERE transaction_id > ?"
+
+LAST_TICK_SQL = "SELECT MAX(updated_at) FROM quotes"
+
+# ----- admin logs ({where} is "" or " WHERE type IN (...)") -----
+
+LOGS_COUNT_SQL = "SELECT COUNT(*) FROM logs{where}"
+
+LOGS_PAGE_SQL = "SELECT * FROM logs{where} ORDER BY timestamp DESC LIMIT ? OFFSET ?"
@@ -0,0 +1,157 @@
+"""
+Quote fan-out from the generator to every web worker process.
+
+The generator publishes each tick's quote changes once, as one row of the
+quote_feed table, in the tick's own transaction. Every process keeps an
+in-memory quote map and a cursor into the feed; when the tick version file
+changes (see tick_version.py) it reads just the feed rows after its cursor
+and applies them. Quote endpoints and the SSE stream serve from the map, so
+between ticks they never touch the database.
+
+A "reset" row (admin edits, bulk loads) or a cursor that fell behind the
+pruned feed makes a process reload the whole map instead.
+"""
+
+import json
+from collections import deque
+from threading import Lock
+
+import tick_version
+
+
+# feed rows kept; a process further behind than this reloads everything
+FEED_KEEP = 1000
+
+state = {
+    "quotes": {},     # stock_id -> quote dict in the /api/prices format
+    "order": [],      # stock ids sorted by symbol
+    "snapshot": [],   # quotes in that order, rebuilt when anything changed
+    "cursor": None,   # last applied quote_feed seq (None: not loaded yet)
+    "version": None,  # tick version the map was last refreshed at
+    "history": deque(maxlen=FEED_KEEP),  # (seq, changed stock ids) of applied feed rows
+    "base": 0,        # oldest cursor the history can answer quotes_since() for
+}
+lock = Lock()
+
+
+def publish(conn, changes=None, tick_id=None):
+    """
+    Publishes quote changes. Runs inside the caller's transaction.
+
+    :param changes: list of (stock_id, price, change), or None for a reset
+                    (every process reloads all quotes)
+    :param tick_id: tick the changes belong to
+    """
+    cur = conn.execute(
+        "INSERT INTO quote_feed (kind, tick_id, payload) VALUES (?, ?, ?)",
+        ("reset" if changes is None else "tick", tick_id,
+         json.dumps(changes) if changes is not None else None)
+    )
+    conn.execute("DELETE FROM quote_feed WHERE seq <= ?", (cur.lastrowid - FEED_KEEP,))
+
+
+RELOAD_SQL = '''
+    SELECT s.stock_id, s.symbol, s.company_name,
+           COALESCE(q.price, s.price) AS price,
+           q.change AS last_change
+    FROM stocks s
+    LEFT JOIN quotes q ON q.stock_id = s.stock_id
+    ORDER BY s.symbol
+'''
+
+FEED_AFTER_SQL = "SELECT seq, kind, payload FROM quote_feed WHERE seq > ? ORDER BY seq"
+
+
+def _reload(conn):
+    rows = conn.execute(RELOAD_SQL).fetchall()
+    state["cursor"] = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM quote_feed").fetchone()[0]
+    state["quotes"] = {
+        row["stock_id"]: {
+            "stock_id": row["stock_id"],
+            "symbol": row["symbol"],
+            "company_name": row["company_name"],
+            "price": row["price"],
+            "last_change": row["last_change"] or 0
+        }
+        for row in rows
+    }
+    state["order"] = [row["stock_id"] for row in rows]
+    state["history"].clear()
+    state["base"] = state["cursor"]
+
+
+def refresh(db_name, connect):
+    """
+    Brings the quote map up to date.
+
+    :param db_name: database file (its tick version says whether anything changed)
+    :param connect: returns a new sqlite3 connection (with Row factory); only
+                    called when the tick version changed
+    :return: the quotes that changed, in the /api/prices format (all of them
+             after a reload), or [] if nothing changed
+    """
+    with lock:
+        version = tick_version.read(db_name)
+        if version == state["version"] and state["cursor"] is not None:
+            return []
+
+        conn = connect()
+        try:
+            if state["cursor"] is None:
+                _reload(conn)
+                changed = None
+            else:
+                rows = conn.execute(FEED_AFTER_SQL, (state["cursor"],)).fetchall()
+                if rows and (rows[0]["seq"] > state["cursor"] + 1
+                             or any(row["kind"] == "reset" for row in rows)):
+                    _reload(conn)
+                    changed = None
+                else:
+                    changed = {}
+                    for row in rows:
+                        ids = []
+                        for stock_id, price, change in json.loads(row["payload"]):
+                            quote = state["quotes"].get(stock_id)
+                            if quote is not None:
+                                quote["price"] = price
+                                quote["last_change"] = change or 0
+                                changed[stock_id] = quote
+                                ids.append(stock_id)
+                        history = state["history"]
+                        if len(history) == history.maxlen:
+                            state["base"] = history[0][0]  # about to be dropped
+                        history.append((row["seq"], ids))
+                        state["cursor"] = row["seq"]
+        finally:
+            conn.close()
+        state["version"] = version
+
+        if changed is None or changed:
+            state["snapshot"] = [dict(state["quotes"][sid]) for sid in state["order"]]
+        if changed is None:
+            return list(state["snapshot"])
+        return [dict(changed[sid]) for sid in state["order"] if sid in changed]
+
+
+def snapshot():
+    """Every quote in the /api/prices format, sorted by symbol (as of the last refresh)."""
+    with lock:
+        return state["snapshot"]
+
+
+def quotes_since(since=None):
+    """
+    Quotes changed after feed position `since` (as of the last refresh).
+
+    :return: (current position, full, quotes) where full is True if every
+             quote is returned because `since` is None or too old to answer
+    """
+    with lock:
+        cursor = state["cursor"] or 0
+        if since is None or since < state["base"] or since > cursor:
+            return cursor, True, state["snapshot"]
+        ids = set()
+        for seq, changed in state["history"]:
+            if seq > since:
+                ids.update(changed)
+        return cursor, False, [q for q in state["snapshot"] if q["stock_id"] in ids]
@@ -0,0 +1,99 @@
+"""
+Wire formats of the quotes API (/api/prices).
+
+- "objects" (default): a list of {stock_id, symbol, company_name, price,
+  last_change} dicts, as the dashboard has always used.
+- "columnar": {"version", "full", "ids", "prices", "changes"} plus "symbols"
+  and "names" in full responses only. Key names are sent once, and deltas
+  (?since=<version>) leave out the static fields.
+- "binary": a packed little-endian struct. Prices and changes are int32
+  cents, which is exact for generator prices:
+
+      header   4s  magic b"EQQ1"
+               B   flags (1 = full snapshot)
+               I   count
+               Q   version
+      body     int32[count] stock ids, int32[count] price cents,
+               int32[count] change cents
+
+  Static fields are not included; fetch them once with the columnar format.
+"""
+
+import struct
+
+import numpy as np
+import orjson
+
+
+FORMATS = ("objects", "columnar", "binary")
+
+MIME_TYPES = {
+    "objects": "application/json",
+    "columnar": "application/vnd.equisense.quotes+json",
+    "binary": "application/vnd.equisense.quotes",
+}
+
+BINARY_MAGIC = b"EQQ1"
+BINARY_HEADER = struct.Struct("<4sBIQ")
+
+
+def negotiate(requested, accept_header):
+    """
+    Picks a format from ?format= or, failing that, the Accept header.
+    Returns None for an unknown ?format= value.
+    """
+    if requested:
+        return requested if requested in FORMATS else None
+    for fmt in ("binary", "columnar"):
+        if MIME_TYPES[fmt] in (accept_header or ""):
+            return fmt
+    return "objects"
+
+
+def encode_objects(quotes):
+    return orjson.dumps(quotes)
+
+
+def encode_columnar(quotes, version, full):
+    body = {
+        "version": version,
+        "full": full,
+        "ids": [q["stock_id"] for q in quotes],
+        "prices": [q["price"] for q in quotes],
+        "changes": [q["last_change"] for q in quotes],
+    }
+    if full:
+        body["symbols"] = [q["symbol"] for q in quotes]
+        body["names"] = [q["company_name"] for q in quotes]
+    return orjson.dumps(body)
+
+
+def encode_binary(quotes, version, full):
+    count = len(quotes)
+    ids = np.fromiter((q["stock_id"] for q in quotes), dtype="<i4", count=count)
+    prices = np.fromiter((q["price"] for q in quotes), dtype=np.float64, count=count)
+    changes = np.fromiter((q["last_change"] for q in quotes), dtype=np.float64, count=count)
+    return b"".join((
+        BINARY_HEADER.pack(BINARY_MAGIC, 1 if full else 0, count, version),
+        ids.tobytes(),
+        np.round(prices * 100).astype("<i4").tobytes(),
+        np.round(changes * 100).astype("<i4").tobytes(),
+    ))
+
+
+def decode_binary(data):
+    """Inverse of encode_binary: (version, full, ids, prices, changes)."""
+    magic, flags, count, version = BINARY_HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC:
+        raise ValueError("not a binary quotes payload")
+    columns = np.frombuffer(data, dtype="<i4", offset=BINARY_HEADER.size, count=3 * count)
+    ids, price_cents, change_cents = columns.reshape(3, count)
+    return version, bool(flags & 1), ids, price_cents / 100, change_cents / 100
+
+
+def encode(fmt, quotes, version, full=True):
+    if fmt == "columnar":
+        return encode_columnar(quotes, version, full)
+    if fmt == "binary":
+        return encode_binary(quotes, version, full)
+    return encode_objects(quotes)
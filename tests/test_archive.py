@@ -0,0 +1,25 @@
+import numpy as np
+
+import archive
+
+
+def test_chunk_round_trip_cents():
+    epochs = np.array([1700000000, 1700000060, 1700000120, 1700000300])
+    prices = np.array([101.25, 101.3, 99.99, 100.0])
+    data = archive.encode_chunk(epochs, prices)
+    assert archive.HEADER.unpack_from(data) == (archive.CENTS, 4)
+
+    decoded_epochs, decoded_prices = archive.decode_chunk(data)
+    assert decoded_epochs.tolist() == epochs.tolist()
+    assert decoded_prices.tolist() == prices.tolist()
+
+
+def test_chunk_round_trip_floats():
+    epochs = np.array([1700000000, 1700000001])
+    prices = np.array([1 / 3, 2.0005])
+    data = archive.encode_chunk(epochs, prices)
+    assert archive.HEADER.unpack_from(data) == (archive.FLOATS, 2)
+
+    decoded_epochs, decoded_prices = archive.decode_chunk(data)
+    assert decoded_epochs.tolist() == epochs.tolist()
+    assert decoded_prices.tolist() == prices.tolist()
@@ -0,0 +1,51 @@
+from order_book import BUY, SELL, OrderBook
+
+
+def test_price_time_priority():
+    book = OrderBook()
+    book.add(1, 10, BUY, 100.0, 5)
+    book.add(2, 11, BUY, 101.0, 5)
+    book.add(3, 12, BUY, 101.0, 5)
+    book.add(4, 13, SELL, 103.0, 5)
+    book.add(5, 14, SELL, 102.0, 5)
+    assert book.best_bid()["order_id"] == 2
+    assert book.best_ask()["order_id"] == 5
+    assert book.crossed_pair() is None
+
+
+def test_cancel_and_reduce():
+    book = OrderBook()
+    book.add(1, 10, BUY, 101.0, 5)
+    book.add(2, 11, BUY, 100.0, 5)
+    assert book.cancel(1)["order_id"] == 1
+    assert book.cancel(1) is None
+    assert book.best_bid()["order_id"] == 2
+
+    book.reduce(2, 3)
+    assert book.best_bid()["remaining"] == 2
+    book.reduce(2, 2)
+    assert book.best_bid() is None
+    assert len(book) == 0
+
+
+def test_crossed_pair():
+    book = OrderBook()
+    book.add(1, 10, SELL, 100.0, 5)
+    book.add(2, 11, BUY, 100.5, 3)
+    bid, ask = book.crossed_pair()
+    assert (bid["order_id"], ask["order_id"]) == (2, 1)
+
+
+def test_crossing_with_price():
+    book = OrderBook()
+    book.add(1, 10, BUY, 101.0, 5)
+    book.add(2, 11, BUY, 99.0, 5)
+    book.add(3, 12, SELL, 98.0, 5)
+    book.add(4, 13, SELL, 100.5, 5)
+    crossing = book.crossing_with_price(100.0)
+    assert next(crossing)["order_id"] == 1
+    book.reduce(1, 5)
+    # an order left in place by the caller is skipped, not returned again
+    assert next(crossing)["order_id"] == 3
+    assert list(crossing) == []
+    assert book.best_ask()["order_id"] == 3
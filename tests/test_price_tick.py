@@ -0,0 +1,49 @@
+import importlib
+
+import pytest
+
+import migrations
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # app.DB_NAME is relative: run against a fresh database in tmp_path
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("EQUISENSE_GENERATOR", "off")
+    app = importlib.import_module("app")
+    migrations.migrate(app.DB_NAME)
+    monkeypatch.setitem(app.generator_lease, "enforce", False)
+    app.reset_limit_books()
+    app.reset_trigger_books()
+    yield app
+    app.reset_limit_books()
+    app.reset_trigger_books()
+
+
+def test_rolled_back_tick_rebuilds_the_books(app, monkeypatch):
+    conn = app.get_db_connection()
+    conn.execute("INSERT INTO users (user_id, username, email, password_hash) VALUES (1, 'u', 'u@x', 'x')")
+    conn.execute("INSERT INTO stocks (stock_id, symbol, company_name, price) VALUES (1, 'AAA', 'A', 9.0)")
+    conn.execute("INSERT INTO portfolio (user_id, stock_id, quantity, avg_cost, total_invested) "
+                 "VALUES (1, 1, 5, 8.0, 40.0)")
+    conn.execute("INSERT INTO limit_orders (user_id, stock_id, side, quantity, limit_price) "
+                 "VALUES (1, 1, 'SELL', 5, 10.0)")
+    conn.commit()
+
+    def fail(*args):
+        raise RuntimeError("snapshot failed")
+
+    # the order fills in the books, then the tick fails and rolls back
+    with monkeypatch.context() as m:
+        m.setattr(app, "record_equity_snapshots", fail)
+        with pytest.raises(RuntimeError):
+            app.write_price_tick([(1, 12.0)], "2030-01-02 15:00:00")
+    assert tuple(conn.execute("SELECT status, filled FROM limit_orders").fetchone()) == ("open", 0)
+    assert app.limit_books == {} and app.limit_book_state["cursor"] == 0
+
+    assert app.write_price_tick([(1, 12.0)], "2030-01-02 15:01:00")
+    assert tuple(conn.execute("SELECT status, filled FROM limit_orders").fetchone()) == ("filled", 5)
+    assert conn.execute("SELECT COUNT(*) FROM portfolio").fetchone()[0] == 0
+    # sold out by the fill: the tick still records the empty holdings
+    assert conn.execute("SELECT holdings_value FROM equity_snapshots").fetchone()[0] == 0
+    conn.close()
@@ -0,0 +1,7 @@
+import migrations
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    db_name = str(tmp_path / "stock_trading.db")
+    assert migrations.migrate(db_name) == migrations.LATEST_VERSION
+    assert migrations.check_query_plans(db_name) == []
@@ -0,0 +1,23 @@
+import pytest
+
+import quote_codec
+
+
+QUOTES = [
+    {"stock_id": 1, "symbol": "AAPL", "company_name": "Apple", "price": 176.04, "last_change": -1.25},
+    {"stock_id": 7, "symbol": "MSFT", "company_name": "Microsoft", "price": 0.01, "last_change": 0.0},
+]
+
+
+def test_binary_round_trip():
+    data = quote_codec.encode("binary", QUOTES, 1234567890123, full=False)
+    version, full, ids, prices, changes = quote_codec.decode_binary(data)
+    assert (version, full) == (1234567890123, False)
+    assert ids.tolist() == [1, 7]
+    assert prices.tolist() == [176.04, 0.01]
+    assert changes.tolist() == [-1.25, 0.0]
+
+
+def test_binary_rejects_other_payloads():
+    with pytest.raises(ValueError):
+        quote_codec.decode_binary(b"XXXX" + bytes(quote_codec.BINARY_HEADER.size))
@@ -0,0 +1,51 @@
+import sqlite3
+
+import pytest
+
+import trade_executor
+
+
+def insert(conn, value):
+    conn.execute("INSERT INTO t (value) VALUES (?)", (value,))
+    return value
+
+
+def insert_and_fail(conn, value):
+    insert(conn, value)
+    raise ValueError("rejected")
+
+
+@pytest.fixture
+def db_name(tmp_path):
+    db_name = str(tmp_path / "jobs.db")
+    conn = sqlite3.connect(db_name)
+    conn.execute("CREATE TABLE t (value INTEGER)")
+    conn.commit()
+    conn.close()
+    return db_name
+
+
+def test_failed_job_rolls_back_to_its_savepoint(db_name):
+    conn = sqlite3.connect(db_name)
+    jobs = [trade_executor.Job(insert, (1,)),
+            trade_executor.Job(insert_and_fail, (2,)),
+            trade_executor.Job(insert, (3,))]
+    trade_executor._run_batch(conn, jobs)
+
+    assert [job.result for job in jobs] == [1, None, 3]
+    assert isinstance(jobs[1].error, ValueError)
+    assert [row[0] for row in conn.execute("SELECT value FROM t ORDER BY value")] == [1, 3]
+    assert not conn.in_transaction
+    conn.close()
+
+
+def test_submit_returns_result_or_raises(db_name, monkeypatch):
+    monkeypatch.setitem(trade_executor.state, "connect", lambda: sqlite3.connect(db_name))
+    monkeypatch.setitem(trade_executor.state, "conn", None)
+    assert trade_executor.submit(insert, 1) == 1
+    with pytest.raises(ValueError):
+        trade_executor.submit(insert_and_fail, 2)
+
+    conn = sqlite3.connect(db_name)
+    assert [row[0] for row in conn.execute("SELECT value FROM t")] == [1]
+    conn.close()
@@ -0,0 +1,32 @@
+from triggers import STOP_LOSS, TAKE_PROFIT, TriggerBook, fires
+
+
+def test_pop_fired():
+    book = TriggerBook()
+    book.add(1, STOP_LOSS, 95.0)
+    book.add(2, STOP_LOSS, 90.0)
+    book.add(3, TAKE_PROFIT, 110.0)
+    book.add(4, TAKE_PROFIT, 120.0)
+    assert book.pop_fired(100.0) == []
+    assert sorted(book.pop_fired(95.0)) == [1]
+    assert sorted(book.pop_fired(115.0)) == [3]
+    assert len(book) == 2
+    assert sorted(book.pop_fired(80.0)) == [2]
+    assert sorted(book.pop_fired(120.0)) == [4]
+    assert len(book) == 0
+
+
+def test_remove():
+    book = TriggerBook()
+    book.add(1, STOP_LOSS, 95.0)
+    book.add(2, TAKE_PROFIT, 110.0)
+    assert book.remove(1, STOP_LOSS, 95.0)
+    assert not book.remove(1, STOP_LOSS, 95.0)
+    assert not book.remove(2, TAKE_PROFIT, 111.0)
+    assert book.pop_fired(50.0) == []
+    assert book.pop_fired(110.0) == [2]
+
+
+def test_fires():
+    assert fires(STOP_LOSS, 95.0, 95.0) and not fires(STOP_LOSS, 95.0, 95.01)
+    assert fires(TAKE_PROFIT, 110.0, 110.0) and not fires(TAKE_PROFIT, 110.0, 109.99)
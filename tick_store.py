@@ -0,0 +1,200 @@
+"""
+Memory-mapped columnar tick store, an alternative to the price_history table.
+
+Every stock gets two append-only files in the store directory:
+
+    <stock_id>.ts   int64 unix seconds (UTC), ascending
+    <stock_id>.px   float64 prices
+
+Readers map them with numpy.memmap and binary-search the timestamps, so a
+range read is a zero-copy slice instead of a query that builds a Row per
+tick. Row numbers in the files serve as since_id cursors.
+
+Enabled with EQUISENSE_TICK_STORE=memmap (default "sqlite" keeps using
+price_history). The directory defaults to stock_trading_ticks next to the
+database (EQUISENSE_TICK_STORE_DIR overrides it). Convert existing history
+with:
+
+    python tick_store.py --convert
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+import archive
+import candles
+
+
+DB_NAME = 'stock_trading.db'
+
+BACKEND = os.environ.get("EQUISENSE_TICK_STORE", "sqlite")
+STORE_DIR = os.environ.get(
+    "EQUISENSE_TICK_STORE_DIR",
+    os.path.splitext(DB_NAME)[0] + "_ticks"
+)
+
+TS_DTYPE = np.dtype("<i8")
+PX_DTYPE = np.dtype("<f8")
+
+
+def enabled():
+    """True if ticks are stored here instead of in price_history."""
+    return BACKEND == "memmap"
+
+
+def paths(stock_id, directory=None):
+    directory = directory or STORE_DIR
+    return (os.path.join(directory, f"{stock_id}.ts"),
+            os.path.join(directory, f"{stock_id}.px"))
+
+
+def _rows_on_disk(ts_path, px_path):
+    """Complete rows in a pair of files (a crash mid-append can leave them uneven)."""
+    try:
+        return min(os.path.getsize(ts_path) // TS_DTYPE.itemsize,
+                   os.path.getsize(px_path) // PX_DTYPE.itemsize)
+    except FileNotFoundError:
+        return 0
+
+
+def append(stock_ids, epochs, prices, directory=None):
+    """
+    Appends ticks to the per-stock files.
+
+    :param stock_ids: stock id of every tick
+    :param epochs: unix seconds of every tick, ascending per stock
+    :param prices: price of every tick
+    """
+    directory = directory or STORE_DIR
+    os.makedirs(directory, exist_ok=True)
+    stock_ids = np.asarray(stock_ids, dtype=np.int64)
+    epochs = np.asarray(epochs, dtype=TS_DTYPE)
+    prices = np.asarray(prices, dtype=PX_DTYPE)
+
+    # group by stock, keeping the time order within each stock
+    order = np.argsort(stock_ids, kind="stable")
+    stock_ids, epochs, prices = stock_ids[order], epochs[order], prices[order]
+    boundaries = np.flatnonzero(np.diff(stock_ids)) + 1
+    for lo, hi in zip(np.r_[0, boundaries], np.r_[boundaries, len(stock_ids)]):
+        ts_path, px_path = paths(int(stock_ids[lo]), directory)
+        rows = _rows_on_disk(ts_path, px_path)
+        for path, column in ((px_path, prices[lo:hi]), (ts_path, epochs[lo:hi])):
+            with open(path, "ab") as f:
+                # drop a partial row left by an interrupted append
+                f.truncate(rows * column.itemsize)
+                f.write(column.tobytes())
+
+
+_maps = {}  # (directory, stock_id) -> (rows, timestamps memmap, prices memmap)
+
+
+def columns(stock_id, directory=None):
+    """
+    (timestamps, prices) of one stock as read-only memmaps (empty arrays if none).
+    The maps are reused until the files grow.
+    """
+    directory = directory or STORE_DIR
+    ts_path, px_path = paths(stock_id, directory)
+    rows = _rows_on_disk(ts_path, px_path)
+    if rows == 0:
+        return np.empty(0, TS_DTYPE), np.empty(0, PX_DTYPE)
+
+    cached = _maps.get((directory, stock_id))
+    if cached and cached[0] == rows:
+        return cached[1], cached[2]
+    ts = np.memmap(ts_path, dtype=TS_DTYPE, mode="r", shape=(rows,))
+    px = np.memmap(px_path, dtype=PX_DTYPE, mode="r", shape=(rows,))
+    _maps[(directory, stock_id)] = (rows, ts, px)
+    return ts, px
+
+
+def last_epoch(stock_ids, directory=None):
+    """Latest timestamp stored for any of the stocks, or None if they have no ticks."""
+    latest = None
+    for stock_id in stock_ids:
+        ts, _ = columns(stock_id, directory)
+        if len(ts) and (latest is None or ts[-1] > latest):
+            latest = int(ts[-1])
+    return latest
+
+
+def read_range(stock_id, start=None, end=None, after_row=None, directory=None):
+    """
+    Ticks of one stock with start <= timestamp < end (unix seconds), as
+    zero-copy slices.
+
+    :param after_row: only rows after this row number (a since_id cursor)
+    :return: (first row number, timestamps, prices)
+    """
+    ts, px = columns(stock_id, directory)
+    lo = int(np.searchsorted(ts, start, "left")) if start is not None else 0
+    hi = int(np.searchsorted(ts, end, "left")) if end is not None else len(ts)
+    if after_row is not None:
+        lo = max(lo, after_row + 1)
+    hi = max(lo, hi)
+    return lo, ts[lo:hi], px[lo:hi]
+
+
+def convert(conn, directory=None, progress=print):
+    """
+    Writes the whole SQLite history (price_history plus the compressed
+    archive) into the tick store, replacing any files already there.
+    Returns the number of ticks written.
+    """
+    directory = directory or STORE_DIR
+    os.makedirs(directory, exist_ok=True)
+    total = 0
+    for (stock_id,) in conn.execute("SELECT stock_id FROM stocks ORDER BY stock_id").fetchall():
+        archived = archive.read_history(conn, stock_id)
+        floor_ts, floor_id = archive.hot_floor(conn, stock_id)
+        hot = conn.execute("""
+            SELECT timestamp, price FROM price_history
+            WHERE stock_id = ? AND timestamp >= ? AND (timestamp > ? OR id > ?)
+            ORDER BY timestamp, id
+        """, (stock_id, floor_ts, floor_ts, floor_id)).fetchall()
+        rows = archived + [tuple(row) for row in hot]
+
+        for path in paths(stock_id, directory):
+            if os.path.exists(path):
+                os.remove(path)
+        if rows:
+            append(
+                np.full(len(rows), stock_id),
+                [candles.to_epoch(ts) for ts, _ in rows],
+                [price for _, price in rows],
+                directory,
+            )
+        total += len(rows)
+        progress(f"stock {stock_id}: {len(rows)} ticks")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory-mapped columnar tick store tools.")
+    parser.add_argument("--convert", action="store_true",
+                        help="copy the SQLite price history into the tick store")
+    parser.add_argument("--db", default=DB_NAME, help=f"database file (default {DB_NAME})")
+    parser.add_argument("--dir", default=None,
+                        help="store directory (default: <db name>_ticks, or EQUISENSE_TICK_STORE_DIR)")
+    args = parser.parse_args()
+    if not args.convert:
+        parser.error("nothing to do (use --convert)")
+
+    directory = args.dir or os.environ.get("EQUISENSE_TICK_STORE_DIR",
+                                           os.path.splitext(args.db)[0] + "_ticks")
+    conn = sqlite3.connect(args.db)
+    try:
+        started = time.perf_counter()
+        ticks = convert(conn, directory)
+        print(f"Converted {ticks} ticks in {time.perf_counter() - started:.1f}s to {directory}/")
+        print("Start the app with EQUISENSE_TICK_STORE=memmap to use it.")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Data version shared by every process using the database.
+
+A small file next to the database (stock_trading.db -> stock_trading.db.tick)
+holds a number that increases whenever prices, history or the market schedule
+change: the generator bumps it after every tick, admin edits and bulk loads
+after their commits. Readers use it for ETags, so an unchanged answer is
+recognised with one stat() call instead of a query.
+
+Other versions can live in their own files: pass a different `name`
+(e.g. "config" -> stock_trading.db.config, see config_cache.py).
+"""
+
+import os
+import time
+
+
+def version_path(db_name, name="tick"):
+    return f"{db_name}.{name}"
+
+
+def bump(db_name, name="tick"):
+    """Advances the version (to at least the current time in microseconds) and returns it."""
+    path = version_path(db_name, name)
+    new_version = max(read(db_name, name) + 1, time.time_ns() // 1000)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(str(new_version))
+    os.replace(tmp_path, path)  # readers never see a half-written file
+    return new_version
+
+
+_memo = {}  # path -> (stat key, version)
+
+
+def read(db_name, name="tick"):
+    """Current version (0 if never bumped). Re-reads the file only when it changed."""
+    path = version_path(db_name, name)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return 0
+    key = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached = _memo.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    try:
+        with open(path) as f:
+            version = int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+    _memo[path] = (key, version)
+    return version
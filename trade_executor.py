@@ -0,0 +1,145 @@
+"""
+Single writer for trades (group commit).
+
+Request threads no longer open a connection and commit per trade. They hand
+a job - a function taking a connection - to the process's writer thread and
+wait. The writer takes every job queued (up to BATCH_MAX, waiting at most
+BATCH_WINDOW_MS for more after the first one), runs them in one BEGIN
+IMMEDIATE transaction with a savepoint per job and commits once. Each caller
+gets back its own job's return value, or its exception after that job's
+writes were rolled back to the savepoint; the other jobs in the batch are
+unaffected.
+
+One commit per batch instead of per trade, and one process-wide writer
+instead of many request threads queueing on SQLite's write lock, is what
+removes the "database is locked" stalls under concurrent traders.
+"""
+
+import os
+import queue
+import sqlite3
+import time
+from threading import Event, Lock, Thread, current_thread
+
+
+BATCH_MAX = int(os.environ.get("EQUISENSE_TRADE_BATCH_MAX", "64"))
+BATCH_WINDOW_MS = float(os.environ.get("EQUISENSE_TRADE_BATCH_MS", "2"))
+BEGIN_RETRIES = 10  # the generator or another process may hold the write lock
+
+state = {
+    "connect": None,  # returns a new sqlite3 connection for the writer
+    "queue": None,
+    "thread": None,
+    "pid": None,      # process that started the writer (forked workers start their own)
+    "conn": None,     # the writer's connection
+    "batches": 0,
+    "jobs": 0,
+}
+lock = Lock()
+
+
+class Job:
+    __slots__ = ("fn", "args", "done", "result", "error")
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+def start(connect):
+    """
+    Sets the writer's connection factory. The thread itself starts on the
+    first submit() in each process.
+    """
+    state["connect"] = connect
+
+
+def _ensure_writer():
+    with lock:
+        if state["pid"] == os.getpid() and state["thread"].is_alive():
+            return
+        state["queue"] = queue.Queue()
+        state["pid"] = os.getpid()
+        state["thread"] = Thread(target=_writer_loop, args=(state["queue"],),
+                                 name="trade-writer", daemon=True)
+        state["thread"].start()
+
+
+def submit(fn, *args):
+    """
+    Runs fn(conn, *args) in the writer's next batch and waits for its commit.
+
+    :return: what fn returned
+    :raises: whatever fn raised (its writes are rolled back), or the
+             sqlite3 error that made the whole batch fail
+    """
+    if current_thread() is state["thread"]:
+        # a job submitting another job: run it inside the current batch
+        return fn(state["conn"], *args)
+    _ensure_writer()
+    job = Job(fn, args)
+    state["queue"].put(job)
+    job.done.wait()
+    if job.error is not None:
+        raise job.error
+    return job.result
+
+
+def _collect(q):
+    jobs = [q.get()]
+    deadline = time.monotonic() + BATCH_WINDOW_MS / 1000
+    while len(jobs) < BATCH_MAX:
+        remaining = deadline - time.monotonic()
+        try:
+            jobs.append(q.get(timeout=remaining) if remaining > 0 else q.get_nowait())
+        except queue.Empty:
+            break
+    return jobs
+
+
+def _run_batch(conn, jobs):
+    for attempt in range(BEGIN_RETRIES):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            break
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e).lower() or attempt == BEGIN_RETRIES - 1:
+                raise
+            time.sleep(0.05)
+
+    try:
+        for job in jobs:
+            conn.execute("SAVEPOINT trade_job")
+            try:
+                job.result = job.fn(conn, *job.args)
+            except Exception as e:
+                conn.execute("ROLLBACK TO trade_job")
+                job.error = e
+            conn.execute("RELEASE trade_job")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _writer_loop(q):
+    while True:
+        jobs = _collect(q)
+        try:
+            if state["conn"] is None:
+                state["conn"] = state["connect"]()
+            _run_batch(state["conn"], jobs)
+            state["batches"] += 1
+            state["jobs"] += len(jobs)
+        except Exception as e:
+            print(f"Trade writer: batch of {len(jobs)} failed: {e}")
+            for job in jobs:
+                job.result, job.error = None, e
+            if state["conn"] is not None:
+                state["conn"].close()
+                state["conn"] = None  # reconnect for the next batch
+        for job in jobs:
+            job.done.set()
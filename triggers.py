@@ -0,0 +1,69 @@
+"""
+Stop-loss and take-profit triggers, indexed by trigger price.
+
+A stop-loss sells when the price falls to its trigger price or below, a
+take-profit when the price rises to it or above. One TriggerBook per stock
+keeps each kind in a sorted list of (key, trigger_id), ordered so that the
+triggers a price fires always form a suffix of the list:
+
+- stops are keyed by trigger price: price p fires every stop with trigger >= p
+- take-profits are keyed by -trigger price: p fires every one with trigger <= p
+
+Anything beyond the previous price already fired on an earlier tick, so the
+suffix is exactly the triggers between the old and the new price. Finding it
+is one bisect and removing it is one slice, so a tick costs O(log n) per
+stock plus the triggers that actually fire.
+
+The books hold no positions or money; the caller settles what fires (see
+fire_triggers in app.py). The trigger_orders table is the source of truth
+and the books are rebuilt from it.
+"""
+
+from bisect import bisect_left, insort
+
+
+STOP_LOSS = "stop_loss"
+TAKE_PROFIT = "take_profit"
+KINDS = (STOP_LOSS, TAKE_PROFIT)
+
+
+def fires(kind, trigger_price, price):
+    """True if a trigger of this kind fires at `price`."""
+    return price <= trigger_price if kind == STOP_LOSS else price >= trigger_price
+
+
+class TriggerBook:
+
+    def __init__(self):
+        self.stops = []  # (trigger_price, trigger_id)
+        self.takes = []  # (-trigger_price, trigger_id)
+
+    def __len__(self):
+        return len(self.stops) + len(self.takes)
+
+    def _entry(self, kind, trigger_price, trigger_id):
+        if kind == STOP_LOSS:
+            return self.stops, (trigger_price, trigger_id)
+        return self.takes, (-trigger_price, trigger_id)
+
+    def add(self, trigger_id, kind, trigger_price):
+        keys, entry = self._entry(kind, trigger_price, trigger_id)
+        insort(keys, entry)
+
+    def remove(self, trigger_id, kind, trigger_price):
+        """Removes a trigger. Returns False if it was not in the book."""
+        keys, entry = self._entry(kind, trigger_price, trigger_id)
+        i = bisect_left(keys, entry)
+        if i < len(keys) and keys[i] == entry:
+            del keys[i]
+            return True
+        return False
+
+    def pop_fired(self, price):
+        """Removes and returns the ids of every trigger `price` fires."""
+        fired = []
+        for keys, key in ((self.stops, price), (self.takes, -price)):
+            i = bisect_left(keys, (key,))
+            fired.extend(trigger_id for _, trigger_id in keys[i:])
+            del keys[i:]
+        return fired